@@ -7,18 +7,38 @@ Integrates top 5 tools for each category + AI analysis
 import os
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 import logging
-from datetime import datetime
-from flask import Flask, request, jsonify, render_template
+import uuid
+import random
+from datetime import datetime, timedelta
+from flask import Flask, Request, request, jsonify, render_template, Response, stream_with_context
 from flask_cors import CORS
 import threading
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout, wait
 import time
 import base64
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 import io
 import hashlib
+import zlib
+import ipaddress
+import itertools
+from collections import OrderedDict, deque
+import socket
+import email.utils
+import sqlite3
+import struct
+import urllib.parse
+import importlib.util
+import re
+import cProfile
+import tracemalloc
 import tempfile
 import shutil
+import mmap
 import numpy as np
 
 # Configure logging
@@ -36,6 +56,12 @@ CORS(app)
 def not_found(error):
     return jsonify({"error": "Endpoint not found", "status": 404}), 404
 
+@app.errorhandler(413)
+def upload_too_large(error):
+    limit = request.max_content_length
+    message = f"Upload exceeds this endpoint's limit of {limit} bytes" if limit else "Upload too large"
+    return jsonify({"error": message, "status": 413}), 413
+
 @app.errorhandler(500)
 def internal_error(error):
     logger.error(f"Internal server error: {error}")
@@ -46,6 +72,1806 @@ def handle_exception(e):
     logger.error(f"Unhandled exception: {str(e)}")
     return jsonify({"error": "An unexpected error occurred", "status": 500}), 500
 
+# Per-provider HTTP settings. Any value can be overridden from the environment
+# as <PROVIDER>_<SETTING>, e.g. SHODAN_READ_TIMEOUT=30 or OPENAI_POOL_MAXSIZE=20
+DEFAULT_PROVIDER_SETTINGS = {
+    'pool_connections': 2,
+    'pool_maxsize': 10,
+    # Retries after a failed attempt, with exponential backoff from
+    # retry_backoff seconds up to retry_backoff_max, fully jittered
+    'retries': 2,
+    'retry_backoff': 0.5,
+    'retry_backoff_max': 8.0,
+    'connect_timeout': 3.05,
+    'read_timeout': 10.0,
+    'cache_ttl': 3600.0,
+    'negative_ttl': 300.0,
+    # Requests per second allowed to the provider (0 = unlimited) and burst size
+    'rate_limit': 0.0,
+    'burst': 1.0,
+    # Circuit breaker: failure rate over the last breaker_window calls (after at
+    # least breaker_min_calls) that opens it, how long it stays open, and the
+    # latency above which a call counts as failed
+    'breaker_window': 20,
+    'breaker_min_calls': 5,
+    'breaker_failure_rate': 0.5,
+    'breaker_open_seconds': 30.0,
+    'breaker_slow_call': 8.0
+}
+
+PROVIDER_SETTINGS = {
+    'ipapi': {'pool_maxsize': 20, 'cache_ttl': 21600.0, 'rate_limit': 2.0, 'burst': 5.0},
+    'emailrep': {'rate_limit': 1.0, 'burst': 2.0},
+    'numverify': {'cache_ttl': 86400.0, 'negative_ttl': 86400.0, 'rate_limit': 1.0, 'burst': 2.0},
+    'shodan': {'pool_maxsize': 20, 'read_timeout': 20.0, 'cache_ttl': 43200.0, 'rate_limit': 1.0},
+    # For AI providers cache_ttl is how long an analysis of identical results is reused,
+    # and context_window the prompt plus reply tokens the model accepts
+    'openai': {'retries': 1, 'read_timeout': 60.0, 'model': 'gpt-4', 'context_window': 8192,
+               'breaker_slow_call': 45.0},
+    'gemini': {'retries': 1, 'read_timeout': 60.0, 'model': 'gemini-1.5-pro', 'context_window': 1048576,
+               'breaker_slow_call': 45.0}
+}
+
+# Total time budget for one API request. Kept below gunicorn's default 30s
+# worker timeout so a slow provider can never get a sync worker killed
+REQUEST_DEADLINE = float(os.getenv('OSINT_REQUEST_DEADLINE', 25))
+# Share of the remaining budget given to lookups; the rest is left for AI analysis
+LOOKUP_BUDGET_SHARE = float(os.getenv('OSINT_LOOKUP_BUDGET_SHARE', 0.6))
+
+class SourceTimeout(Exception):
+    """Raised when an upstream call runs out of its time budget"""
+
+class Deadline:
+    """Absolute time budget carried from an endpoint down to every provider call"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left in the budget, never negative"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def slice(self, share):
+        """A child deadline holding only a share of the remaining budget"""
+        return Deadline(self.remaining() * share)
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open"""
+
+    def __init__(self, provider, retry_in):
+        super().__init__(f"{provider} is failing, calls suspended for another {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+def circuit_open_envelope(error):
+    """Per-source envelope for a lookup skipped because its provider's breaker is open"""
+    return {
+        "success": False,
+        "error": "circuit_open",
+        "message": str(error),
+        "retry_in": round(error.retry_in, 1)
+    }
+
+def timeout_envelope(seconds=None):
+    """Per-source envelope for a lookup that ran out of time"""
+    return {
+        "success": False,
+        "error": "timeout",
+        "message": f"No response within the {seconds:.1f}s budget" if seconds is not None else "Provider did not respond in time"
+    }
+
+def request_timeout():
+    """Seconds allowed for the current API request, optionally shortened with ?timeout="""
+    try:
+        seconds = float(request.args.get('timeout', REQUEST_DEADLINE))
+    except ValueError:
+        seconds = REQUEST_DEADLINE
+    return min(max(seconds, 0.0), REQUEST_DEADLINE)
+
+def request_deadline():
+    """Deadline for the current API request, optionally shortened with ?timeout="""
+    return Deadline(request_timeout())
+
+def normalize_target(kind, target):
+    """Canonical form of a lookup target, so equivalent inputs share cache entries"""
+    target = str(target).strip()
+    if kind == 'ip':
+        try:
+            return ipaddress.ip_address(target).compressed
+        except ValueError:
+            return target
+    if kind == 'phone':
+        digits = ''.join(ch for ch in target if ch.isdigit())
+        return f"+{digits}" if target.startswith('+') else digits
+    if kind in ('email', 'domain'):
+        return target.lower().rstrip('.')
+    return target
+
+def results_digest(results):
+    """SHA-256 of results in canonical JSON form, ignoring per-response cache meta"""
+    def strip(value):
+        if isinstance(value, dict):
+            return {k: strip(v) for k, v in value.items() if k != 'meta'}
+        if isinstance(value, list):
+            return [strip(v) for v in value]
+        return value
+    canonical = json.dumps(strip(results), sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+# Rough token budget for the results embedded in an AI prompt (~4 characters per token)
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('OSINT_AI_TOKEN_BUDGET', 3000))
+# Longest analysis a provider may write for one target
+AI_MAX_OUTPUT_TOKENS = int(os.getenv('OSINT_AI_MAX_OUTPUT_TOKENS', 1000))
+
+# Fields an analyst reads first; they are kept in front and never dropped
+HIGH_SIGNAL_FIELDS = (
+    'success', 'error', 'valid', 'ip', 'ip_str', 'org', 'isp', 'asn', 'os', 'ports', 'vulns',
+    'hostnames', 'domains', 'country_name', 'country', 'city', 'carrier', 'line_type', 'location',
+    'reputation', 'suspicious', 'references', 'product', 'version', 'transport', 'port'
+)
+
+# Bulky fields that say little to an analyst; dropped once the results need squeezing
+LOW_SIGNAL_FIELDS = (
+    'meta', 'html', 'raw', 'favicon', 'screenshot', 'thumbnail', 'hash', 'cpe', 'cpe23', 'opts',
+    '_shodan', 'crawler', 'headers', 'upgrade_info', 'message', 'instructions', 'url', 'search_url'
+)
+
+# (max list items, max string length, drop low-signal fields), tightest last
+COMPACTION_LEVELS = ((50, 2000, False), (20, 600, True), (8, 200, True), (3, 80, True), (1, 40, True))
+
+# AI providers that can stand in for each other, and how a request is routed
+# between them: 'fixed' (the investigation's own provider only), 'fallback'
+# (the others in turn on error or timeout), 'fastest' (best recent p95 first,
+# with fallback) or 'hedged' (start the next provider too when the first has
+# not answered within OSINT_AI_HEDGE_AFTER, or its recent p95, and take
+# whichever answers first)
+AI_PROVIDERS = ('openai', 'gemini')
+AI_ROUTING_POLICIES = ('fixed', 'fallback', 'fastest', 'hedged')
+AI_ROUTING = os.getenv('OSINT_AI_ROUTING', 'fallback')
+AI_HEDGE_AFTER = float(os.getenv('OSINT_AI_HEDGE_AFTER', 0))
+AI_HEDGE_DEFAULT = 5.0
+if AI_ROUTING not in AI_ROUTING_POLICIES:
+    logger.warning(f"Unknown OSINT_AI_ROUTING={AI_ROUTING!r}, using 'fallback'")
+    AI_ROUTING = 'fallback'
+
+def compact_results(results, token_budget=None):
+    """Compact JSON of results for an AI prompt, squeezed to fit a token budget
+
+    Indentation and cache meta are dropped, repeated banners are replaced by a
+    reference to their first occurrence, and high-signal fields come first.
+    Larger results are progressively trimmed: long arrays keep their first
+    items plus a count of the rest, long strings are cut and low-signal
+    fields dropped, until the text fits token_budget (AI_PROMPT_TOKEN_BUDGET).
+    """
+    max_chars = (token_budget or AI_PROMPT_TOKEN_BUDGET) * 4
+
+    for max_items, max_length, drop_low_signal in COMPACTION_LEVELS:
+        seen = set()
+
+        def compact(value):
+            if isinstance(value, dict):
+                keys = sorted(value, key=lambda k: k not in HIGH_SIGNAL_FIELDS)
+                return {k: compact(value[k]) for k in keys
+                        if k != 'meta' and value[k] not in (None, '', [], {})
+                        and not (drop_low_signal and k in LOW_SIGNAL_FIELDS)}
+            if isinstance(value, list):
+                items = [compact(v) for v in value[:max_items]]
+                if len(value) > max_items:
+                    items.append(f"... {len(value) - max_items} more")
+                return items
+            if isinstance(value, str):
+                if len(value) > 64:
+                    fingerprint = hash(value)
+                    if fingerprint in seen:
+                        return "[same as an earlier value]"
+                    seen.add(fingerprint)
+                if len(value) > max_length:
+                    return f"{value[:max_length]}... ({len(value)} chars)"
+            return value
+
+        text = json.dumps(compact(results), separators=(',', ':'), default=str)
+        if len(text) <= max_chars:
+            return text
+    return f"{text[:max_chars]}... (truncated)"
+
+def ai_prompt_content(prompt, results, targets=1):
+    """Prompt text sent to an AI provider: the instructions plus compacted results
+
+    A prompt covering several targets gets each of them the budget one
+    target would have.
+    """
+    content = compact_results(results, AI_PROMPT_TOKEN_BUDGET * targets) if results else 'No results available'
+    return f"{prompt}\n\nOSINT Results:\n{content}"
+
+def ai_output_tokens(provider, content, targets=1):
+    """Reply tokens to ask for: AI_MAX_OUTPUT_TOKENS per target, within what the context window leaves"""
+    left = provider_setting(provider, 'context_window') - len(content) // 4
+    return max(1, min(AI_MAX_OUTPUT_TOKENS * targets, left))
+
+class ProviderResponse:
+    """Status and body of an upstream response, as fetched live or replayed from cache"""
+
+    def __init__(self, status_code, content, cached_at=None, coalesced=False, retries=0):
+        self.status_code = status_code
+        self.content = content
+        self.cached_at = cached_at
+        # True when this response was shared from another caller's in-flight request
+        self.coalesced = coalesced
+        # Attempts that failed before this response was obtained
+        self.retries = retries
+        self._json = None
+
+    @property
+    def from_cache(self):
+        return self.cached_at is not None
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        if self._json is None:
+            self._json = json.loads(self.content)
+        return self._json
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution
+
+    The first caller for a key runs the call; callers arriving while it is
+    in flight wait for its outcome (up to their own deadline) instead of
+    issuing a duplicate upstream request.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func, deadline=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                response = call.result(timeout=deadline.remaining() if deadline else None)
+            except FuturesTimeout:
+                raise SourceTimeout(f"{key} still in flight when the deadline passed")
+            # A private copy, so callers never share a parsed JSON body; it
+            # reports the leader's cache age and retries, plus the coalescing
+            return ProviderResponse(response.status_code, response.content, cached_at=response.cached_at,
+                                    coalesced=True, retries=response.retries)
+
+        try:
+            response = func()
+            call.set_result(response)
+            return response
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "coalesced": self.coalesced}
+
+class Metrics:
+    """Prometheus-style counters, gauges and histograms, rendered by /metrics
+
+    Each process keeps its own series. When OSINT_METRICS_DIR is set, every
+    process also writes a snapshot of them to <dir>/metrics-<pid>.json (at
+    most once per flush_interval), and /metrics adds up the snapshots of
+    all workers. Counters and histograms of exited workers are kept; their
+    gauges are dropped.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0)
+
+    HELP = {
+        'osint_http_requests_total': ('counter', 'API requests by endpoint, method and status code'),
+        'osint_http_request_duration_seconds': ('histogram', 'API request latency by endpoint'),
+        'osint_http_requests_in_flight': ('gauge', 'API requests being handled, by endpoint'),
+        'osint_source_duration_seconds': ('histogram', 'Source lookup latency by source'),
+        'osint_source_results_total': ('counter', 'Source lookups by source and outcome'),
+        'osint_upstream_requests_total': ('counter', 'Upstream provider requests by provider and status code'),
+        'osint_upstream_duration_seconds': ('histogram', 'Upstream provider request latency by provider'),
+        'osint_upstream_requests_in_flight': ('gauge', 'Upstream provider requests in flight, by provider'),
+        'osint_cache_requests_total': ('counter', 'Cache lookups by cache and result'),
+        'osint_cache_hit_ratio': ('gauge', 'Share of cache lookups that were hits, by cache'),
+        'osint_ai_tokens_total': ('counter', 'AI tokens used by provider and kind (prompt or completion)')
+    }
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._flushed_at = 0.0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def gauge_add(self, name, labels=None, value=1):
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, labels=None, seconds=0.0):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(self.BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+        self._maybe_flush()
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                "counters": [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                "gauges": [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+                "histograms": [[name, list(labels), list(values)] for (name, labels), values in self._histograms.items()]
+            }
+
+    def _maybe_flush(self):
+        if self.directory and time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write this process's snapshot for the other workers to aggregate"""
+        if not self.directory:
+            return
+        self._flushed_at = time.monotonic()
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        try:
+            with open(f"{path}.{threading.get_ident()}.tmp", 'w') as f:
+                json.dump(self._snapshot(), f)
+            os.replace(f.name, path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot: {str(e)}")
+
+    def _collect(self):
+        """Series of this process, plus those of every other worker when shared"""
+        snapshots = [self._snapshot()]
+        if self.directory:
+            own = f"metrics-{os.getpid()}.json"
+            for filename in os.listdir(self.directory):
+                if not filename.startswith('metrics-') or not filename.endswith('.json') or filename == own:
+                    continue
+                try:
+                    with open(os.path.join(self.directory, filename)) as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                try:
+                    os.kill(int(filename[8:-5]), 0)
+                except (ValueError, ProcessLookupError):
+                    snapshot['gauges'] = []
+                except PermissionError:
+                    pass
+                snapshots.append(snapshot)
+
+        counters, gauges, histograms = {}, {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, value in snapshot['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+        return counters, gauges, histograms
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        """All series in the Prometheus text exposition format"""
+        counters, gauges, histograms = self._collect()
+
+        # Hit ratio per cache, derived from the aggregated lookup counters
+        lookups = {}
+        for (name, labels), value in counters.items():
+            if name == 'osint_cache_requests_total':
+                label = dict(labels)
+                hits, total = lookups.get(label['cache'], (0, 0))
+                lookups[label['cache']] = (hits + (value if label['result'] == 'hit' else 0), total + value)
+        for cache, (hits, total) in lookups.items():
+            gauges[('osint_cache_hit_ratio', (('cache', cache),))] = hits / total if total else 0.0
+
+        # Lines of each series, per label set; a histogram's stay in bucket order
+        series = {}
+        for (name, labels), value in counters.items():
+            series.setdefault(name, []).append((labels, [f"{name}{self._labels(labels)} {value}"]))
+        for (name, labels), value in gauges.items():
+            series.setdefault(name, []).append((labels, [f"{name}{self._labels(labels)} {value}"]))
+        for (name, labels), values in histograms.items():
+            lines = [f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}"
+                     for bound, count in zip(self.BUCKETS, values)]
+            lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{name}_sum{self._labels(labels)} {values[-2]}")
+            lines.append(f"{name}_count{self._labels(labels)} {values[-1]}")
+            series.setdefault(name, []).append((labels, lines))
+
+        out = []
+        for name in sorted(series):
+            kind, help_text = self.HELP.get(name, ('untyped', name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            for labels, lines in sorted(series[name], key=lambda entry: [(n, str(v)) for n, v in entry[0]]):
+                out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+metrics = Metrics(os.getenv('OSINT_METRICS_DIR'))
+
+def record_ai_usage(provider, usage, prompt_field, completion_field):
+    """Count the tokens an AI response reports having used"""
+    if not isinstance(usage, dict):
+        return
+    for kind, field in (('prompt', prompt_field), ('completion', completion_field)):
+        if usage.get(field):
+            metrics.inc('osint_ai_tokens_total', {'provider': provider, 'kind': kind}, usage[field])
+
+class RequestTimings:
+    """Where the time of one API request went, for its optional timings section"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.sources = {}
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def source(self, name, wall, queued=0.0, envelope=None, upstream=None):
+        """Record one source's wall and queued time, cache use and upstream traffic"""
+        entry = {"wall_ms": round(wall * 1000, 1), "queued_ms": round(queued * 1000, 1)}
+        meta = (envelope or {}).get('meta') or {}
+        if meta.get('cache'):
+            entry['cache'] = meta['cache']
+        if (envelope or {}).get('error') in ('timeout', 'circuit_open'):
+            entry['outcome'] = envelope['error']
+        if upstream:
+            entry['upstream_requests'] = upstream['requests']
+            entry['upstream_ms'] = round(upstream['seconds'] * 1000, 1)
+            entry['bytes'] = upstream['bytes']
+        with self._lock:
+            self.sources[name] = entry
+
+    def stage(self, name, seconds, **details):
+        with self._lock:
+            self.stages[name] = dict({"wall_ms": round(seconds * 1000, 1)}, **details)
+
+    def as_dict(self):
+        with self._lock:
+            return dict({"total_ms": round((time.monotonic() - self.started) * 1000, 1),
+                         "sources": dict(self.sources)}, **self.stages)
+
+# Timings of the API request being handled, when it asked for them with ?timings=1
+REQUEST_TIMINGS = contextvars.ContextVar('request_timings', default=None)
+
+class Profiler:
+    """Samples CPU and allocation profiles of selected routes into a directory
+
+    A sampled request runs under cProfile, and, when memory_frames is set,
+    under tracemalloc. Its profile is written to <dir>/<route>-<time>-<pid>-<id>.pstats
+    (readable with pstats, snakeviz or flameprof) and a tracemalloc
+    snapshot to the matching .tracemalloc file (tracemalloc.Snapshot.load).
+    cProfile only sees the thread handling the request: work it hands to
+    worker pools (lookups, AI calls) shows up as time spent waiting.
+    tracemalloc traces the whole process, so only one request per process
+    is profiled at a time, keeping other requests' allocations out of its
+    snapshot.
+    """
+
+    def __init__(self, directory=None, routes=(), sample_rate=0.0, memory_frames=10):
+        self.directory = directory
+        self.routes = set(routes)
+        self.sample_rate = sample_rate
+        self.memory_frames = memory_frames
+        self.profiled = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def sample(self, rule):
+        """Whether to profile a request to this route pattern"""
+        return bool(self.directory) and rule in self.routes and random.random() < self.sample_rate
+
+    def start(self):
+        """Start profiling the current request; None if another one is being profiled"""
+        if not self._lock.acquire(blocking=False):
+            return None
+        started_tracing = False
+        if self.memory_frames and not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+            started_tracing = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return {"id": uuid.uuid4().hex[:12], "profile": profile, "tracing": started_tracing}
+
+    def stop(self, state, rule):
+        """Stop profiling and write the request's profiles"""
+        try:
+            # Snapshot first so the profiles' own bookkeeping stays out of it
+            snapshot = tracemalloc.take_snapshot() if state['tracing'] else None
+            state['profile'].disable()
+            name = '%s-%s-%d-%s' % (rule.strip('/').replace('/', '_') or 'root',
+                                    datetime.now().strftime('%Y%m%dT%H%M%S'), os.getpid(), state['id'])
+            state['profile'].dump_stats(os.path.join(self.directory, name + '.pstats'))
+            if snapshot is not None:
+                snapshot.filter_traces([tracemalloc.Filter(False, cProfile.__file__),
+                                        tracemalloc.Filter(False, tracemalloc.__file__)]
+                                       ).dump(os.path.join(self.directory, name + '.tracemalloc'))
+            self.profiled += 1
+        except Exception as e:
+            logger.error(f"Writing profile failed: {str(e)}")
+        finally:
+            if state['tracing']:
+                tracemalloc.stop()
+            self._lock.release()
+
+    def stats(self):
+        return {
+            "enabled": bool(self.directory),
+            "routes": sorted(self.routes),
+            "sample_rate": self.sample_rate,
+            "profiled": self.profiled
+        }
+
+profiler = Profiler(os.getenv('OSINT_PROFILE_DIR'),
+                    routes=[r.strip() for r in os.getenv('OSINT_PROFILE_ROUTES', '/api/image,/api/video').split(',') if r.strip()],
+                    sample_rate=float(os.getenv('OSINT_PROFILE_SAMPLE_RATE', 0.05)),
+                    memory_frames=int(os.getenv('OSINT_PROFILE_MEMORY_FRAMES', 10)))
+
+class LatencyStats:
+    """Recent latency samples per key, summarized as percentiles"""
+
+    WINDOW = 200
+
+    def __init__(self):
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds):
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.WINDOW)).append(seconds)
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def percentile(self, key, q):
+        """The q-th percentile (0-100) of the recent samples for key, or None"""
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+    def stats(self):
+        with self._lock:
+            keys = list(self._samples)
+        return {key: {"count": self._counts[key],
+                      "p50_ms": round(self.percentile(key, 50) * 1000, 1),
+                      "p95_ms": round(self.percentile(key, 95) * 1000, 1)}
+                for key in keys}
+
+def token_bucket(tokens, updated, now, rate, burst, penalty=0.0):
+    """Advance a token bucket to now and try to take one token
+
+    Returns (tokens left, seconds to wait); a wait of 0 means the token was
+    taken. A penalty (e.g. a 429's Retry-After) empties the bucket so that
+    the next token only becomes available after that many seconds.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if penalty > 0:
+        return min(tokens, 1 - penalty * rate), penalty
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+def retry_after_seconds(response, default=1.0):
+    """Seconds a provider asked us to back off for, from its Retry-After header"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+# API keys some providers take in the query string, and so in exception texts
+URL_SECRET_PARAMS = re.compile(r'([?&](?:key|access_key|api_key|token)=)[^&\s\'"]+', re.IGNORECASE)
+
+def redact_url_secrets(text):
+    """text with the values of key-like URL query parameters masked"""
+    return URL_SECRET_PARAMS.sub(r'\1[redacted]', text)
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker around one upstream provider
+
+    Outcomes of the last breaker_window calls are kept; a call fails if it
+    raises, returns a 5xx or takes longer than breaker_slow_call seconds.
+    Once breaker_min_calls have been seen and the failure rate reaches
+    breaker_failure_rate the breaker opens and calls fail fast. After
+    breaker_open_seconds one probe call is let through (half-open): its
+    success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.state = 'closed'
+        self.opened_at = None
+        self.opened = 0
+        self.rejected = 0
+        self._outcomes = deque(maxlen=int(provider_setting(provider, 'breaker_window')))
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Let a call through, or raise CircuitOpen"""
+        with self._lock:
+            if self.state == 'closed':
+                return
+            retry_in = self.opened_at + provider_setting(self.provider, 'breaker_open_seconds') - time.time()
+            if self.state == 'open' and retry_in <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return
+            self.rejected += 1
+        raise CircuitOpen(self.provider, max(retry_in, 0.0))
+
+    def record(self, ok):
+        """Record the outcome of an allowed call"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+                if ok:
+                    self.state = 'closed'
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(ok)
+            calls = len(self._outcomes)
+            failures = calls - sum(self._outcomes)
+            if (self.state == 'closed' and calls >= provider_setting(self.provider, 'breaker_min_calls')
+                    and failures / calls >= provider_setting(self.provider, 'breaker_failure_rate')):
+                self._open()
+
+    def release(self):
+        """An allowed call ended without a verdict on the provider (deadline, rate limit)"""
+        with self._lock:
+            if self.state == 'half_open':
+                self._probing = False
+
+    def _open(self):
+        self.state = 'open'
+        self.opened_at = time.time()
+        self.opened += 1
+        logger.warning(f"Circuit breaker for {self.provider} opened")
+
+    def snapshot(self):
+        with self._lock:
+            calls = len(self._outcomes)
+            snapshot = {
+                "state": self.state,
+                "calls": calls,
+                "failure_rate": round((calls - sum(self._outcomes)) / calls, 2) if calls else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected
+            }
+            if self.state == 'open':
+                retry_in = self.opened_at + provider_setting(self.provider, 'breaker_open_seconds') - time.time()
+                snapshot['retry_in'] = round(max(retry_in, 0.0), 1)
+            return snapshot
+
+class RateLimiter:
+    """Token bucket per provider, shared through the cache backend
+
+    With the sqlite or redis backend every worker process draws from the
+    same buckets, so the combined request rate stays at the provider's
+    ceiling. Callers queue for a token until their deadline. Responses are
+    observed for quota headers and 429s, which pause the provider's bucket
+    for the Retry-After period.
+    """
+
+    # Response headers providers use to report their remaining quota
+    QUOTA_HEADERS = {
+        'limit': ('X-RateLimit-Limit', 'X-RateLimit-Limit-Requests', 'RateLimit-Limit'),
+        'remaining': ('X-RateLimit-Remaining', 'X-RateLimit-Remaining-Requests', 'RateLimit-Remaining'),
+        'reset': ('X-RateLimit-Reset', 'X-RateLimit-Reset-Requests', 'RateLimit-Reset'),
+        'remaining_tokens': ('X-RateLimit-Remaining-Tokens',)
+    }
+
+    def __init__(self, store=None):
+        self.store = store or MemoryCacheBackend()
+        # Used while the shared store is unreachable
+        self._fallback = MemoryCacheBackend()
+        # Pauses for providers without a configured rate, after a 429
+        self._blocked_until = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _provider_stats(self, provider):
+        stats = self._stats.get(provider)
+        if stats is None:
+            stats = self._stats.setdefault(provider, {
+                "requests": 0, "throttled": 0, "waits": 0, "waited_seconds": 0.0, "rejected": 0, "quota": {}
+            })
+        return stats
+
+    def _take(self, provider, rate, burst, penalty=0.0):
+        key = f"ratelimit:{provider}"
+        try:
+            return self.store.take_token(key, rate, burst, penalty)
+        except Exception as e:
+            logger.warning(f"Shared rate limiter unavailable, limiting {provider} per process: {str(e)}")
+            return self._fallback.take_token(key, rate, burst, penalty)
+
+    def acquire(self, provider, deadline=None):
+        """Wait for a request slot, raising SourceTimeout if none frees up before the deadline"""
+        rate = provider_setting(provider, 'rate_limit')
+        burst = provider_setting(provider, 'burst')
+        waited = 0.0
+        while True:
+            if rate > 0:
+                wait_for = self._take(provider, rate, burst)
+            else:
+                wait_for = max(0.0, self._blocked_until.get(provider, 0.0) - time.time())
+            if wait_for <= 0:
+                break
+            if deadline is not None and wait_for > deadline.remaining():
+                with self._lock:
+                    self._provider_stats(provider)['rejected'] += 1
+                raise SourceTimeout(f"{provider} rate limit leaves no request slot before the deadline")
+            time.sleep(wait_for)
+            waited += wait_for
+
+        with self._lock:
+            stats = self._provider_stats(provider)
+            stats['requests'] += 1
+            if waited:
+                stats['waits'] += 1
+                stats['waited_seconds'] += waited
+
+    def observe(self, provider, response):
+        """Record a provider response's quota headers and back off after a 429"""
+        quota = {}
+        for name, headers in self.QUOTA_HEADERS.items():
+            for header in headers:
+                value = response.headers.get(header)
+                if value is not None:
+                    quota[name] = value
+                    break
+
+        with self._lock:
+            stats = self._provider_stats(provider)
+            if quota:
+                quota['updated_at'] = datetime.now().isoformat()
+                stats['quota'] = quota
+            if response.status_code == 429:
+                stats['throttled'] += 1
+        if response.status_code != 429:
+            return
+
+        pause = retry_after_seconds(response)
+        rate = provider_setting(provider, 'rate_limit')
+        if rate > 0:
+            self._take(provider, rate, provider_setting(provider, 'burst'), penalty=pause)
+        else:
+            self._blocked_until[provider] = max(self._blocked_until.get(provider, 0.0), time.time() + pause)
+
+    def stats(self):
+        with self._lock:
+            return {provider: dict(stats, waited_seconds=round(stats['waited_seconds'], 2),
+                                   rate_limit=provider_setting(provider, 'rate_limit'),
+                                   burst=provider_setting(provider, 'burst'))
+                    for provider, stats in self._stats.items()}
+
+class MemoryCacheBackend:
+    """In-process LRU store of byte values with a TTL per entry"""
+
+    name = 'memory'
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def take_token(self, key, rate, burst, penalty=0.0):
+        """Take a token from a rate limiter bucket; returns seconds to wait, 0 if taken"""
+        with self._lock:
+            now = time.time()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, wait_for = token_bucket(tokens, updated, now, rate, burst, penalty)
+            self._buckets[key] = (tokens, now)
+            return wait_for
+
+    def stats(self):
+        with self._lock:
+            return {"backend": self.name, "entries": len(self._entries), "max_entries": self.max_entries}
+
+class SQLiteCacheBackend:
+    """On-disk store shared by every worker process on the host
+
+    Uses WAL mode so readers never block the writer, one connection per
+    thread, and approximate LRU eviction by last access time.
+    """
+
+    name = 'sqlite'
+    # Refresh an entry's access time at most this often, so hits stay read-only
+    ACCESS_RESOLUTION = 60
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, max_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed_at)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )""")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= now:
+            return None
+        if now - row[2] > self.ACCESS_RESOLUTION:
+            with conn:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return bytes(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                         (key, sqlite3.Binary(value), now + ttl, now))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune(conn, now)
+
+    def _prune(self, conn, now):
+        """Drop expired entries, then the least recently used ones over the size bound"""
+        with conn:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+            excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at LIMIT ?)",
+                             (excess,))
+
+    def delete(self, key):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM cache")
+
+    def take_token(self, key, rate, burst, penalty=0.0):
+        """Take a token from a rate limiter bucket; returns seconds to wait, 0 if taken"""
+        conn = self._connection()
+        # BEGIN IMMEDIATE takes the write lock up front, so concurrent
+        # processes read-modify-write the bucket one at a time
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row is not None else (burst, now)
+            tokens, wait_for = token_bucket(tokens, updated, now, rate, burst, penalty)
+            conn.execute("INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return wait_for
+
+    def stats(self):
+        entries = self._connection().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {"backend": self.name, "path": self.path, "entries": entries, "max_entries": self.max_entries}
+
+class RedisCacheBackend:
+    """Store speaking the Redis protocol (RESP), shared by every worker and host
+
+    Only GET, SET PX, DEL and SCAN are used for the cache, plus EVAL for the
+    shared rate limiter buckets. Size is bounded by the server's maxmemory
+    policy.
+    """
+
+    name = 'redis'
+
+    # token_bucket() as a script, so the read-modify-write is atomic
+    TOKEN_BUCKET_SCRIPT = """
+local rate, burst, now, penalty = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if penalty > 0 then
+    tokens = math.min(tokens, 1 - penalty * rate)
+    wait = penalty
+elseif tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst / rate + penalty) * 1000) + 1000)
+return tostring(wait)
+"""
+
+    def __init__(self, url, prefix='osint:', socket_timeout=2.0):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.prefix = prefix
+        self.socket_timeout = socket_timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.socket_timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile('rb')
+        if self.password:
+            self._send('AUTH', self.password)
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _send(self, *args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, (bytes, bytearray, memoryview)):
+                arg = str(arg).encode()
+            parts.append(b'$%d\r\n' % len(arg))
+            parts.append(arg)
+            parts.append(b'\r\n')
+        self._local.sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        reader = self._local.reader
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest
+        if kind == b'-':
+            raise RuntimeError(f"Redis error: {rest.decode(errors='replace')}")
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def _command(self, *args):
+        """Run a command, reconnecting once if the pooled connection went stale"""
+        for attempt in range(2):
+            try:
+                if getattr(self._local, 'sock', None) is None:
+                    self._connect()
+                return self._send(*args)
+            except (OSError, ConnectionError):
+                sock, self._local.sock = getattr(self._local, 'sock', None), None
+                if sock is not None:
+                    sock.close()
+                if attempt:
+                    raise
+
+    def get(self, key):
+        return self._command('GET', self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self._command('SET', self.prefix + key, value, 'PX', max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self._command('DEL', self.prefix + key)
+
+    def take_token(self, key, rate, burst, penalty=0.0):
+        """Take a token from a rate limiter bucket; returns seconds to wait, 0 if taken"""
+        reply = self._command('EVAL', self.TOKEN_BUCKET_SCRIPT, 1, self.prefix + key,
+                              repr(float(rate)), repr(float(burst)), repr(time.time()), repr(float(penalty)))
+        return float(reply)
+
+    def clear(self):
+        cursor = b'0'
+        while True:
+            cursor, keys = self._command('SCAN', cursor, 'MATCH', self.prefix + '*', 'COUNT', 500)
+            if keys:
+                self._command('DEL', *keys)
+            if cursor == b'0':
+                break
+
+    def stats(self):
+        return {"backend": self.name, "host": self.host, "port": self.port, "db": self.db}
+
+def create_cache_backend(store='cache'):
+    """Build the backend selected by OSINT_CACHE_BACKEND for the lookup cache, or with store='jobs' for job state
+
+    Jobs get a store of their own (another SQLite file, Redis key prefix or
+    memory LRU), so lookup traffic never evicts a running job.
+    """
+    backend = os.getenv('OSINT_CACHE_BACKEND', 'memory').lower()
+    if store == 'jobs':
+        max_entries = int(os.getenv('OSINT_JOB_MAX_STORED', 10000))
+        path = os.getenv('OSINT_JOB_STORE_PATH', os.path.join(tempfile.gettempdir(), 'osint_jobs.sqlite3'))
+        prefix = 'osint-jobs:'
+    else:
+        max_entries = int(os.getenv('OSINT_CACHE_MAX_ENTRIES', 5000))
+        path = os.getenv('OSINT_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'osint_cache.sqlite3'))
+        prefix = 'osint:'
+    try:
+        if backend == 'sqlite':
+            return SQLiteCacheBackend(path, max_entries)
+        if backend == 'redis':
+            return RedisCacheBackend(os.getenv('OSINT_CACHE_REDIS_URL', 'redis://localhost:6379/0'), prefix=prefix)
+    except (sqlite3.Error, OSError, ValueError) as e:
+        # A cache that cannot be opened must not keep the app from starting
+        logger.warning(f"Cache backend {backend!r} unavailable ({str(e)}), using memory")
+        return MemoryCacheBackend(max_entries)
+    if backend != 'memory':
+        logger.warning(f"Unknown OSINT_CACHE_BACKEND={backend!r}, using memory")
+    return MemoryCacheBackend(max_entries)
+
+class LookupCache:
+    """Cache of provider responses on top of a pluggable backend
+
+    Entries are a small fixed header (stored time, status code) followed by
+    the upstream body exactly as received, so even large Shodan match lists
+    are written and read without being re-encoded. A failing backend is
+    treated as a cache miss, and skipped for a few seconds, rather than
+    failing or slowing down the lookup.
+    """
+
+    HEADER = struct.Struct('!dH')
+    ERROR_BACKOFF = 5
+
+    def __init__(self, backend, name='lookup'):
+        self.backend = backend
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._skip_until = 0
+
+    def _backend_failed(self, action, error):
+        self.errors += 1
+        self._skip_until = time.monotonic() + self.ERROR_BACKOFF
+        logger.warning(f"Lookup cache {action} failed: {str(error)}")
+
+    def get(self, key):
+        """Return a cached ProviderResponse, or None if missing or expired"""
+        value = None
+        if time.monotonic() >= self._skip_until:
+            try:
+                value = self.backend.get(key)
+            except Exception as e:
+                self._backend_failed('read', e)
+        if value is None:
+            self.misses += 1
+            metrics.inc('osint_cache_requests_total', {'cache': self.name, 'result': 'miss'})
+            return None
+
+        self.hits += 1
+        metrics.inc('osint_cache_requests_total', {'cache': self.name, 'result': 'hit'})
+        stored_at, status_code = self.HEADER.unpack_from(value)
+        return ProviderResponse(status_code, value[self.HEADER.size:], cached_at=stored_at)
+
+    def set(self, key, response, ttl):
+        if time.monotonic() < self._skip_until:
+            return
+        value = self.HEADER.pack(time.time(), response.status_code) + response.content
+        try:
+            self.backend.set(key, value, ttl)
+        except Exception as e:
+            self._backend_failed('write', e)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
+
+    def backend_stats(self):
+        """Size and location of the backend, which the lookup, AI and upload caches share"""
+        try:
+            return self.backend.stats()
+        except Exception as e:
+            return {"backend": self.backend.name, "error": str(e)}
+
+def provider_setting(provider, name):
+    """Look up a provider setting, preferring an environment override"""
+    default = PROVIDER_SETTINGS.get(provider, {}).get(name, DEFAULT_PROVIDER_SETTINGS.get(name))
+    override = os.getenv(f"{provider.upper()}_{name.upper()}")
+    if override is None:
+        return default
+    try:
+        return type(default)(override) if default is not None else override
+    except ValueError:
+        logger.warning(f"Ignoring invalid {provider.upper()}_{name.upper()}={override!r}")
+        return default
+
+# Uploads up to OSINT_UPLOAD_SPOOL_THRESHOLD bytes stay in memory, larger ones
+# are streamed to a file in OSINT_UPLOAD_DIR. Uploads over the endpoint's limit
+# are refused with 413 as soon as the limit is crossed.
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv('OSINT_UPLOAD_SPOOL_THRESHOLD', 1024 * 1024))
+UPLOAD_DIR = os.getenv('OSINT_UPLOAD_DIR') or None
+UPLOAD_LIMITS = {
+    '/api/image': int(os.getenv('OSINT_MAX_IMAGE_UPLOAD', 25 * 1024 * 1024)),
+    '/api/image/similar': int(os.getenv('OSINT_MAX_IMAGE_UPLOAD', 25 * 1024 * 1024)),
+    '/api/face': int(os.getenv('OSINT_MAX_IMAGE_UPLOAD', 25 * 1024 * 1024)),
+    '/api/deepfake': int(os.getenv('OSINT_MAX_VIDEO_UPLOAD', 500 * 1024 * 1024)),
+    '/api/video': int(os.getenv('OSINT_MAX_VIDEO_UPLOAD', 500 * 1024 * 1024)),
+    '/api/jobs': int(os.getenv('OSINT_MAX_VIDEO_UPLOAD', 500 * 1024 * 1024))
+}
+
+class UploadSpool:
+    """An uploaded file, kept in memory up to a threshold and spilled to a named file past it
+
+    Werkzeug writes each multipart file into one of these as it streams in.
+    Once on disk, analyzers that need a path (moviepy) use it directly
+    instead of copying the upload to a temporary file of their own. The file
+    is removed when the request closes its uploads.
+    """
+
+    def __init__(self, threshold=UPLOAD_SPOOL_THRESHOLD, directory=UPLOAD_DIR, suffix=''):
+        self.threshold = threshold
+        self.directory = directory
+        self.suffix = suffix
+        self.path = None
+        self.crc32 = 0
+        self._sha256 = hashlib.sha256()
+        self._file = io.BytesIO()
+
+    def write(self, data):
+        # Hashed as it streams in, so the content never has to be read back for it
+        self._sha256.update(data)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        if self.path is None and self._file.tell() + len(data) > self.threshold:
+            self._rollover()
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def _rollover(self):
+        fd, self.path = tempfile.mkstemp(prefix='osint-upload-', suffix=self.suffix, dir=self.directory)
+        spooled = os.fdopen(fd, 'w+b')
+        position = self._file.tell()
+        spooled.write(self._file.getbuffer())
+        spooled.seek(position)
+        self._file = spooled
+
+    def on_disk(self):
+        """The spool file's path, moving the upload to disk first if it is still in memory"""
+        if self.path is None:
+            self._rollover()
+        self._file.flush()
+        return self.path
+
+    def detach(self):
+        """Hand the upload, moved to disk, over to a new spool that outlives the request
+
+        The returned spool owns the file and removes it when closed; this
+        one is left empty, so closing the request's uploads leaves it alone.
+        """
+        self.on_disk()
+        detached = UploadSpool(self.threshold, self.directory, self.suffix)
+        detached.path, detached._file = self.path, self._file
+        detached.crc32, detached._sha256 = self.crc32, self._sha256
+        self.path, self._file = None, io.BytesIO()
+        return detached
+
+    def view(self):
+        """The upload's content: a copy while in memory, a read-only mmap once on disk"""
+        if self.path is None:
+            return self._file.getvalue()
+        if self.size_bytes == 0:
+            # An empty file cannot be mapped
+            return b''
+        return mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def size_bytes(self):
+        if self.path is None:
+            return self._file.getbuffer().nbytes
+        self._file.flush()
+        return os.fstat(self._file.fileno()).st_size
+
+    def __getattr__(self, name):
+        # read, readline, seek, tell, flush and the rest go to the current file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        # Line iteration is looked up on the class, so __getattr__ never sees it
+        return iter(self._file)
+
+    def close(self):
+        self._file.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+class UploadRequest(Request):
+    """Flask request that spools uploads through UploadSpool and applies per-endpoint limits"""
+
+    @property
+    def max_content_length(self):
+        rule = self.url_rule.rule if self.url_rule is not None else None
+        return UPLOAD_LIMITS.get(rule, super().max_content_length)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        extension = os.path.splitext(filename or '')[1].lower()
+        return UploadSpool(suffix=extension if extension[1:].isalnum() else '')
+
+app.request_class = UploadRequest
+
+def upload_fingerprint(media):
+    """SHA-256, CRC-32 and size of an upload's content"""
+    if isinstance(media, DecodedImage):
+        media = media.source
+    if isinstance(media, UploadSpool):
+        return {"sha256": media.sha256, "crc32": f"{media.crc32:08x}", "size_bytes": media.size_bytes}
+    return {"sha256": hashlib.sha256(media).hexdigest(), "crc32": f"{zlib.crc32(media):08x}",
+            "size_bytes": len(media)}
+
+class BlobStore:
+    """Uploads kept under <dir>/<sha256[:2]>/<sha256>, so each distinct file is stored once"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.stored = 0
+        self.deduplicated = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def put(self, media, sha256):
+        """Store an upload (bytes, UploadSpool or DecodedImage) unless its content is already there"""
+        path = self.path(sha256)
+        if os.path.exists(path):
+            self.deduplicated += 1
+            return path
+        if isinstance(media, DecodedImage):
+            media = media.source
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(media, UploadSpool) and media.path is not None:
+            # A spool already on disk becomes the blob without copying it, if it is on the same filesystem
+            try:
+                os.link(media.on_disk(), path)
+                self.stored += 1
+                return path
+            except FileExistsError:
+                self.deduplicated += 1
+                return path
+            except OSError:
+                pass
+        fd, incoming = tempfile.mkstemp(prefix='.incoming-', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as blob:
+                if isinstance(media, UploadSpool):
+                    media.seek(0)
+                    shutil.copyfileobj(media, blob)
+                else:
+                    blob.write(media)
+            os.replace(incoming, path)
+        except BaseException:
+            os.unlink(incoming)
+            raise
+        self.stored += 1
+        return path
+
+    def stats(self):
+        return {"directory": self.directory, "stored": self.stored, "deduplicated": self.deduplicated}
+
+# Analyzer results of an upload are reused for the same content for this long
+UPLOAD_CACHE_TTL = int(os.getenv('OSINT_UPLOAD_CACHE_TTL', 7 * 24 * 3600))
+# ...or only this long when any analyzer failed, so a transient failure is retried soon.
+# Failures marked "retryable": False (an unsupported format, a missing optional
+# library) would only repeat, and keep the full TTL
+UPLOAD_NEGATIVE_TTL = int(os.getenv('OSINT_UPLOAD_NEGATIVE_TTL', 300))
+
+# Video metadata needs the optional moviepy package
+MOVIEPY_AVAILABLE = importlib.util.find_spec('moviepy') is not None
+
+class ExifReader:
+    """Lazy, selective reader for the TIFF structure inside an EXIF block
+
+    Nothing is decoded up front: an IFD's entries are indexed the first
+    time a tag in it is asked for, and a value is decoded only when it is
+    read. Tags no group asks for, like a MakerNote of several kilobytes,
+    are never decoded.
+    """
+
+    # TIFF field type: (struct format of one value, size in bytes)
+    TYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('L', 4), 5: ('LL', 8), 7: ('B', 1), 9: ('l', 4), 10: ('ll', 8)}
+    EXIF_POINTER = 0x8769
+    GPS_POINTER = 0x8825
+
+    # Tags read by each group: (IFD, tag, name in the result)
+    FIELDS = {
+        'camera': (
+            ('ifd0', 0x010F, 'make'), ('ifd0', 0x0110, 'model'), ('ifd0', 0x0131, 'software'),
+            ('exif', 0xA433, 'lens_make'), ('exif', 0xA434, 'lens_model'), ('exif', 0xA431, 'serial_number'),
+            ('exif', 0x829A, 'exposure_time'), ('exif', 0x829D, 'f_number'), ('exif', 0x8827, 'iso'),
+            ('exif', 0x920A, 'focal_length')
+        ),
+        'timestamps': (
+            ('ifd0', 0x0132, 'modified'), ('exif', 0x9003, 'original'), ('exif', 0x9004, 'digitized'),
+            ('exif', 0x9010, 'offset'), ('exif', 0x9011, 'offset_original'), ('exif', 0x9012, 'offset_digitized'),
+            ('exif', 0x9291, 'subsec_original')
+        )
+    }
+    GROUPS = ('gps', 'camera', 'timestamps', 'thumbnail')
+
+    def __init__(self, data):
+        if bytes(data[:6]) == b'Exif\x00\x00':
+            data = memoryview(data)[6:]
+        self.data = memoryview(data)
+        byte_order = bytes(self.data[:2])
+        if byte_order not in (b'II', b'MM'):
+            raise ValueError("Not an EXIF block")
+        self.endian = '<' if byte_order == b'II' else '>'
+        magic, ifd0 = self._unpack('HL', 2)
+        if magic != 42:
+            raise ValueError("Not an EXIF block")
+        self._offsets = {'ifd0': ifd0}
+        self._ifds = {}
+
+    def _unpack(self, fmt, offset):
+        fmt = self.endian + fmt
+        if offset < 0 or offset + struct.calcsize(fmt) > len(self.data):
+            raise ValueError("EXIF block is truncated")
+        return struct.unpack_from(fmt, self.data, offset)
+
+    def _offset(self, ifd):
+        if ifd == 'exif':
+            return self.value('ifd0', self.EXIF_POINTER)
+        if ifd == 'gps':
+            return self.value('ifd0', self.GPS_POINTER)
+        if ifd == 'ifd1':
+            # IFD1, which describes the thumbnail, follows IFD0
+            self._entries('ifd0')
+        return self._offsets.get(ifd)
+
+    def _entries(self, ifd):
+        """Tag -> (type, count, position of the value field), without decoding any value"""
+        if ifd not in self._ifds:
+            entries = {}
+            offset = self._offset(ifd)
+            if offset:
+                count, = self._unpack('H', offset)
+                for position in range(offset + 2, offset + 2 + 12 * count, 12):
+                    tag, field_type, field_count = self._unpack('HHL', position)
+                    entries[tag] = (field_type, field_count, position + 8)
+                if ifd == 'ifd0':
+                    self._offsets['ifd1'], = self._unpack('L', offset + 2 + 12 * count)
+            self._ifds[ifd] = entries
+        return self._ifds[ifd]
+
+    def value(self, ifd, tag):
+        """Decode one tag: text, a number (rationals as floats) or a list of numbers; None if absent"""
+        entry = self._entries(ifd).get(tag)
+        if entry is None or entry[0] not in self.TYPES:
+            return None
+        field_type, count, position = entry
+        fmt, size = self.TYPES[field_type]
+        if size * count > 4:
+            position, = self._unpack('L', position)
+        if position + size * count > len(self.data):
+            raise ValueError("EXIF block is truncated")
+        if field_type == 2:
+            text = bytes(self.data[position:position + count]).split(b'\x00', 1)[0]
+            return text.decode('utf-8', errors='replace').strip()
+        values = self._unpack(fmt * count, position)
+        if field_type in (5, 10):
+            values = [numerator / denominator if denominator else None
+                      for numerator, denominator in zip(values[::2], values[1::2])]
+        return values[0] if count == 1 else list(values)
+
+    def group(self, name):
+        """Decode one tag group: gps, camera, timestamps or thumbnail"""
+        if name == 'gps':
+            return self.gps()
+        if name == 'thumbnail':
+            return self.thumbnail()
+        fields = {}
+        for ifd, tag, key in self.FIELDS[name]:
+            value = self.value(ifd, tag)
+            if value is not None and value != '':
+                fields[key] = value
+        return fields
+
+    def _coordinate(self, tag, ref_tag):
+        dms = self.value('gps', tag)
+        if not isinstance(dms, list) or len(dms) != 3 or None in dms:
+            return None
+        degrees = dms[0] + dms[1] / 60 + dms[2] / 3600
+        return round(-degrees if self.value('gps', ref_tag) in ('S', 'W') else degrees, 7)
+
+    def gps(self):
+        """GPS position as decimal degrees (negative south and west), altitude in metres and UTC time"""
+        gps = {}
+        latitude, longitude = self._coordinate(2, 1), self._coordinate(4, 3)
+        if latitude is not None and longitude is not None:
+            gps['latitude'] = latitude
+            gps['longitude'] = longitude
+            gps['maps_url'] = f"https://www.google.com/maps?q={latitude},{longitude}"
+        altitude = self.value('gps', 6)
+        if isinstance(altitude, float):
+            gps['altitude_m'] = round(-altitude if self.value('gps', 5) == 1 else altitude, 2)
+        date, clock = self.value('gps', 0x1D), self.value('gps', 7)
+        if date and isinstance(clock, list) and len(clock) == 3 and None not in clock:
+            gps['timestamp_utc'] = f"{date} {int(clock[0]):02d}:{int(clock[1]):02d}:{clock[2]:06.3f}"
+        for tag, key in ((0x12, 'map_datum'), (0x11, 'image_direction')):
+            value = self.value('gps', tag)
+            if value is not None:
+                gps[key] = value
+        return gps
+
+    def thumbnail(self):
+        """The embedded JPEG thumbnail (base64), which may predate later edits of the image"""
+        offset, length = self.value('ifd1', 0x0201), self.value('ifd1', 0x0202)
+        if not isinstance(offset, int) or not isinstance(length, int) or offset + length > len(self.data):
+            return {}
+        return {
+            "format": "JPEG",
+            "size_bytes": length,
+            "data_base64": base64.b64encode(self.data[offset:offset + length]).decode('ascii')
+        }
+
+# EXIF groups image_osint decodes unless the request asks for others with "exif"
+EXIF_DEFAULT_GROUPS = ('gps', 'camera', 'timestamps')
+
+def requested_exif_groups(data=None):
+    """EXIF groups for the current request from ?exif= or the body's "exif" field, e.g. gps,camera or all"""
+    groups = request.args.get('exif')
+    if groups is None and data:
+        groups = data.get('exif')
+    if not groups:
+        return EXIF_DEFAULT_GROUPS
+    if groups == 'all':
+        return ExifReader.GROUPS
+    groups = tuple(group.strip() for group in groups.split(',') if group.strip())
+    unknown = [group for group in groups if group not in ExifReader.GROUPS]
+    if unknown:
+        raise ValueError(f"Unknown EXIF groups: {', '.join(unknown)} (choose from {', '.join(ExifReader.GROUPS)} or all)")
+    return groups
+
+class DecodedImage:
+    """An uploaded image, decoded once and shared by the image analyzers
+
+    Only the header is parsed up front (Image.open reads pixels lazily), and
+    the EXIF block is parsed on first use and then kept. Bytes are read
+    through an io.BytesIO, which shares their buffer, and an UploadSpool is
+    read in place, so nothing is copied or written to disk.
+    """
+
+    def __init__(self, data):
+        self.source = data
+        self.error = None
+        # Set when the content is not an image format Pillow reads, as opposed to a failed read
+        self.unsupported = False
+        self._image = None
+        self._exif = None
+        if isinstance(data, UploadSpool):
+            self.size_bytes = data.size_bytes
+            data.seek(0)
+            source = data
+        else:
+            self.size_bytes = len(data)
+            source = io.BytesIO(data)
+        try:
+            self._image = Image.open(source)
+        except Exception as e:
+            self.error = str(e)
+            self.unsupported = isinstance(e, UnidentifiedImageError)
+
+    @classmethod
+    def of(cls, image):
+        """Wrap raw upload bytes, passing an already decoded image through"""
+        return image if isinstance(image, cls) else cls(image)
+
+    @property
+    def image(self):
+        if self._image is None:
+            raise ValueError(self.error)
+        return self._image
+
+    @property
+    def exif(self):
+        """An ExifReader over the image's EXIF block, or None if it has none"""
+        if self._exif is None:
+            raw = self.image.info.get('exif')
+            if raw is None and self.image.format == 'TIFF':
+                # A TIFF file is itself the structure an EXIF block holds
+                raw = self.source.view() if isinstance(self.source, UploadSpool) else self.source
+            self._exif = ExifReader(raw) if raw else False
+        return self._exif or None
+
+    def failure(self, error):
+        """An analyzer's error envelope; a format Pillow cannot read fails the same way every time"""
+        envelope = {"success": False, "error": str(error)}
+        if self.unsupported:
+            envelope['retryable'] = False
+        return envelope
+
+    def analysis_envelope(self):
+        """The Image_Analysis result: format, mode and dimensions from the header"""
+        try:
+            img = self.image
+        except ValueError as e:
+            return self.failure(e)
+        return {
+            "success": True,
+            "data": {
+                "format": img.format,
+                "mode": img.mode,
+                "size": img.size,
+                "width": img.width,
+                "height": img.height
+            }
+        }
+
+# DCT-II basis for pHash's 32x32 transform
+PHASH_SIZE = 32
+_k, _n = np.meshgrid(np.arange(PHASH_SIZE), np.arange(PHASH_SIZE), indexing='ij')
+PHASH_DCT = np.cos(np.pi * (2 * _n + 1) * _k / (2 * PHASH_SIZE))
+del _k, _n
+
+def perceptual_hashes(img):
+    """aHash, dHash and pHash of a PIL image, each a 64-bit integer
+
+    All three work on a small grayscale copy, so they survive resizing,
+    recompression and small edits: aHash compares 8x8 pixels with their
+    mean, dHash compares horizontal neighbours of a 9x8 image, and pHash
+    compares the lowest 8x8 DCT frequencies of a 32x32 image with their
+    median.
+    """
+    gray = img.convert('L')
+
+    def bits_to_int(bits):
+        return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+    pixels = np.asarray(gray.resize((8, 8), Image.LANCZOS), dtype=np.float32)
+    ahash = bits_to_int(pixels > pixels.mean())
+    pixels = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.float32)
+    dhash = bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+    pixels = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (PHASH_DCT @ pixels @ PHASH_DCT.T)[:8, :8]
+    # The DC term only says how bright the image is, so it is left out of the median
+    phash = bits_to_int(low > np.median(low.ravel()[1:]))
+    return {"ahash": ahash, "dhash": dhash, "phash": phash}
+
+class ImageIndex:
+    """Perceptual hashes of every analyzed image, searchable by Hamming distance
+
+    Multi-index hashing: the 64-bit pHash is split into four 16-bit chunks,
+    each an indexed SQLite column. Two hashes at most r bits apart differ in
+    at most r // 4 bits on at least one chunk, so a search probes each
+    chunk's index for the values that close to the query's chunk and checks
+    the full distance of just those candidates. The chunk indexes also
+    carry the pHash, so candidates are checked without touching the table.
+    The database is shared by every worker on the host, one connection per
+    thread.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+    # r // 4 <= 3 keeps a search under 700 index probes per chunk
+    MAX_DISTANCE = 15
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._flips = [[sum(1 << bit for bit in bits) for bits in itertools.combinations(range(self.CHUNK_BITS), n)]
+                       for n in range(self.MAX_DISTANCE // self.CHUNKS + 1)]
+        with self._connection() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS image_hashes (
+                sha256 TEXT PRIMARY KEY,
+                phash INTEGER NOT NULL,
+                dhash TEXT NOT NULL,
+                ahash TEXT NOT NULL,
+                c0 INTEGER NOT NULL,
+                c1 INTEGER NOT NULL,
+                c2 INTEGER NOT NULL,
+                c3 INTEGER NOT NULL,
+                format TEXT,
+                width INTEGER,
+                height INTEGER,
+                first_seen REAL NOT NULL
+            )""")
+            for chunk in range(self.CHUNKS):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS image_hashes_c{chunk} ON image_hashes (c{chunk}, phash)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _signed(value):
+        # SQLite integers are signed 64-bit
+        return value - (1 << 64) if value >= 1 << 63 else value
+
+    def _chunks(self, phash):
+        mask = (1 << self.CHUNK_BITS) - 1
+        return [(phash >> (self.CHUNK_BITS * chunk)) & mask for chunk in range(self.CHUNKS)]
+
+    def add(self, sha256, hashes, info=None):
+        """Index an image's hashes; an image already indexed keeps its first entry"""
+        info = info or {}
+        conn = self._connection()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO image_hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (sha256, self._signed(hashes['phash']), f"{hashes['dhash']:016x}", f"{hashes['ahash']:016x}",
+                          *self._chunks(hashes['phash']), info.get('format'), info.get('width'), info.get('height'),
+                          time.time()))
+
+    def get(self, sha256):
+        """The hashes indexed for an image, or None"""
+        row = self._connection().execute("SELECT phash, dhash, ahash FROM image_hashes WHERE sha256 = ?",
+                                         (sha256,)).fetchone()
+        return None if row is None else {"phash": row[0] & (1 << 64) - 1, "dhash": int(row[1], 16), "ahash": int(row[2], 16)}
+
+    def search(self, hashes, max_distance=8, limit=20, exclude=None):
+        """Indexed images whose pHash is within max_distance bits of hashes['phash'], closest first"""
+        max_distance = min(max_distance, self.MAX_DISTANCE)
+        flips = [mask for n in range(max_distance // self.CHUNKS + 1) for mask in self._flips[n]]
+        conn = self._connection()
+        query_hash = self._signed(hashes['phash'])
+        distances = {}
+        for chunk, value in enumerate(self._chunks(hashes['phash'])):
+            probes = [value ^ mask for mask in flips]
+            query = f"SELECT rowid, phash FROM image_hashes WHERE c{chunk} IN ({','.join('?' * len(probes))})"
+            for rowid, phash in conn.execute(query, probes):
+                distance = ((phash ^ query_hash) & (1 << 64) - 1).bit_count()
+                if distance <= max_distance:
+                    distances[rowid] = distance
+        if not distances:
+            return []
+
+        matches = []
+        # Only the closest are looked up, with one spare for the excluded query image
+        rowids = sorted(distances, key=distances.get)[:limit + 1]
+        query = (f"SELECT rowid, sha256, phash, dhash, ahash, format, width, height, first_seen FROM image_hashes "
+                 f"WHERE rowid IN ({','.join('?' * len(rowids))})")
+        for rowid, sha256, phash, dhash, ahash, image_format, width, height, first_seen in conn.execute(query, rowids):
+            if sha256 == exclude:
+                continue
+            match = {"sha256": sha256, "distance": distances[rowid], "phash": f"{phash & (1 << 64) - 1:016x}",
+                     "dhash": dhash, "ahash": ahash,
+                     "format": image_format, "width": width, "height": height,
+                     "first_seen": datetime.fromtimestamp(first_seen).isoformat()}
+            for name, value in (('dhash', dhash), ('ahash', ahash)):
+                if name in hashes:
+                    match[f"{name}_distance"] = (int(value, 16) ^ hashes[name]).bit_count()
+            matches.append(match)
+        matches.sort(key=lambda match: (match['distance'], match.get('dhash_distance', 0)))
+        return matches[:limit]
+
+    def stats(self):
+        # Rows are never deleted, so the largest rowid is the entry count without a full scan
+        indexed = self._connection().execute("SELECT MAX(rowid) FROM image_hashes").fetchone()[0]
+        return {"path": self.path, "indexed": indexed or 0}
+
+def open_image_index():
+    """The ImageIndex at OSINT_IMAGE_INDEX_PATH, or None if it cannot be opened"""
+    path = os.getenv('OSINT_IMAGE_INDEX_PATH')
+    if not path:
+        path = os.path.join(tempfile.gettempdir(), 'osint_images.sqlite3')
+        logger.warning(f"OSINT_IMAGE_INDEX_PATH is not set, indexing images in {path}, which may not survive a restart")
+    try:
+        return ImageIndex(path)
+    except sqlite3.Error as e:
+        logger.warning(f"Image index {path} unavailable ({str(e)}), similar-image search disabled")
+        return None
+
 class OSINTToolManager:
     def __init__(self):
         self.api_keys = {
@@ -61,66 +1887,575 @@ class OSINTToolManager:
             'epieos': os.getenv('EPIEOS_API_KEY'),
             'shodan': os.getenv('SHODAN_API_KEY', 'a72Q4g76UyurRjlrLp2O8eVkPvGfpheB')
         }
+        # One keep-alive session (and connection pool) per upstream provider
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        # Upstream responses, keyed by provider and normalized target
+        self.lookup_cache = LookupCache(create_cache_backend())
+        self.single_flight = SingleFlight()
+        # AI analyses, keyed by provider, model, prompt and results digest
+        self.ai_cache = LookupCache(self.lookup_cache.backend, name='ai')
+        # Upload analyses by content hash, with the uploads themselves in OSINT_UPLOAD_STORE_DIR
+        self.upload_cache = LookupCache(self.lookup_cache.backend, name='upload')
+        store_dir = os.getenv('OSINT_UPLOAD_STORE_DIR')
+        self.blob_store = BlobStore(store_dir) if store_dir else None
+        self.image_index = open_image_index()
+        # Time to first token of streamed AI analyses, and total time of
+        # uncached analyses, per provider
+        self.ai_ttft = LatencyStats()
+        self.ai_latency = LatencyStats()
+        self._ai_executor = ThreadPoolExecutor(max_workers=int(os.getenv('OSINT_AI_WORKERS', 8)),
+                                               thread_name_prefix='osint-ai')
+        self.rate_limiter = RateLimiter(self.lookup_cache.backend)
+        self._breakers = {}
+        # Upstream traffic of the source lookup running on each thread
+        self._source_local = threading.local()
+        # Bounded pool for running the independent source lookups of one target
+        self._executor = ThreadPoolExecutor(max_workers=int(os.getenv('OSINT_FANOUT_WORKERS', 16)),
+                                            thread_name_prefix='osint-source')
+
+    def _session(self, provider):
+        """Get the pooled HTTP session for a provider, creating it on first use"""
+        session = self._sessions.get(provider)
+        if session is not None:
+            return session
+
+        with self._sessions_lock:
+            session = self._sessions.get(provider)
+            if session is None:
+                # Retries are handled by _request, which knows the deadline
+                adapter = HTTPAdapter(pool_connections=provider_setting(provider, 'pool_connections'),
+                                      pool_maxsize=provider_setting(provider, 'pool_maxsize'),
+                                      max_retries=0)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[provider] = session
+        return session
+
+    def breaker(self, provider):
+        """The circuit breaker guarding a provider, created on first use"""
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            with self._sessions_lock:
+                breaker = self._breakers.setdefault(provider, CircuitBreaker(provider))
+        return breaker
+
+    def breaker_states(self):
+        return {provider: breaker.snapshot() for provider, breaker in list(self._breakers.items())}
+
+    def _request(self, provider, method, url, deadline=None, idempotent=None, **kwargs):
+        """Send a request to an upstream provider, retrying transient failures
+
+        Up to the provider's `retries` further attempts are made after a
+        429, after a 5xx or a failed connection for idempotent requests
+        (GET/HEAD/OPTIONS unless idempotent says otherwise), and after
+        connection failures that never reached the provider for the rest.
+        Attempts are spaced by jittered exponential backoff, or the
+        provider's Retry-After, and stop when the next one would not fit in
+        the deadline. The response's `retries` attribute counts them.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in ('GET', 'HEAD', 'OPTIONS')
+        max_retries = provider_setting(provider, 'retries')
+        attempt = 0
+        while True:
+            response = error = retry_after = None
+            try:
+                response = self._send(provider, method, url, deadline, **kwargs)
+            except (SourceTimeout, requests.exceptions.ConnectionError) as e:
+                if attempt >= max_retries or not self._retryable_error(e, idempotent):
+                    raise
+                error = e
+            else:
+                retryable = response.status_code == 429 or (idempotent and response.status_code in (500, 502, 503, 504))
+                if attempt >= max_retries or not retryable:
+                    response.retries = attempt
+                    return response
+                retry_after = retry_after_seconds(response, None)
+
+            ceiling = min(provider_setting(provider, 'retry_backoff_max'),
+                          provider_setting(provider, 'retry_backoff') * 2 ** attempt)
+            delay = random.uniform(0, ceiling)
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if deadline is not None and delay >= deadline.remaining():
+                if error is not None:
+                    raise error
+                response.retries = attempt
+                return response
+
+            if response is not None:
+                response.close()
+            reason = (f"{type(error).__name__}: {redact_url_secrets(str(error))}" if error is not None
+                      else f"HTTP {response.status_code}")
+            logger.info(f"Retrying {provider} (attempt {attempt + 2} of {max_retries + 1}) in {delay:.2f}s after {reason}")
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def _retryable_error(error, idempotent):
+        """Whether a failed attempt may be repeated without risking a duplicate request"""
+        cause = error.__cause__ if isinstance(error, SourceTimeout) else error
+        # Timeouts raised for the deadline or the rate limit never reached the provider,
+        # but there is no time left to retry them either
+        if cause is None:
+            return False
+        if isinstance(cause, requests.exceptions.ConnectTimeout):
+            return True
+        if idempotent:
+            return isinstance(cause, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        reason = cause.args[0] if cause.args else None
+        return isinstance(getattr(reason, 'reason', None), NewConnectionError)
+
+    def _send(self, provider, method, url, deadline=None, **kwargs):
+        """Make one attempt at a provider request over its pooled session
+
+        Fails fast with CircuitOpen while the provider's breaker is open,
+        then waits for the provider's rate limit. The provider's timeouts
+        are clipped to whatever is left of the deadline, and any timeout is
+        raised as SourceTimeout. A timeout only counts against the breaker
+        when the provider's own timeout expired, not one cut short by the
+        deadline.
+        """
+        breaker = self.breaker(provider)
+        breaker.allow()
+        try:
+            self.rate_limiter.acquire(provider, deadline)
+            connect_limit = provider_setting(provider, 'connect_timeout')
+            read_limit = provider_setting(provider, 'read_timeout')
+            connect_timeout, read_timeout = connect_limit, read_limit
+            if deadline is not None:
+                remaining = deadline.remaining()
+                if remaining <= 0:
+                    raise SourceTimeout(f"{provider} skipped, request deadline exhausted")
+                connect_timeout = min(connect_timeout, remaining)
+                read_timeout = min(read_timeout, remaining)
+        except BaseException:
+            breaker.release()
+            raise
+
+        started = time.monotonic()
+        status = 'error'
+        metrics.gauge_add('osint_upstream_requests_in_flight', {'provider': provider})
+        try:
+            response = self._session(provider).request(method, url, timeout=(connect_timeout, read_timeout), **kwargs)
+            status = str(response.status_code)
+        except requests.exceptions.Timeout as e:
+            status = 'timeout'
+            if isinstance(e, requests.exceptions.ConnectTimeout):
+                clipped = connect_timeout < connect_limit
+            else:
+                clipped = read_timeout < read_limit
+            if clipped:
+                # Our deadline ran out first; that says nothing about the provider
+                breaker.release()
+            else:
+                breaker.record(False)
+            raise SourceTimeout(f"{provider} timed out: {redact_url_secrets(str(e))}") from e
+        except Exception:
+            breaker.record(False)
+            raise
+        except BaseException:
+            # GeneratorExit, KeyboardInterrupt: the call was abandoned, not failed
+            breaker.release()
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            upstream = getattr(self._source_local, 'upstream', None)
+            if upstream is not None:
+                upstream['requests'] += 1
+                upstream['seconds'] += elapsed
+                if status not in ('error', 'timeout'):
+                    # Streamed bodies are not read yet; count what the provider announced
+                    upstream['bytes'] += (int(response.headers.get('Content-Length', 0) or 0)
+                                          if kwargs.get('stream') else len(response.content))
+            metrics.gauge_add('osint_upstream_requests_in_flight', {'provider': provider}, -1)
+            metrics.inc('osint_upstream_requests_total', {'provider': provider, 'status': status})
+            metrics.observe('osint_upstream_duration_seconds', {'provider': provider}, elapsed)
+        breaker.record(response.status_code < 500 and elapsed <= provider_setting(provider, 'breaker_slow_call'))
+        self.rate_limiter.observe(provider, response)
+        return response
+
+    def _lookup_request(self, provider, kind, target, url, deadline=None):
+        """GET a provider lookup through the result cache
+
+        kind names what target is ('ip', 'email', ...) so that it can be
+        normalized; the cache key is provider, kind and normalized target.
+        """
+        key = f"{provider}:{kind}:{normalize_target(kind, target)}"
+        cached = self.lookup_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # Identical lookups already in flight share one upstream call
+        return self.single_flight.do(key, lambda: self._fetch_and_cache(provider, key, url, deadline), deadline)
+
+    def _fetch_and_cache(self, provider, key, url, deadline=None):
+        live = self._request(provider, 'GET', url, deadline=deadline)
+        response = ProviderResponse(live.status_code, live.content, retries=live.retries)
+        ttl = self._cache_ttl(provider, response)
+        if ttl > 0:
+            self.lookup_cache.set(key, response, ttl)
+        return response
+
+    def _cache_ttl(self, provider, response):
+        """Seconds a provider response may be cached: positive, negative or 0 for never"""
+        if response.status_code == 404:
+            return provider_setting(provider, 'negative_ttl')
+        if response.status_code != 200:
+            return 0
+
+        try:
+            body = response.json()
+        except ValueError:
+            return 0
+        if isinstance(body, dict):
+            # API-level failures (bad key, quota, rate limit) must be retried later
+            if body.get('success') is False or body.get('reason') == 'RateLimited':
+                return 0
+            # Well-formed answers that the target is invalid, reserved, unknown...
+            if body.get('valid') is False or body.get('error'):
+                return provider_setting(provider, 'negative_ttl')
+        return provider_setting(provider, 'cache_ttl')
+
+    def _with_meta(self, envelope, response):
+        """Record where a source's data came from in its envelope"""
+        envelope['meta'] = {"cache": "hit" if response.from_cache else "miss"}
+        if response.from_cache:
+            envelope['meta']['age_seconds'] = round(time.time() - response.cached_at, 1)
+        if response.coalesced:
+            envelope['meta']['coalesced'] = True
+        if response.retries:
+            envelope['meta']['retries'] = response.retries
+        return envelope
 
-    def call_ai_api(self, provider, prompt, results=None):
+    def call_ai_api(self, provider, prompt, results=None, deadline=None, targets=1):
         """Call AI APIs (ChatGPT, Gemini, Grok) for analysis"""
         if not self.api_keys.get(provider):
             return {"error": f"{provider.upper()} API key not configured"}
         
         try:
-            if provider == 'openai':
-                return self._call_openai(prompt, results)
-            elif provider == 'gemini':
-                return self._call_gemini(prompt, results)
+            if provider in ('openai', 'gemini'):
+                return self._cached_ai_call(provider, prompt, results, deadline, targets)
             elif provider == 'grok':
                 return self._call_grok(prompt, results)
+        except SourceTimeout as e:
+            return {"error": "timeout", "message": str(e)}
+        except CircuitOpen as e:
+            return {"error": "circuit_open", "message": str(e)}
         except Exception as e:
             return {"error": f"AI API error: {str(e)}"}
 
-    def _call_openai(self, prompt, results=None):
+    def ai_route(self, preferred, policy=None):
+        """Providers to try for an analysis, in order, under the routing policy"""
+        policy = policy or AI_ROUTING
+        if policy == 'fixed' or preferred not in AI_PROVIDERS:
+            return [preferred]
+        configured = [p for p in AI_PROVIDERS if self.api_keys.get(p)]
+        if not configured:
+            return [preferred]
+        # Preferred provider first, the others in their usual order
+        order = sorted(configured, key=lambda p: p != preferred)
+        if policy in ('fastest', 'hedged'):
+            # Providers without samples yet go first, so that they get some
+            order = sorted(order, key=lambda p: self.ai_latency.percentile(p, 95) or 0)
+        # Providers whose breaker is open are only tried last
+        return sorted(order, key=lambda p: self.breaker(p).state == 'open')
+
+    def route_ai_api(self, preferred, prompt, results=None, deadline=None, policy=None, targets=1):
+        """Analyze results with whichever AI provider the routing policy picks
+
+        An analysis already cached for any candidate provider is returned
+        directly. The envelope's meta records the provider that answered.
+        targets is how many targets the prompt covers, which scales its
+        token budgets.
+        """
+        policy = policy or AI_ROUTING
+        providers = self.ai_route(preferred, policy)
+        if len(providers) == 1:
+            return self._timed_ai_call(providers[0], prompt, results, deadline, targets)
+
+        cached = self.cached_analysis(providers, prompt, results)
+        if cached is not None:
+            return cached
+
+        if policy == 'hedged':
+            return self._race_ai(providers, prompt, results, deadline, targets)
+
+        analysis = None
+        for provider in providers:
+            if deadline is not None and deadline.expired():
+                break
+            analysis = self._timed_ai_call(provider, prompt, results, deadline, targets)
+            if 'analysis' in analysis:
+                break
+        return analysis or {"error": "timeout", "message": "No AI provider answered in time"}
+
+    def cached_analysis(self, providers, prompt, results=None):
+        """An analysis already cached for any of the providers, or None"""
+        for provider in providers:
+            if provider not in AI_PROVIDERS:
+                continue
+            cached = self.ai_cache.get(self._ai_cache_key(provider, prompt, results))
+            if cached is not None:
+                analysis = self._with_meta(cached.json(), cached)
+                analysis['meta']['provider'] = provider
+                return analysis
+        return None
+
+    def _race_ai(self, providers, prompt, results=None, deadline=None, targets=1):
+        """Hedged requests: start the next provider whenever the running ones are slow or fail"""
+        waiting = list(providers)
+        running = {}
+        analysis = None
+
+        def launch():
+            provider = waiting.pop(0)
+            running[self._ai_executor.submit(self._timed_ai_call, provider, prompt, results, deadline, targets)] = provider
+
+        launch()
+        while running:
+            timeout = deadline.remaining() if deadline else None
+            if waiting:
+                hedge_after = AI_HEDGE_AFTER or self.ai_latency.percentile(running[next(iter(running))], 95) or AI_HEDGE_DEFAULT
+                timeout = hedge_after if timeout is None else min(timeout, hedge_after)
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if not waiting or (deadline is not None and deadline.expired()):
+                    break
+                launch()
+                continue
+            for future in done:
+                running.pop(future)
+                analysis = future.result()
+                # Losing requests finish in the background and still fill the cache
+                if 'analysis' in analysis:
+                    return analysis
+                if waiting:
+                    launch()
+        return analysis or {"error": "timeout", "message": "No AI provider answered in time"}
+
+    def _timed_ai_call(self, provider, prompt, results=None, deadline=None, targets=1):
+        """call_ai_api, recording the provider's latency when it was really asked"""
+        started = time.monotonic()
+        analysis = self.call_ai_api(provider, prompt, results, deadline, targets)
+        meta = analysis.setdefault('meta', {})
+        if meta.get('cache') == 'miss' and not meta.get('coalesced'):
+            if 'analysis' in analysis or analysis.get('error') == 'timeout':
+                self.ai_latency.record(provider, time.monotonic() - started)
+        meta['provider'] = provider
+        return analysis
+
+    def _cached_ai_call(self, provider, prompt, results=None, deadline=None, targets=1):
+        """Reuse the analysis of identical results for the same provider, model and prompt"""
+        key = self._ai_cache_key(provider, prompt, results)
+        cached = self.ai_cache.get(key)
+        if cached is not None:
+            return self._with_meta(cached.json(), cached)
+
+        def analyze():
+            call = self._call_openai if provider == 'openai' else self._call_gemini
+            analysis = call(prompt, results, deadline, targets)
+            return self._store_analysis(provider, key, analysis)
+
+        # The same analysis requested twice at once is only paid for once
+        response = self.single_flight.do(key, analyze, deadline)
+        return self._with_meta(response.json(), response)
+
+    def store_analysis(self, provider, prompt, results, analysis):
+        """Cache an analysis obtained some other way (e.g. split from a batch)"""
+        if provider in AI_PROVIDERS:
+            self._store_analysis(provider, self._ai_cache_key(provider, prompt, results), analysis)
+
+    def _ai_cache_key(self, provider, prompt, results=None):
+        model = provider_setting(provider, 'model')
+        digest = hashlib.sha256(f"{provider}\0{model}\0{prompt}\0{results_digest(results)}".encode('utf-8')).hexdigest()
+        return f"ai:{provider}:{digest}"
+
+    def _store_analysis(self, provider, key, analysis):
+        response = ProviderResponse(200, json.dumps(analysis).encode('utf-8'))
+        ttl = provider_setting(provider, 'cache_ttl')
+        # Only real analyses are kept; errors are retried next time
+        if 'analysis' in analysis and ttl > 0:
+            self.ai_cache.set(key, response, ttl)
+        return response
+
+    def stream_ai_api(self, provider, prompt, results=None, deadline=None):
+        """Run an AI analysis, yielding {"text": ...} chunks as they are generated
+
+        The last item is the complete envelope, as call_ai_api would return
+        it. OpenAI and Gemini are streamed token by token; cached analyses
+        and other providers arrive as a single chunk.
+        """
+        if provider not in ('openai', 'gemini') or not self.api_keys.get(provider):
+            analysis = self.call_ai_api(provider, prompt, results, deadline)
+            if 'analysis' in analysis:
+                yield {"text": analysis['analysis']}
+            yield analysis
+            return
+
+        key = self._ai_cache_key(provider, prompt, results)
+        cached = self.ai_cache.get(key)
+        if cached is not None:
+            analysis = self._with_meta(cached.json(), cached)
+            yield {"text": analysis['analysis']}
+            yield analysis
+            return
+
+        stream = self._stream_openai if provider == 'openai' else self._stream_gemini
+        started = time.monotonic()
+        parts = []
+        try:
+            for text in stream(prompt, results, deadline):
+                if not parts:
+                    self.ai_ttft.record(provider, time.monotonic() - started)
+                parts.append(text)
+                yield {"text": text}
+        except SourceTimeout as e:
+            yield {"error": "timeout", "message": str(e)}
+            return
+        except CircuitOpen as e:
+            yield {"error": "circuit_open", "message": str(e)}
+            return
+        except Exception as e:
+            yield {"error": f"AI API error: {str(e)}"}
+            return
+
+        analysis = {"analysis": ''.join(parts) or 'No response'}
+        response = self._store_analysis(provider, key, analysis)
+        yield self._with_meta(analysis, response)
+
+    def _sse_payloads(self, provider, response, deadline=None):
+        """Parse the data: lines of a streaming provider response as JSON"""
+        # Event streams are UTF-8, whatever requests guesses for text/* bodies
+        response.encoding = 'utf-8'
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if deadline is not None and deadline.expired():
+                    raise SourceTimeout(f"{provider} stream cut off by the request deadline")
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[5:].strip()
+                if payload == '[DONE]':
+                    return
+                yield json.loads(payload)
+        except requests.exceptions.ConnectionError as e:
+            # Read timeouts between chunks surface as connection errors
+            if 'timed out' in str(e).lower():
+                raise SourceTimeout(f"{provider} timed out: {redact_url_secrets(str(e))}") from e
+            raise
+        finally:
+            response.close()
+
+    def _stream_openai(self, prompt, results=None, deadline=None):
+        """Stream an OpenAI chat completion, yielding content deltas"""
+        headers = {
+            'Authorization': f'Bearer {self.api_keys["openai"]}',
+            'Content-Type': 'application/json'
+        }
+        content = ai_prompt_content(prompt, results)
+        data = {
+            "model": provider_setting('openai', 'model'),
+            "messages": [{"role": "user", "content": content}],
+            "max_tokens": ai_output_tokens('openai', content),
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        # Completions have no side effects, so failed ones are safe to retry
+        response = self._request('openai', 'POST', 'https://api.openai.com/v1/chat/completions',
+                                 deadline=deadline, idempotent=True, headers=headers, json=data, stream=True)
+        if response.status_code != 200:
+            raise RuntimeError(f"OpenAI HTTP {response.status_code}: {response.text[:200]}")
+
+        for chunk in self._sse_payloads('openai', response, deadline):
+            # The last chunk carries no choices, only the token usage
+            record_ai_usage('openai', chunk.get('usage'), 'prompt_tokens', 'completion_tokens')
+            text = (chunk.get('choices') or [{}])[0].get('delta', {}).get('content')
+            if text:
+                yield text
+
+    def _stream_gemini(self, prompt, results=None, deadline=None):
+        """Stream a Gemini generation, yielding text parts"""
+        content = ai_prompt_content(prompt, results)
+        data = {
+            "contents": [{"parts": [{"text": content}]}],
+            "generationConfig": {
+                "temperature": 0.7,
+                "maxOutputTokens": ai_output_tokens('gemini', content)
+            }
+        }
+        url = (f"https://generativelanguage.googleapis.com/v1/models/{provider_setting('gemini', 'model')}"
+               f":streamGenerateContent?alt=sse&key={self.api_keys['gemini']}")
+        response = self._request('gemini', 'POST', url, deadline=deadline, idempotent=True,
+                                 headers={'Content-Type': 'application/json'}, json=data, stream=True)
+        if response.status_code != 200:
+            raise RuntimeError(f"Gemini HTTP {response.status_code}: {response.text[:200]}")
+
+        usage = None
+        for chunk in self._sse_payloads('gemini', response, deadline):
+            # Every chunk reports the usage so far; only the last one counts
+            usage = chunk.get('usageMetadata', usage)
+            for candidate in chunk.get('candidates', [])[:1]:
+                for part in candidate.get('content', {}).get('parts', []):
+                    if part.get('text'):
+                        yield part['text']
+        record_ai_usage('gemini', usage, 'promptTokenCount', 'candidatesTokenCount')
+
+    def _call_openai(self, prompt, results=None, deadline=None, targets=1):
         """Call OpenAI ChatGPT API"""
         headers = {
             'Authorization': f'Bearer {self.api_keys["openai"]}',
             'Content-Type': 'application/json'
         }
         
-        content = f"{prompt}\n\nOSINT Results:\n{json.dumps(results, indent=2) if results else 'No results available'}"
+        content = ai_prompt_content(prompt, results, targets)
         
         data = {
-            "model": "gpt-4",
+            "model": provider_setting('openai', 'model'),
             "messages": [{"role": "user", "content": content}],
-            "max_tokens": 1000
+            "max_tokens": ai_output_tokens('openai', content, targets)
         }
         
         try:
-            response = requests.post('https://api.openai.com/v1/chat/completions', 
-                                  headers=headers, json=data)
+            # Completions have no side effects, so failed ones are safe to retry
+            response = self._request('openai', 'POST', 'https://api.openai.com/v1/chat/completions',
+                                     deadline=deadline, idempotent=True, headers=headers, json=data)
+            if response.status_code != 200:
+                return {"error": f"OpenAI API error: HTTP {response.status_code}: {response.text[:200]}"}
             result = response.json()
+            record_ai_usage('openai', result.get('usage'), 'prompt_tokens', 'completion_tokens')
             return {"analysis": result.get('choices', [{}])[0].get('message', {}).get('content', 'No response')}
+        except (SourceTimeout, CircuitOpen):
+            raise
         except Exception as e:
             return {"error": f"OpenAI API error: {str(e)}"}
 
-    def _call_gemini(self, prompt, results=None):
+    def _call_gemini(self, prompt, results=None, deadline=None, targets=1):
         """Call Google Gemini API"""
         headers = {
             'Content-Type': 'application/json'
         }
         
-        content = f"{prompt}\n\nOSINT Results:\n{json.dumps(results, indent=2) if results else 'No results available'}"
+        content = ai_prompt_content(prompt, results, targets)
         
         data = {
             "contents": [{"parts": [{"text": content}]}],
             "generationConfig": {
                 "temperature": 0.7,
-                "maxOutputTokens": 1000
+                "maxOutputTokens": ai_output_tokens('gemini', content, targets)
             }
         }
         
-        url = f"https://generativelanguage.googleapis.com/v1/models/gemini-1.5-pro:generateContent?key={self.api_keys['gemini']}"
+        url = f"https://generativelanguage.googleapis.com/v1/models/{provider_setting('gemini', 'model')}:generateContent?key={self.api_keys['gemini']}"
         
         try:
-            response = requests.post(url, headers=headers, json=data)
+            response = self._request('gemini', 'POST', url, deadline=deadline, idempotent=True,
+                                     headers=headers, json=data)
+            if response.status_code != 200:
+                return {"error": f"Gemini API error: HTTP {response.status_code}: {response.text[:200]}"}
             result = response.json()
+            record_ai_usage('gemini', result.get('usageMetadata'), 'promptTokenCount', 'candidatesTokenCount')
             
             if 'candidates' in result and result['candidates']:
                 candidate = result['candidates'][0]
@@ -130,6 +2465,8 @@ class OSINTToolManager:
                         return {"analysis": parts[0]['text']}
             
             return {"analysis": f"Gemini Response: {str(result)}"}
+        except (SourceTimeout, CircuitOpen):
+            raise
         except Exception as e:
             return {"error": f"Gemini API error: {str(e)}"}
 
@@ -137,6 +2474,80 @@ class OSINTToolManager:
         """Call Grok API (placeholder - replace with actual Grok API)"""
         return {"analysis": "Grok analysis placeholder - API not publicly available"}
 
+    def _fan_out(self, results, sources, deadline=None, on_result=None):
+        """Run independent source lookups concurrently and merge them into results
+
+        sources maps a result name to a (function, *args) tuple. Each function
+        returns the usual {"success": ..., "data"/"error": ...} envelope, so
+        an endpoint takes as long as its slowest source rather than the sum.
+        Sources still running when the deadline passes get a timeout envelope.
+        on_result(name, envelope) is called for the results already present
+        and then for each source as soon as it finishes.
+        """
+        budget = deadline.remaining() if deadline else None
+        timings = REQUEST_TIMINGS.get()
+        if on_result:
+            for name, envelope in results.items():
+                on_result(name, envelope)
+
+        submitted = time.monotonic()
+        pending = {self._executor.submit(self._run_source, func, *args, deadline=deadline, name=name,
+                                         timings=timings, submitted=submitted): name
+                   for name, (func, *args) in sources.items()}
+        finished = {}
+        while pending:
+            done, _ = wait(pending, timeout=deadline.remaining() if deadline else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                name = pending.pop(future)
+                finished[name] = future.result()
+                if on_result:
+                    on_result(name, finished[name])
+
+        for future, name in pending.items():
+            future.cancel()
+            finished[name] = timeout_envelope(budget)
+            if timings is not None:
+                timings.source(name, time.monotonic() - submitted, envelope=finished[name])
+            if on_result:
+                on_result(name, finished[name])
+
+        # Merge in declaration order so the response layout does not depend on timing
+        for name in sources:
+            results[name] = finished[name]
+        return results
+
+    def _run_source(self, func, *args, deadline=None, name=None, timings=None, submitted=None):
+        """Run one source lookup, turning unexpected failures into an error envelope"""
+        started = time.monotonic()
+        upstream = self._source_local.upstream = {"requests": 0, "seconds": 0.0, "bytes": 0}
+        try:
+            envelope = func(*args, deadline=deadline)
+        except SourceTimeout:
+            envelope = timeout_envelope()
+        except CircuitOpen as e:
+            envelope = circuit_open_envelope(e)
+        except Exception as e:
+            logger.error(f"Source {func.__name__} failed: {str(e)}")
+            envelope = {"success": False, "error": str(e)}
+        finally:
+            self._source_local.upstream = None
+
+        source = name or func.__name__
+        if timings is not None:
+            timings.source(source, time.monotonic() - started, started - (submitted or started), envelope, upstream)
+        if envelope.get('success'):
+            outcome = 'success'
+        elif envelope.get('error') in ('timeout', 'circuit_open'):
+            outcome = envelope['error']
+        else:
+            outcome = 'error'
+        metrics.observe('osint_source_duration_seconds', {'source': source}, time.monotonic() - started)
+        metrics.inc('osint_source_results_total', {'source': source, 'outcome': outcome})
+        return envelope
+
     def run_command(self, command, timeout=30):
         """Run a command with timeout and error handling"""
         try:
@@ -160,7 +2571,7 @@ class OSINTToolManager:
             return {"success": False, "error": str(e)}
 
     # Phone Number OSINT Methods
-    def phone_osint(self, phone_number):
+    def phone_osint(self, phone_number, deadline=None, on_result=None):
         """Run all phone number OSINT tools"""
         results = {}
         
@@ -193,41 +2604,49 @@ class OSINTToolManager:
             }
         }
 
-        # NumVerify API lookup
+        # Upstream lookups
+        return self._fan_out(results, {
+            'NumLookup': (self._numverify_lookup, phone_number)
+        }, deadline, on_result)
+
+    def _numverify_lookup(self, phone_number, deadline=None):
+        """NumVerify API lookup"""
         try:
-            if self.api_keys.get('numverify'):
-                response = requests.get(f"http://apilayer.net/api/validate?access_key={self.api_keys['numverify']}&number={phone_number}")
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get('valid'):
-                        results['NumLookup'] = {
-                            "success": True, 
-                            "data": {
-                                "valid": data.get('valid'),
-                                "number": data.get('number'),
-                                "local_format": data.get('local_format'),
-                                "international_format": data.get('international_format'),
-                                "country_prefix": data.get('country_prefix'),
-                                "country_code": data.get('country_code'),
-                                "country_name": data.get('country_name'),
-                                "location": data.get('location'),
-                                "carrier": data.get('carrier'),
-                                "line_type": data.get('line_type')
-                            }
-                        }
-                    else:
-                        results['NumLookup'] = {"success": False, "error": "Invalid phone number"}
-                else:
-                    results['NumLookup'] = {"success": False, "error": f"API error: {response.status_code}"}
+            if not self.api_keys.get('numverify'):
+                return {"success": False, "error": "NumVerify API key not configured"}
+
+            response = self._lookup_request('numverify', 'phone', phone_number,
+                                            f"http://apilayer.net/api/validate?access_key={self.api_keys['numverify']}&number={phone_number}",
+                                            deadline=deadline)
+            if response.status_code != 200:
+                envelope = {"success": False, "error": f"API error: {response.status_code}"}
+            elif not response.json().get('valid'):
+                envelope = {"success": False, "error": "Invalid phone number"}
             else:
-                results['NumLookup'] = {"success": False, "error": "NumVerify API key not configured"}
+                data = response.json()
+                envelope = {
+                    "success": True, 
+                    "data": {
+                        "valid": data.get('valid'),
+                        "number": data.get('number'),
+                        "local_format": data.get('local_format'),
+                        "international_format": data.get('international_format'),
+                        "country_prefix": data.get('country_prefix'),
+                        "country_code": data.get('country_code'),
+                        "country_name": data.get('country_name'),
+                        "location": data.get('location'),
+                        "carrier": data.get('carrier'),
+                        "line_type": data.get('line_type')
+                    }
+                }
+            return self._with_meta(envelope, response)
+        except (SourceTimeout, CircuitOpen):
+            raise
         except Exception as e:
-            results['NumLookup'] = {"success": False, "error": str(e)}
-
-        return results
+            return {"success": False, "error": str(e)}
 
     # Email OSINT Methods
-    def email_osint(self, email):
+    def email_osint(self, email, deadline=None, on_result=None):
         """Run all email OSINT tools"""
         results = {}
         
@@ -259,76 +2678,98 @@ class OSINTToolManager:
             }
         }
 
-        # Free email API
+        # Upstream lookups
+        return self._fan_out(results, {
+            'EmailRep': (self._emailrep_lookup, email)
+        }, deadline, on_result)
+
+    def _emailrep_lookup(self, email, deadline=None):
+        """Free EmailRep.io reputation lookup"""
         try:
-            response = requests.get(f"https://emailrep.io/{email}")
+            response = self._lookup_request('emailrep', 'email', email, f"https://emailrep.io/{email}", deadline=deadline)
             if response.status_code == 200:
-                results['EmailRep'] = {"success": True, "data": response.json()}
+                envelope = {"success": True, "data": response.json()}
             else:
-                results['EmailRep'] = {"success": False, "error": "API unavailable"}
+                envelope = {"success": False, "error": "API unavailable"}
+            return self._with_meta(envelope, response)
+        except (SourceTimeout, CircuitOpen):
+            raise
         except Exception as e:
-            results['EmailRep'] = {"success": False, "error": str(e)}
+            return {"success": False, "error": str(e)}
 
+    # Image OSINT Methods
+    def image_osint(self, image, exif_groups=EXIF_DEFAULT_GROUPS):
+        """Run all image OSINT tools on upload bytes, an UploadSpool or a DecodedImage"""
+        fingerprint = upload_fingerprint(image)
+        results = self._memoized_upload('image', image, lambda m: self._image_osint(m, exif_groups),
+                                        ','.join(exif_groups), fingerprint=fingerprint)
+        hashes = results.get('Perceptual_Hashes', {})
+        if hashes.get('success') and self.image_index is not None:
+            # Every analyzed image can be found again with /api/image/similar
+            try:
+                self.image_index.add(fingerprint['sha256'], {name: int(value, 16) for name, value in hashes['data'].items()},
+                                     results['Image_Analysis'].get('data'))
+            except sqlite3.Error as e:
+                logger.warning(f"Indexing image {fingerprint['sha256']} failed: {str(e)}")
         return results
 
-    # Image OSINT Methods
-    def image_osint(self, image_data):
-        """Run all image OSINT tools"""
+    def _memoized_upload(self, kind, media, analyze, variant=None, fingerprint=None):
+        """Run an upload analyzer once per distinct content and replay its results afterwards"""
+        fingerprint = fingerprint or upload_fingerprint(media)
+        key = f"upload:{kind}:{variant + ':' if variant else ''}{fingerprint['sha256']}"
+        response = self.upload_cache.get(key)
+        if response is None:
+            def run():
+                results = analyze(media)
+                analyzed = ProviderResponse(200, json.dumps(results).encode('utf-8'))
+                failed = any(not envelope.get('success') and envelope.get('retryable', True)
+                             for envelope in results.values())
+                ttl = min(UPLOAD_CACHE_TTL, UPLOAD_NEGATIVE_TTL) if failed else UPLOAD_CACHE_TTL
+                if ttl > 0:
+                    self.upload_cache.set(key, analyzed, ttl)
+                if self.blob_store is not None:
+                    try:
+                        self.blob_store.put(media, fingerprint['sha256'])
+                    except OSError as e:
+                        logger.warning(f"Storing upload {fingerprint['sha256']} failed: {str(e)}")
+                return analyzed
+
+            # The same file uploaded twice at once is only analyzed once
+            response = self.single_flight.do(key, run)
+        results = response.json()
+        for envelope in results.values():
+            self._with_meta(envelope, response)
+        return results
+
+    def _image_osint(self, image, exif_groups):
         results = {}
-        
-        # Save image to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            tmp_file.write(image_data)
-            image_path = tmp_file.name
+        image = DecodedImage.of(image)
 
-        try:
-            # Basic image analysis
-            try:
-                with Image.open(image_path) as img:
-                    results['Image_Analysis'] = {
-                        "success": True,
-                        "data": {
-                            "format": img.format,
-                            "mode": img.mode,
-                            "size": img.size,
-                            "width": img.width,
-                            "height": img.height
-                        }
-                    }
-            except Exception as e:
-                results['Image_Analysis'] = {"success": False, "error": str(e)}
+        # Basic image analysis
+        results['Image_Analysis'] = image.analysis_envelope()
 
-            # EXIF data (basic)
-            try:
-                with Image.open(image_path) as img:
-                    exif_data = img.getexif()
-                    if exif_data:
-                        # Convert EXIF data to JSON-serializable format
-                        exif_dict = {}
-                        for tag_id, value in exif_data.items():
-                            try:
-                                # Convert rational numbers and other non-serializable types
-                                if hasattr(value, 'numerator') and hasattr(value, 'denominator'):
-                                    exif_dict[str(tag_id)] = float(value.numerator) / float(value.denominator)
-                                else:
-                                    exif_dict[str(tag_id)] = str(value)
-                            except:
-                                exif_dict[str(tag_id)] = str(value)
-                        results['EXIF_Data'] = {"success": True, "data": exif_dict}
-                    else:
-                        results['EXIF_Data'] = {"success": True, "data": {"message": "No EXIF data found"}}
-            except Exception as e:
-                results['EXIF_Data'] = {"success": False, "error": str(e)}
+        # EXIF data, only the groups asked for
+        try:
+            exif = image.exif
+            if exif:
+                results['EXIF_Data'] = {"success": True, "data": {group: exif.group(group) for group in exif_groups}}
+            else:
+                results['EXIF_Data'] = {"success": True, "data": {"message": "No EXIF data found"}}
+        except Exception as e:
+            results['EXIF_Data'] = image.failure(e)
 
-        finally:
-            # Clean up temporary file
-            if os.path.exists(image_path):
-                os.unlink(image_path)
+        # Perceptual hashes, for finding near-duplicates
+        try:
+            hashes = perceptual_hashes(image.image)
+            results['Perceptual_Hashes'] = {"success": True,
+                                            "data": {name: f"{value:016x}" for name, value in hashes.items()}}
+        except Exception as e:
+            results['Perceptual_Hashes'] = image.failure(e)
 
         return results
 
     # Website OSINT Methods
-    def website_osint(self, domain):
+    def website_osint(self, domain, deadline=None, on_result=None):
         """Run all website OSINT tools"""
         results = {}
         
@@ -370,52 +2811,59 @@ class OSINTToolManager:
             }
         }
         
-        # Shodan search for domain
+        # Upstream lookups
+        return self._fan_out(results, {
+            'Shodan_Search': (self._shodan_domain_search, domain)
+        }, deadline, on_result)
+
+    def _shodan_domain_search(self, domain, deadline=None):
+        """Shodan search for hosts matching a domain"""
         try:
-            if self.api_keys.get('shodan'):
-                # Search for the domain in Shodan
-                shodan_url = f"https://api.shodan.io/shodan/host/search?key={self.api_keys['shodan']}&query=hostname:{domain}"
-                response = requests.get(shodan_url)
-                
-                if response.status_code == 200:
-                    shodan_data = response.json()
-                    results['Shodan_Search'] = {
-                        "success": True,
-                        "data": {
-                            "total_results": shodan_data.get('total', 0),
-                            "matches": shodan_data.get('matches', []),
-                            "message": f"Found {shodan_data.get('total', 0)} Shodan results for {domain}"
-                        }
-                    }
-                elif response.status_code == 403:
-                    # Free plan limitation
-                    results['Shodan_Search'] = {
-                        "success": False,
-                        "error": "Shodan search requires paid membership. Free plan has limited access.",
-                        "upgrade_info": {
-                            "current_plan": "oss (Open Source Software)",
-                            "recommendation": "Upgrade to Membership or Professional plan for full search access",
-                            "alternative": "Use Shodan web interface for manual searches"
-                        }
+            if not self.api_keys.get('shodan'):
+                return {
+                    "success": False,
+                    "error": "Shodan API key not configured"
+                }
+
+            # Search for the domain in Shodan
+            shodan_url = f"https://api.shodan.io/shodan/host/search?key={self.api_keys['shodan']}&query=hostname:{domain}"
+            response = self._lookup_request('shodan', 'domain', domain, shodan_url, deadline=deadline)
+            
+            if response.status_code == 200:
+                shodan_data = response.json()
+                envelope = {
+                    "success": True,
+                    "data": {
+                        "total_results": shodan_data.get('total', 0),
+                        "matches": shodan_data.get('matches', []),
+                        "message": f"Found {shodan_data.get('total', 0)} Shodan results for {domain}"
                     }
-                else:
-                    results['Shodan_Search'] = {
-                        "success": False,
-                        "error": f"Shodan API error: {response.status_code} - {response.text}"
+                }
+            elif response.status_code == 403:
+                # Free plan limitation
+                envelope = {
+                    "success": False,
+                    "error": "Shodan search requires paid membership. Free plan has limited access.",
+                    "upgrade_info": {
+                        "current_plan": "oss (Open Source Software)",
+                        "recommendation": "Upgrade to Membership or Professional plan for full search access",
+                        "alternative": "Use Shodan web interface for manual searches"
                     }
+                }
             else:
-                results['Shodan_Search'] = {
+                envelope = {
                     "success": False,
-                    "error": "Shodan API key not configured"
+                    "error": f"Shodan API error: {response.status_code} - {response.text}"
                 }
+            return self._with_meta(envelope, response)
+        except (SourceTimeout, CircuitOpen):
+            raise
         except Exception as e:
-            results['Shodan_Search'] = {
+            return {
                 "success": False,
                 "error": f"Shodan search failed: {str(e)}"
             }
 
-        return results
-
     # Social Media OSINT Methods
     def social_media_osint(self, username):
         """Run all social media OSINT tools"""
@@ -463,22 +2911,32 @@ class OSINTToolManager:
         return results
 
     # Video OSINT Methods
-    def video_osint(self, video_data):
-        """Run all video OSINT tools"""
+    def video_osint(self, video):
+        """Run all video OSINT tools on upload bytes or an UploadSpool"""
+        # Installing moviepy gives the same video new results
+        return self._memoized_upload('video', video, self._video_osint, 'metadata' if MOVIEPY_AVAILABLE else None)
+
+    def _video_osint(self, video):
         results = {}
         
-        # Save video to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
-            tmp_file.write(video_data)
-            video_path = tmp_file.name
+        if isinstance(video, UploadSpool):
+            # Read the spooled upload in place
+            video_path = video.on_disk()
+            size_bytes = video.size_bytes
+        else:
+            # Save video to temporary file
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as tmp_file:
+                tmp_file.write(video)
+                video_path = tmp_file.name
+            size_bytes = len(video)
 
         try:
             # Basic video analysis
             results['Video_Analysis'] = {
                 "success": True,
                 "data": {
-                    "size_bytes": len(video_data),
-                    "size_mb": round(len(video_data) / (1024 * 1024), 2),
+                    "size_bytes": size_bytes,
+                    "size_mb": round(size_bytes / (1024 * 1024), 2),
                     "message": "Basic video analysis completed"
                 }
             }
@@ -506,7 +2964,8 @@ class OSINTToolManager:
                 results['Video_Metadata'] = {
                     "success": False,
                     "error": "MoviePy not available - advanced video analysis disabled",
-                    "message": "Video analysis requires MoviePy library"
+                    "message": "Video analysis requires MoviePy library",
+                    "retryable": False
                 }
             except Exception as e:
                 results['Video_Metadata'] = {
@@ -515,98 +2974,70 @@ class OSINTToolManager:
                 }
 
         finally:
-            # Clean up temporary file
-            if os.path.exists(video_path):
+            # Clean up temporary file; the spool removes its own
+            if not isinstance(video, UploadSpool) and os.path.exists(video_path):
                 os.unlink(video_path)
 
         return results
 
     # Deepfake Detection Methods
-    def deepfake_detection(self, media_data, media_type='image'):
-        """Run deepfake detection on media"""
-        results = {}
-        
-        # Save media to temporary file
-        extension = '.jpg' if media_type == 'image' else '.mp4'
-        with tempfile.NamedTemporaryFile(delete=False, suffix=extension) as tmp_file:
-            tmp_file.write(media_data)
-            media_path = tmp_file.name
+    def deepfake_detection(self, media, media_type='image'):
+        """Run deepfake detection on media bytes, an UploadSpool or a DecodedImage"""
+        return self._memoized_upload('deepfake', media, lambda m: self._deepfake_detection(m, media_type), media_type)
 
-        try:
-            # Basic deepfake detection simulation
-            results['Deepfake_Detection'] = {
-                "success": True,
-                "data": {
-                    "message": f"Deepfake detection for {media_type} would require specialized AI models",
-                    "media_type": media_type,
-                    "file_size": f"{len(media_data)} bytes",
-                    "analysis_available": False
-                }
-            }
+    def _deepfake_detection(self, media, media_type):
+        results = {}
+        size_bytes = media.size_bytes if isinstance(media, (UploadSpool, DecodedImage)) else len(media)
 
-            # Media analysis
-            results['Media_Analysis'] = {
-                "success": True,
-                "data": {
-                    "format": media_type,
-                    "size_bytes": len(media_data),
-                    "size_mb": round(len(media_data) / (1024 * 1024), 2)
-                }
+        # Basic deepfake detection simulation
+        results['Deepfake_Detection'] = {
+            "success": True,
+            "data": {
+                "message": f"Deepfake detection for {media_type} would require specialized AI models",
+                "media_type": media_type,
+                "file_size": f"{size_bytes} bytes",
+                "analysis_available": False
             }
+        }
 
-        finally:
-            # Clean up temporary file
-            if os.path.exists(media_path):
-                os.unlink(media_path)
+        # Media analysis
+        results['Media_Analysis'] = {
+            "success": True,
+            "data": {
+                "format": media_type,
+                "size_bytes": size_bytes,
+                "size_mb": round(size_bytes / (1024 * 1024), 2)
+            }
+        }
 
         return results
 
     # Face Detection Methods
-    def face_detection(self, image_data):
-        """Run face detection on image"""
+    def face_detection(self, image):
+        """Run face detection on upload bytes, an UploadSpool or a DecodedImage"""
+        return self._memoized_upload('face', image, self._face_detection)
+
+    def _face_detection(self, image):
         results = {}
-        
-        # Save image to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp_file:
-            tmp_file.write(image_data)
-            image_path = tmp_file.name
+        image = DecodedImage.of(image)
 
-        try:
-            # Basic image analysis
-            try:
-                with Image.open(image_path) as img:
-                    results['Image_Analysis'] = {
-                        "success": True,
-                        "data": {
-                            "format": img.format,
-                            "mode": img.mode,
-                            "size": img.size,
-                            "width": img.width,
-                            "height": img.height
-                        }
-                    }
-            except Exception as e:
-                results['Image_Analysis'] = {"success": False, "error": str(e)}
+        # Basic image analysis
+        results['Image_Analysis'] = image.analysis_envelope()
 
-            # Face detection simulation
-            results['Face_Detection'] = {
-                "success": True,
-                "data": {
-                    "message": "Face detection would require OpenCV or similar libraries",
-                    "faces_detected": "Unknown",
-                    "confidence": "Unknown"
-                }
+        # Face detection simulation
+        results['Face_Detection'] = {
+            "success": True,
+            "data": {
+                "message": "Face detection would require OpenCV or similar libraries",
+                "faces_detected": "Unknown",
+                "confidence": "Unknown"
             }
-
-        finally:
-            # Clean up temporary file
-            if os.path.exists(image_path):
-                os.unlink(image_path)
+        }
 
         return results
 
     # IP Address OSINT Methods
-    def ip_osint(self, ip_address):
+    def ip_osint(self, ip_address, deadline=None, on_result=None):
         """Run all IP address OSINT tools"""
         results = {}
         
@@ -639,70 +3070,853 @@ class OSINTToolManager:
             }
         }
 
-        # Free IP geolocation API
+        # Upstream lookups (geolocation and Shodan run concurrently)
+        return self._fan_out(results, {
+            'IP_Geolocation': (self._ip_geolocation_lookup, ip_address),
+            'Shodan_IP_Search': (self._shodan_host_lookup, ip_address)
+        }, deadline, on_result)
+
+    def _ip_geolocation_lookup(self, ip_address, deadline=None):
+        """Free ipapi.co geolocation lookup"""
         try:
-            response = requests.get(f"https://ipapi.co/{ip_address}/json/")
+            response = self._lookup_request('ipapi', 'ip', ip_address, f"https://ipapi.co/{ip_address}/json/", deadline=deadline)
             if response.status_code == 200:
-                results['IP_Geolocation'] = {"success": True, "data": response.json()}
+                envelope = {"success": True, "data": response.json()}
             else:
-                results['IP_Geolocation'] = {"success": False, "error": "API unavailable"}
+                envelope = {"success": False, "error": "API unavailable"}
+            return self._with_meta(envelope, response)
+        except (SourceTimeout, CircuitOpen):
+            raise
         except Exception as e:
-            results['IP_Geolocation'] = {"success": False, "error": str(e)}
-        
-        # Shodan search for IP address
+            return {"success": False, "error": str(e)}
+
+    def _shodan_host_lookup(self, ip_address, deadline=None):
+        """Shodan host lookup for an IP address"""
         try:
-            if self.api_keys.get('shodan'):
-                # Search for the IP in Shodan
-                shodan_url = f"https://api.shodan.io/shodan/host/{ip_address}?key={self.api_keys['shodan']}"
-                response = requests.get(shodan_url)
-                
-                if response.status_code == 200:
-                    shodan_data = response.json()
-                    results['Shodan_IP_Search'] = {
-                        "success": True,
-                        "data": {
-                            "ip": shodan_data.get('ip_str'),
-                            "ports": shodan_data.get('ports', []),
-                            "hostnames": shodan_data.get('hostnames', []),
-                            "country_name": shodan_data.get('country_name'),
-                            "city": shodan_data.get('city'),
-                            "org": shodan_data.get('org'),
-                            "os": shodan_data.get('os'),
-                            "data": shodan_data.get('data', []),
-                            "message": f"Shodan data found for IP {ip_address}"
+            if not self.api_keys.get('shodan'):
+                return {
+                    "success": False,
+                    "error": "Shodan API key not configured"
+                }
+
+            # Search for the IP in Shodan
+            shodan_url = f"https://api.shodan.io/shodan/host/{ip_address}?key={self.api_keys['shodan']}"
+            response = self._lookup_request('shodan', 'ip', ip_address, shodan_url, deadline=deadline)
+            
+            if response.status_code == 200:
+                shodan_data = response.json()
+                envelope = {
+                    "success": True,
+                    "data": {
+                        "ip": shodan_data.get('ip_str'),
+                        "ports": shodan_data.get('ports', []),
+                        "hostnames": shodan_data.get('hostnames', []),
+                        "country_name": shodan_data.get('country_name'),
+                        "city": shodan_data.get('city'),
+                        "org": shodan_data.get('org'),
+                        "os": shodan_data.get('os'),
+                        "data": shodan_data.get('data', []),
+                        "message": f"Shodan data found for IP {ip_address}"
+                    }
+                }
+            elif response.status_code == 403:
+                # Free plan limitation
+                envelope = {
+                    "success": False,
+                    "error": "Shodan search requires paid membership. Free plan has limited access.",
+                    "upgrade_info": {
+                        "current_plan": "oss (Open Source Software)",
+                        "recommendation": "Upgrade to Membership or Professional plan for full search access",
+                        "alternative": "Use Shodan web interface for manual searches"
+                    }
+                }
+            else:
+                envelope = {
+                    "success": False,
+                    "error": f"Shodan API error: {response.status_code} - {response.text}"
+                }
+            return self._with_meta(envelope, response)
+        except (SourceTimeout, CircuitOpen):
+            raise
+        except Exception as e:
+            return {
+                "success": False,
+                "error": f"Shodan IP search failed: {str(e)}"
+            }
+
+    def investigate(self, kind, target, deadline=None, on_result=None, options=None):
+        """Run the OSINT tools for one kind of investigation (see INVESTIGATIONS)"""
+        options = options or {}
+        if kind == 'phone':
+            return self.phone_osint(target, deadline, on_result)
+        elif kind == 'email':
+            return self.email_osint(target, deadline, on_result)
+        elif kind == 'website':
+            return self.website_osint(target, deadline, on_result)
+        elif kind == 'ip':
+            return self.ip_osint(target, deadline, on_result)
+        elif kind == 'shodan':
+            results = self.shodan_search(target, options.get('search_type', 'host'), deadline)
+        elif kind == 'social':
+            results = self.social_media_osint(target)
+        elif kind == 'image':
+            results = self.image_osint(target)
+        elif kind == 'video':
+            results = self.video_osint(target)
+        elif kind == 'deepfake':
+            results = self.deepfake_detection(target, options.get('media_type', 'image'))
+        elif kind == 'face':
+            results = self.face_detection(target)
+        else:
+            raise ValueError(f"Unknown investigation type: {kind}")
+
+        if on_result:
+            for name, envelope in results.items():
+                on_result(name, envelope)
+        return results
+
+    # Shodan Search Methods
+    def shodan_search(self, query, search_type='host', deadline=None):
+        """Run a Shodan host lookup or general search"""
+        try:
+            if search_type == 'host':
+                # Search for specific host/IP
+                url = f"https://api.shodan.io/shodan/host/{query}?key={self.api_keys['shodan']}"
+            else:
+                # General search
+                url = f"https://api.shodan.io/shodan/host/search?key={self.api_keys['shodan']}&query={query}"
+        
+            response = self._lookup_request('shodan', 'ip' if search_type == 'host' else 'query', query, url, deadline=deadline)
+        
+            if response.status_code == 200:
+                shodan_data = response.json()
+            
+                if search_type == 'host':
+                    results = {
+                        "Shodan_Host_Search": {
+                            "success": True,
+                            "data": {
+                                "ip": shodan_data.get('ip_str'),
+                                "ports": shodan_data.get('ports', []),
+                                "hostnames": shodan_data.get('hostnames', []),
+                                "country_name": shodan_data.get('country_name'),
+                                "city": shodan_data.get('city'),
+                                "org": shodan_data.get('org'),
+                                "os": shodan_data.get('os'),
+                                "data": shodan_data.get('data', []),
+                                "message": f"Shodan data found for {query}"
+                            }
+                        }
+                    }
+                else:
+                    results = {
+                        "Shodan_General_Search": {
+                            "success": True,
+                            "data": {
+                                "total_results": shodan_data.get('total', 0),
+                                "matches": shodan_data.get('matches', []),
+                                "message": f"Found {shodan_data.get('total', 0)} Shodan results for '{query}'"
+                            }
                         }
                     }
-                elif response.status_code == 403:
-                    # Free plan limitation
-                    results['Shodan_IP_Search'] = {
+            elif response.status_code == 403:
+                # Free plan limitation
+                results = {
+                    "Shodan_Search": {
                         "success": False,
                         "error": "Shodan search requires paid membership. Free plan has limited access.",
                         "upgrade_info": {
                             "current_plan": "oss (Open Source Software)",
                             "recommendation": "Upgrade to Membership or Professional plan for full search access",
-                            "alternative": "Use Shodan web interface for manual searches"
+                            "alternative": "Use Shodan web interface for manual searches",
+                            "web_interface": f"https://www.shodan.io/search?query={query}"
                         }
                     }
-                else:
-                    results['Shodan_IP_Search'] = {
+                }
+            else:
+                results = {
+                    "Shodan_Search": {
                         "success": False,
                         "error": f"Shodan API error: {response.status_code} - {response.text}"
                     }
-            else:
-                results['Shodan_IP_Search'] = {
-                    "success": False,
-                    "error": "Shodan API key not configured"
                 }
-        except Exception as e:
-            results['Shodan_IP_Search'] = {
-                "success": False,
-                "error": f"Shodan IP search failed: {str(e)}"
-            }
+            for envelope in results.values():
+                self._with_meta(envelope, response)
+        except SourceTimeout:
+            results = {"Shodan_Search": timeout_envelope()}
+        except CircuitOpen as e:
+            results = {"Shodan_Search": circuit_open_envelope(e)}
 
         return results
 
+# Investigation types: the request field holding the target, the AI provider
+# used for analysis and its prompt ({target} and {media_type} are filled in)
+INVESTIGATIONS = {
+    'phone': {
+        'field': 'phone_number',
+        'provider': 'gemini',
+        'prompt': "Analyze this phone number OSINT data for {target}. Provide insights, patterns, and recommendations."
+    },
+    'email': {
+        'field': 'email',
+        'provider': 'openai',
+        'prompt': "Analyze this email OSINT data for {target}. Provide insights, patterns, and recommendations."
+    },
+    'image': {
+        'field': 'image',
+        'upload': True,
+        'provider': 'openai',
+        'prompt': "Analyze this image OSINT data. Provide insights about metadata, faces, and any hidden information."
+    },
+    'website': {
+        'field': 'domain',
+        'provider': 'openai',
+        'prompt': "Analyze this website OSINT data for {target}. Provide insights about subdomains, technologies, and potential vulnerabilities."
+    },
+    'social': {
+        'field': 'username',
+        'provider': 'openai',
+        'prompt': "Analyze this social media OSINT data for {target}. Provide insights about online presence, patterns, and potential risks."
+    },
+    'ip': {
+        'field': 'ip_address',
+        'provider': 'openai',
+        'prompt': "Analyze this IP address OSINT data for {target}. Provide insights about geolocation, ISP, and potential risks."
+    },
+    'video': {
+        'field': 'video',
+        'upload': True,
+        'provider': 'openai',
+        'prompt': "Analyze this video OSINT data. Provide insights about metadata, content, and any hidden information."
+    },
+    'deepfake': {
+        'field': 'media',
+        'upload': True,
+        'provider': 'openai',
+        'prompt': "Analyze this {media_type} for deepfake detection. Provide insights about authenticity and potential manipulation."
+    },
+    'face': {
+        'field': 'image',
+        'upload': True,
+        'provider': 'openai',
+        'prompt': "Analyze this image for face detection. Provide insights about faces, expressions, and potential identification."
+    },
+    'shodan': {
+        'field': 'query',
+        'provider': 'openai',
+        'prompt': "Analyze this Shodan search data for '{target}'. Provide insights about exposed services, potential vulnerabilities, and security recommendations."
+    }
+}
+
+def investigation_prompt(kind, target=None, media_type='image'):
+    """AI analysis prompt for one investigation"""
+    return INVESTIGATIONS[kind]['prompt'].format(target=target, media_type=media_type)
+
+# Multi-target AI analysis: analyses requested within OSINT_AI_BATCH_WINDOW
+# seconds of each other for the same investigation type share one prompt
+AI_BATCH_WINDOW = float(os.getenv('OSINT_AI_BATCH_WINDOW', 0.2))
+AI_BATCH_SIZE = int(os.getenv('OSINT_AI_BATCH_SIZE', 8))
+# Prompt plus reply tokens one batch may use; a group over it is split. By
+# default (0) three quarters of the smallest AI context window, since a batch
+# may be routed to any provider and token estimates are rough
+AI_BATCH_TOKEN_BUDGET = int(os.getenv('OSINT_AI_BATCH_TOKEN_BUDGET', 0))
+AI_BATCH_CONTEXT_SHARE = 0.75
+
+def ai_batch_token_budget():
+    """Tokens one batch may use with whichever AI provider it ends up routed to"""
+    context_window = min(provider_setting(provider, 'context_window') for provider in AI_PROVIDERS)
+    if AI_BATCH_TOKEN_BUDGET > 0:
+        return min(AI_BATCH_TOKEN_BUDGET, context_window)
+    return int(context_window * AI_BATCH_CONTEXT_SHARE)
+
+AI_BATCH_INSTRUCTIONS = (
+    "The OSINT results below cover {count} separate targets, keyed by id. Analyze each target "
+    "on its own. Reply with only a JSON object mapping every id to its analysis as a string."
+)
+
+def parse_batch_reply(text):
+    """The id -> analysis object of a multi-target reply, or {} if it is not one"""
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end <= start:
+        return {}
+    try:
+        reply = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(reply, dict):
+        return {}
+    return {key: value if isinstance(value, str) else json.dumps(value) for key, value in reply.items()}
+
+class AIBatcher:
+    """Groups AI analyses of one investigation type into multi-target prompts
+
+    The first caller of a window waits AI_BATCH_WINDOW for others to join
+    (or until AI_BATCH_SIZE have, or their tokens fill AI_BATCH_TOKEN_BUDGET),
+    sends one prompt for all of them and splits the JSON reply back per
+    target. The prompt and reply get each target's token budgets, and a
+    group that would need more than the batch budget is split. Each
+    per-target analysis is cached as if it had been requested alone;
+    targets missing from the reply, or all of them when the batch prompt
+    fails, are analyzed individually on the batcher's own pool.
+    """
+
+    def __init__(self, manager, window=AI_BATCH_WINDOW, max_size=AI_BATCH_SIZE, token_budget=None):
+        self.manager = manager
+        self.window = window
+        self.max_size = max_size
+        self.token_budget = token_budget or ai_batch_token_budget()
+        # Not the manager's AI pool: hedged routing submits to that one and waits
+        self._fallback_executor = ThreadPoolExecutor(max_workers=max(1, max_size),
+                                                     thread_name_prefix='osint-ai-fallback')
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.batched_targets = 0
+        self.fallbacks = 0
+
+    def analyze(self, kind, target, results, deadline=None, media_type='image'):
+        """Analyze one target's results, possibly as part of a batch"""
+        spec = INVESTIGATIONS[kind]
+        prompt = investigation_prompt(kind, target, media_type)
+        if self.window <= 0 or self.max_size < 2 or spec.get('upload'):
+            return self.manager.route_ai_api(spec['provider'], prompt, results, deadline=deadline)
+
+        cached = self.manager.cached_analysis(self.manager.ai_route(spec['provider']), prompt, results)
+        if cached is not None:
+            return cached
+
+        item = {"target": target, "prompt": prompt, "results": results, "deadline": deadline, "future": Future(),
+                "tokens": self.tokens(results)}
+        with self._lock:
+            group = self._pending.setdefault(kind, [])
+            group.append(item)
+            leader = len(group) == 1
+            full = len(group) >= self.max_size or sum(i['tokens'] for i in group) >= self.token_budget
+            if full:
+                del self._pending[kind]
+        if full:
+            self._flush(kind, group)
+        elif leader:
+            time.sleep(self.window)
+            with self._lock:
+                flush = self._pending.get(kind) is group
+                if flush:
+                    del self._pending[kind]
+            if flush:
+                self._flush(kind, group)
+
+        try:
+            return item['future'].result(timeout=deadline.remaining() if deadline else None)
+        except FuturesTimeout:
+            return {"error": "timeout", "message": "AI analysis did not finish within the deadline"}
+
+    @staticmethod
+    def tokens(results):
+        """Estimated prompt plus reply tokens of one target in a batch"""
+        prompt_tokens = len(compact_results(results)) // 4 if results else 0
+        return min(prompt_tokens, AI_PROMPT_TOKEN_BUDGET) + AI_MAX_OUTPUT_TOKENS
+
+    def pack(self, group):
+        """Split a group into batches whose estimated tokens fit the batch budget"""
+        batches, batch, used = [], [], 0
+        for item in group:
+            if batch and used + item['tokens'] > self.token_budget:
+                batches.append(batch)
+                batch, used = [], 0
+            batch.append(item)
+            used += item['tokens']
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _flush(self, kind, group):
+        for batch in self.pack(group):
+            try:
+                if len(batch) == 1:
+                    item = batch[0]
+                    item['future'].set_result(self.manager.route_ai_api(
+                        INVESTIGATIONS[kind]['provider'], item['prompt'], item['results'], deadline=item['deadline']))
+                else:
+                    self._analyze_batch(kind, batch)
+            except Exception as e:
+                for item in batch:
+                    if not item['future'].done():
+                        item['future'].set_result({"error": f"AI API error: {str(e)}"})
+
+    def _analyze_batch(self, kind, group):
+        spec = INVESTIGATIONS[kind]
+        prompt = " ".join([investigation_prompt(kind, 'each target', 'media'),
+                           AI_BATCH_INSTRUCTIONS.format(count=len(group))])
+        results = {f"t{i + 1}": {"target": item['target'], "results": item['results']}
+                   for i, item in enumerate(group)}
+        deadlines = [item['deadline'] for item in group if item['deadline'] is not None]
+        deadline = max(deadlines, key=lambda d: d.remaining()) if len(deadlines) == len(group) else None
+
+        analysis = self.manager.route_ai_api(spec['provider'], prompt, results, deadline=deadline, targets=len(group))
+        with self._lock:
+            self.batches += 1
+            self.batched_targets += len(group)
+        if 'analysis' not in analysis:
+            self._fall_back(spec['provider'], group)
+            return
+
+        provider = analysis.get('meta', {}).get('provider', spec['provider'])
+        reply = parse_batch_reply(analysis['analysis'])
+        missing = []
+        for i, item in enumerate(group):
+            text = reply.get(f"t{i + 1}")
+            if not text:
+                missing.append(item)
+                continue
+            self.manager.store_analysis(provider, item['prompt'], item['results'], {"analysis": text})
+            item['future'].set_result({"analysis": text,
+                                       "meta": {"cache": analysis['meta'].get('cache', 'miss'),
+                                                "provider": provider, "batch_size": len(group)}})
+
+        # Targets the reply left out (or an unparseable reply) are analyzed one by one
+        if missing:
+            self._fall_back(spec['provider'], missing)
+
+    def _fall_back(self, provider, items):
+        """Analyze each item on its own, concurrently"""
+        with self._lock:
+            self.fallbacks += len(items)
+        futures = [(item, self._fallback_executor.submit(
+            self.manager.route_ai_api, provider, item['prompt'], item['results'], item['deadline']))
+            for item in items]
+        for item, future in futures:
+            item['future'].set_result(future.result())
+
+    def stats(self):
+        with self._lock:
+            return {"window_seconds": self.window, "max_size": self.max_size, "token_budget": self.token_budget,
+                    "batches": self.batches,
+                    "batched_targets": self.batched_targets, "fallbacks": self.fallbacks}
+
+# Background investigation jobs
+JOB_DEADLINE = float(os.getenv('OSINT_JOB_DEADLINE', 300))
+# An event stream whose job makes no progress for this long ends with job_error
+JOB_STREAM_IDLE = float(os.getenv('OSINT_JOB_STREAM_IDLE', 600))
+
+class JobQueueFull(Exception):
+    """Raised when too many investigation jobs are already queued or running"""
+
+class JobManager:
+    """Runs investigations on a bounded pool and tracks their per-source progress
+
+    Job state lives in the process running the job and is mirrored to a job
+    store after every change, so with a shared backend (sqlite/redis) any
+    gunicorn worker can answer polls and event streams.
+    """
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, manager, backend, max_workers=4, max_active=100, ttl=3600, batcher=None,
+                 stream_idle=JOB_STREAM_IDLE):
+        self.manager = manager
+        # Analyses of concurrent jobs are grouped into multi-target prompts
+        self.batcher = batcher
+        self.backend = backend
+        self.max_active = max_active
+        self.ttl = ttl
+        self.stream_idle = stream_idle
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='osint-job')
+        self._jobs = {}
+        self._changed = threading.Condition()
+
+    def submit(self, kind, target, label=None, options=None, ai=True):
+        """Queue an investigation and return the new job's snapshot"""
+        job = self._create(kind, label if label is not None else target, ai)
+        self._watch(job, self._executor.submit(self._run, job, target, options or {}))
+        return self._snapshot(job)
+
+    def submit_analysis(self, kind, target, results, media_type='image'):
+        """Queue only the AI analysis of results that were already returned to the client"""
+        job = self._create(kind, target, True, results)
+        self._watch(job, self._executor.submit(self._run_analysis, job, results, {'media_type': media_type}))
+        return self._snapshot(job)
+
+    def _watch(self, job, future):
+        """Fail a job whose worker ends without recording a final status"""
+        def finished(future):
+            if job['status'] in ('queued', 'running'):
+                error = future.exception() if not future.cancelled() else None
+                logger.error(f"Job {job['id']} worker stopped without finishing: {error!r}")
+                self._update(job, status='failed', lost=True, error="Job worker stopped without finishing")
+        future.add_done_callback(finished)
+
+    def _create(self, kind, target, ai, results=None):
+        now = datetime.now().isoformat()
+        with self._changed:
+            self._prune()
+            active = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'running'))
+            if active >= self.max_active:
+                raise JobQueueFull(f"{active} jobs already queued or running")
+            job = {
+                "id": uuid.uuid4().hex,
+                "type": kind,
+                "target": target,
+                "status": "queued",
+                "ai": ai,
+                "results": dict(results or {}),
+                "version": 0,
+                "created_at": now,
+                "updated_at": now
+            }
+            self._jobs[job['id']] = job
+            snapshot = self._snapshot(job)
+        self._save(snapshot)
+        return job
+
+    def _run(self, job, target, options):
+        deadline = Deadline(JOB_DEADLINE)
+        self._update(job, status='running')
+        try:
+            results = self.manager.investigate(job['type'], target,
+                                               deadline.slice(LOOKUP_BUDGET_SHARE) if job['ai'] else deadline,
+                                               lambda name, envelope: self._add_result(job, name, envelope),
+                                               options)
+            if job['ai']:
+                self._analyze(job, results, options, deadline)
+            self._update(job, status='done')
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {str(e)}")
+            self._update(job, status='failed', error=str(e))
+        finally:
+            if isinstance(target, UploadSpool):
+                # Detached from its request by create_job_endpoint; nothing else removes it
+                target.close()
+
+    def _run_analysis(self, job, results, options):
+        self._update(job, status='running')
+        try:
+            self._analyze(job, results, options, Deadline(JOB_DEADLINE))
+            self._update(job, status='done')
+        except Exception as e:
+            logger.error(f"Analysis job {job['id']} failed: {str(e)}")
+            self._update(job, status='failed', error=str(e))
+
+    def _analyze(self, job, results, options, deadline):
+        spec = INVESTIGATIONS[job['type']]
+        prompt = investigation_prompt(job['type'], job['target'], options.get('media_type', 'image'))
+        if self.batcher is not None:
+            analysis = self.batcher.analyze(job['type'], job['target'], results, deadline, options.get('media_type', 'image'))
+        else:
+            analysis = self.manager.route_ai_api(spec['provider'], prompt, results, deadline=deadline)
+        self._update(job, ai_analysis=analysis)
+
+    def _add_result(self, job, name, envelope):
+        with self._changed:
+            job['results'][name] = envelope
+            snapshot = self._touch(job)
+        self._save(snapshot)
+
+    def _update(self, job, **fields):
+        with self._changed:
+            job.update(fields)
+            snapshot = self._touch(job)
+        self._save(snapshot)
+
+    def _touch(self, job):
+        """Bump a job's version and wake up event streams; caller holds the lock"""
+        job['version'] += 1
+        job['updated_at'] = datetime.now().isoformat()
+        self._changed.notify_all()
+        return self._snapshot(job)
+
+    def _snapshot(self, job):
+        return dict(job, results=dict(job['results']))
+
+    def _save(self, snapshot):
+        try:
+            self.backend.set(f"job:{snapshot['id']}", json.dumps(snapshot).encode(), self.ttl)
+        except Exception as e:
+            logger.warning(f"Could not persist job {snapshot['id']}: {str(e)}")
+
+    def _prune(self):
+        """Forget finished jobs older than the TTL; caller holds the lock"""
+        cutoff = (datetime.now() - timedelta(seconds=self.ttl)).isoformat()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job['status'] in ('done', 'failed') and job['updated_at'] < cutoff]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        """Current snapshot of a job, from this process or the shared backend"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._snapshot(job)
+        try:
+            value = self.backend.get(f"job:{job_id}")
+        except Exception as e:
+            logger.warning(f"Could not load job {job_id}: {str(e)}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def _wait(self, job_id, version, timeout):
+        """Snapshot of a job once it moves past version, or after timeout"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._changed.wait_for(lambda: job['version'] != version, timeout)
+                return self._snapshot(job)
+
+        # Job runs in another worker: poll the shared backend
+        waited = 0
+        while waited < timeout:
+            time.sleep(self.POLL_INTERVAL)
+            waited += self.POLL_INTERVAL
+            snapshot = self.get(job_id)
+            if snapshot is None or snapshot['version'] != version:
+                return snapshot
+        return self.get(job_id)
+
+    def events(self, job_id, keepalive=15, max_idle=None):
+        """Server-Sent Events for a job: one per source as it lands, then the AI analysis and completion
+
+        The stream ends with job_error if the job is unknown, its worker
+        stopped without finishing, or it makes no progress for max_idle
+        seconds (stream_idle), e.g. because the process running it died.
+        """
+        max_idle = self.stream_idle if max_idle is None else max_idle
+        snapshot = self.get(job_id)
+        sent = set()
+        error = "Job not found"
+        idle_since = time.monotonic()
+        while snapshot is not None:
+            for name, envelope in snapshot['results'].items():
+                if name not in sent:
+                    sent.add(name)
+                    yield sse_event('source', {"name": name, "result": envelope})
+            if 'ai_analysis' in snapshot and 'ai_analysis' not in sent:
+                sent.add('ai_analysis')
+                yield sse_event('ai_analysis', snapshot['ai_analysis'])
+            if snapshot.get('lost'):
+                error = snapshot['error']
+                break
+            if snapshot['status'] in ('done', 'failed'):
+                yield sse_event('done', {"status": snapshot['status'], "error": snapshot.get('error')})
+                return
+
+            version = snapshot['version']
+            idle = time.monotonic() - idle_since
+            if idle >= max_idle:
+                error = f"Job made no progress for {idle:.0f}s"
+                break
+            snapshot = self._wait(job_id, version, min(keepalive, max_idle - idle))
+            if snapshot is not None and snapshot['version'] == version:
+                yield ": keepalive\n\n"
+            else:
+                idle_since = time.monotonic()
+        # Not "error", which EventSource uses for connection failures
+        yield sse_event('job_error', {"error": error})
+
+    def stats(self):
+        with self._changed:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+        return counts
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_ai_analysis(provider, prompt, results, deadline):
+    """Relay an AI analysis as Server-Sent Events: token events, then done"""
+    for item in osint_manager.stream_ai_api(provider, prompt, results, deadline):
+        if 'text' in item:
+            yield sse_event('token', item)
+        else:
+            yield sse_event('done', {
+                "provider": provider,
+                "analysis": item,
+                "timestamp": datetime.now().isoformat()
+            })
+
+# AI analysis stage: 'inline' runs it before responding, 'deferred' attaches
+# it to a background job the client can poll or stream, 'off' skips it
+AI_MODES = ('off', 'inline', 'deferred')
+AI_ANALYSIS_MODE = os.getenv('OSINT_AI_MODE', 'inline')
+
+def requested_ai_mode(data=None):
+    """AI mode for the current request: ?ai=, then the body's "ai" field, then OSINT_AI_MODE"""
+    mode = request.args.get('ai')
+    if mode is None and data:
+        mode = data.get('ai')
+    mode = str(AI_ANALYSIS_MODE if mode is None else mode).lower()
+    if mode in ('false', '0', 'no', 'none'):
+        return 'off'
+    if mode in ('true', '1', 'yes'):
+        return 'inline'
+    return mode if mode in AI_MODES else AI_ANALYSIS_MODE
+
+def lookup_budget(deadline, ai_mode):
+    """Lookups may use the whole deadline unless AI analysis runs inline after them"""
+    return deadline.slice(LOOKUP_BUDGET_SHARE) if ai_mode == 'inline' else deadline
+
+def run_ai_stage(kind, target, results, deadline, ai_mode, media_type='image'):
+    """Run, schedule or skip the AI analysis of an investigation's results"""
+    timings = REQUEST_TIMINGS.get()
+    if timings is not None:
+        # Everything before the AI stage is lookups
+        timings.stage('lookups', time.monotonic() - timings.started)
+    if ai_mode == 'off':
+        return {"status": "off"}
+
+    if ai_mode == 'deferred':
+        try:
+            job = job_manager.submit_analysis(kind, target, results, media_type)
+        except JobQueueFull as e:
+            return {"status": "unavailable", "error": f"Too many analyses in progress: {str(e)}"}
+        return {
+            "status": "pending",
+            "job_id": job['id'],
+            "status_url": f"/api/jobs/{job['id']}",
+            "events_url": f"/api/jobs/{job['id']}/events"
+        }
+
+    started = time.monotonic()
+    analysis = osint_manager.route_ai_api(INVESTIGATIONS[kind]['provider'],
+                                          investigation_prompt(kind, target, media_type),
+                                          results, deadline=deadline)
+    if timings is not None:
+        meta = analysis.get('meta', {})
+        timings.stage('ai_analysis', time.monotonic() - started,
+                      provider=meta.get('provider'), cache=meta.get('cache'))
+    return analysis
+
+# Bulk lookups: investigation type -> normalize_target kind
+BATCH_KINDS = {'phone': 'phone', 'email': 'email', 'ip': 'ip', 'website': 'domain'}
+BATCH_MAX_TARGETS = int(os.getenv('OSINT_BATCH_MAX_TARGETS', 10000))
+BATCH_CONCURRENCY = int(os.getenv('OSINT_BATCH_CONCURRENCY', 8))
+batch_executor = ThreadPoolExecutor(max_workers=int(os.getenv('OSINT_BATCH_WORKERS', 16)),
+                                    thread_name_prefix='osint-batch')
+
+def run_batch(kind, targets, concurrency=BATCH_CONCURRENCY, ai=False, timeout=REQUEST_DEADLINE):
+    """Look up a stream of targets, yielding one NDJSON line per unique target
+
+    Targets are normalized and deduplicated as they are read, at most
+    `concurrency` lookups are in flight at once, and lines are yielded in
+    completion order, so memory stays flat however long the batch is.
+    Provider rate limits apply as for any other lookup. Each target gets
+    its own deadline of timeout seconds. With ai, each line also carries an
+    analysis; concurrent ones share multi-target prompts.
+    """
+    seen = set()
+    pending = {}
+
+    def lookup(target):
+        deadline = Deadline(timeout)
+        if not ai:
+            return {"results": osint_manager.investigate(kind, target, deadline)}
+        results = osint_manager.investigate(kind, target, lookup_budget(deadline, 'inline'))
+        return {"results": results, "ai_analysis": ai_batcher.analyze(kind, target, results, deadline)}
+
+    def drain(return_when):
+        done, _ = wait(pending, return_when=return_when)
+        for future in done:
+            target, normalized = pending.pop(future)
+            try:
+                line = {"target": target, "normalized": normalized, **future.result()}
+            except Exception as e:
+                line = {"target": target, "normalized": normalized, "error": str(e)}
+            yield json.dumps(line) + "\n"
+
+    for target in targets:
+        if isinstance(target, int):
+            target = str(target)
+        if not isinstance(target, str) or not target.strip():
+            continue
+        normalized = normalize_target(BATCH_KINDS[kind], target)
+        if normalized in seen:
+            continue
+        if len(seen) >= BATCH_MAX_TARGETS:
+            yield json.dumps({"error": f"Batch truncated at {BATCH_MAX_TARGETS} unique targets"}) + "\n"
+            break
+        seen.add(normalized)
+        pending[batch_executor.submit(lookup, target.strip())] = (target.strip(), normalized)
+        if len(pending) >= concurrency:
+            yield from drain(FIRST_COMPLETED)
+
+    while pending:
+        yield from drain(FIRST_COMPLETED)
+
+def batch_targets(field):
+    """Yield the raw targets of a batch request
+
+    Accepts a JSON array, {"targets": [...]}, or NDJSON (one JSON string,
+    object or bare value per line) as the request body or as a 'file' upload.
+    """
+    if 'file' in request.files or request.mimetype in ('application/x-ndjson', 'application/jsonl', 'text/plain'):
+        stream = request.files['file'].stream if 'file' in request.files else request.stream
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                item = line.decode('utf-8', errors='replace')
+            yield item.get(field) or item.get('target') if isinstance(item, dict) else item
+        return
+
+    data = request.get_json(silent=True)
+    items = data if isinstance(data, list) else (data or {}).get('targets', [])
+    for item in items:
+        yield item.get(field) or item.get('target') if isinstance(item, dict) else item
+
 # Initialize the OSINT tool manager
 osint_manager = OSINTToolManager()
+ai_batcher = AIBatcher(osint_manager)
+job_manager = JobManager(osint_manager, create_cache_backend('jobs'),
+                         max_workers=int(os.getenv('OSINT_JOB_WORKERS', 4)),
+                         max_active=int(os.getenv('OSINT_JOB_MAX_ACTIVE', 100)),
+                         batcher=ai_batcher)
+
+def metrics_endpoint_label():
+    """The matched route pattern, so /api/jobs/<job_id> is one series rather than one per job"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    request.environ['osint.started'] = time.monotonic()
+    metrics.gauge_add('osint_http_requests_in_flight', {'endpoint': metrics_endpoint_label()})
+    if request.args.get('timings') in ('1', 'true'):
+        request.environ['osint.timings'] = REQUEST_TIMINGS.set(RequestTimings())
+    if profiler.sample(metrics_endpoint_label()):
+        request.environ['osint.profile'] = profiler.start()
+
+@app.after_request
+def record_response_status(response):
+    request.environ['osint.status'] = response.status_code
+    timings = REQUEST_TIMINGS.get()
+    if timings is not None and response.is_json and not response.is_streamed:
+        body = response.get_json()
+        if isinstance(body, dict):
+            body['timings'] = timings.as_dict()
+            response.set_data(json.dumps(body))
+    profile = request.environ.get('osint.profile')
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile['id']
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    token = request.environ.pop('osint.timings', None)
+    if token is not None:
+        REQUEST_TIMINGS.reset(token)
+    profile = request.environ.pop('osint.profile', None)
+    if profile is not None:
+        profiler.stop(profile, metrics_endpoint_label())
+    started = request.environ.get('osint.started')
+    if started is None:
+        return
+    endpoint = metrics_endpoint_label()
+    status = request.environ.get('osint.status', 500)
+    metrics.gauge_add('osint_http_requests_in_flight', {'endpoint': endpoint}, -1)
+    metrics.inc('osint_http_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': str(status)})
+    metrics.observe('osint_http_request_duration_seconds', {'endpoint': endpoint}, time.monotonic() - started)
 
 @app.route('/')
 def index():
@@ -960,6 +4174,83 @@ def index():
                 }
             }
 
+            // Lookups come back without AI analysis so they render at once; the
+            // analysis is then streamed into the same view token by token
+            async function streamAnalysis(elementId, view, body) {
+                view.ai_analysis = { analysis: '' };
+                showResult(elementId, view);
+                const response = await fetch('/api/ai/analyze', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(Object.assign({ stream: true, results: view.results }, body))
+                });
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) {
+                        break;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split('\\n\\n');
+                    buffer = events.pop();
+                    for (const raw of events) {
+                        const event = (raw.match(/^event: (.*)$/m) || [])[1];
+                        const data = JSON.parse((raw.match(/^data: (.*)$/m) || [])[1] || 'null');
+                        if (event === 'token') {
+                            view.ai_analysis.analysis += data.text;
+                        } else if (event === 'done') {
+                            view.ai_analysis = data.analysis;
+                        }
+                    }
+                    showResult(elementId, view);
+                }
+                return view;
+            }
+
+            // Long-running investigations run as background jobs; each source
+            // is rendered as soon as it arrives over Server-Sent Events
+            async function runJob(elementId, body) {
+                const options = body instanceof FormData
+                    ? { method: 'POST', body: body }
+                    : { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify(body) };
+                const response = await fetch('/api/jobs', options);
+                const job = await response.json();
+                if (!response.ok) {
+                    throw new Error(job.error || ('HTTP ' + response.status));
+                }
+
+                const view = { job_id: job.job_id, status: 'running', results: {} };
+                showResult(elementId, view);
+                return new Promise((resolve, reject) => {
+                    const events = new EventSource(job.events_url);
+                    events.addEventListener('source', (e) => {
+                        const message = JSON.parse(e.data);
+                        view.results[message.name] = message.result;
+                        showResult(elementId, view);
+                    });
+                    events.addEventListener('ai_analysis', (e) => {
+                        view.ai_analysis = JSON.parse(e.data);
+                        showResult(elementId, view);
+                    });
+                    events.addEventListener('done', (e) => {
+                        Object.assign(view, JSON.parse(e.data));
+                        showResult(elementId, view);
+                        events.close();
+                        resolve(view);
+                    });
+                    events.addEventListener('job_error', (e) => {
+                        events.close();
+                        reject(new Error(JSON.parse(e.data).error));
+                    });
+                    events.addEventListener('error', () => {
+                        events.close();
+                        reject(new Error('Lost connection to job ' + job.job_id));
+                    });
+                });
+            }
+
             async function analyzePhone() {
                 const phone = document.getElementById('phoneInput').value;
                 if (!phone) {
@@ -968,8 +4259,9 @@ def index():
                 }
                 showLoading('phone');
                 try {
-                    const result = await makeRequest('/api/phone', { phone_number: phone });
+                    const result = await makeRequest('/api/phone', { phone_number: phone, ai: 'off' });
                     showResult('phone', result);
+                    await streamAnalysis('phone', result, { kind: 'phone', target: phone });
                 } catch (error) {
                     showError('phone', error.message);
                 } finally {
@@ -985,8 +4277,9 @@ def index():
                 }
                 showLoading('email');
                 try {
-                    const result = await makeRequest('/api/email', { email: email });
+                    const result = await makeRequest('/api/email', { email: email, ai: 'off' });
                     showResult('email', result);
+                    await streamAnalysis('email', result, { kind: 'email', target: email });
                 } catch (error) {
                     showError('email', error.message);
                 } finally {
@@ -1002,8 +4295,9 @@ def index():
                 }
                 showLoading('ip');
                 try {
-                    const result = await makeRequest('/api/ip', { ip_address: ip });
+                    const result = await makeRequest('/api/ip', { ip_address: ip, ai: 'off' });
                     showResult('ip', result);
+                    await streamAnalysis('ip', result, { kind: 'ip', target: ip });
                 } catch (error) {
                     showError('ip', error.message);
                 } finally {
@@ -1019,8 +4313,9 @@ def index():
                 }
                 showLoading('website');
                 try {
-                    const result = await makeRequest('/api/website', { domain: website });
+                    const result = await makeRequest('/api/website', { domain: website, ai: 'off' });
                     showResult('website', result);
+                    await streamAnalysis('website', result, { kind: 'website', target: website });
                 } catch (error) {
                     showError('website', error.message);
                 } finally {
@@ -1036,8 +4331,9 @@ def index():
                 }
                 showLoading('social');
                 try {
-                    const result = await makeRequest('/api/social', { username: username });
+                    const result = await makeRequest('/api/social', { username: username, ai: 'off' });
                     showResult('social', result);
+                    await streamAnalysis('social', result, { kind: 'social', target: username });
                 } catch (error) {
                     showError('social', error.message);
                 } finally {
@@ -1056,8 +4352,10 @@ def index():
                 try {
                     const formData = new FormData();
                     formData.append('image', file);
+                    formData.append('ai', 'off');
                     const result = await makeFileRequest('/api/image', formData);
                     showResult('image', result);
+                    await streamAnalysis('image', result, { kind: 'image' });
                 } catch (error) {
                     showError('image', error.message);
                 } finally {
@@ -1075,9 +4373,9 @@ def index():
                 showLoading('video');
                 try {
                     const formData = new FormData();
+                    formData.append('type', 'video');
                     formData.append('video', file);
-                    const result = await makeFileRequest('/api/video', formData);
-                    showResult('video', result);
+                    await runJob('video', formData);
                 } catch (error) {
                     showError('video', error.message);
                 } finally {
@@ -1097,8 +4395,10 @@ def index():
                     const formData = new FormData();
                     formData.append('media', file);
                     formData.append('media_type', file.type.startsWith('image/') ? 'image' : 'video');
+                    formData.append('ai', 'off');
                     const result = await makeFileRequest('/api/deepfake', formData);
                     showResult('deepfake', result);
+                    await streamAnalysis('deepfake', result, { kind: 'deepfake', media_type: result.media_type });
                 } catch (error) {
                     showError('deepfake', error.message);
                 } finally {
@@ -1117,8 +4417,10 @@ def index():
                 try {
                     const formData = new FormData();
                     formData.append('image', file);
+                    formData.append('ai', 'off');
                     const result = await makeFileRequest('/api/face', formData);
                     showResult('face', result);
+                    await streamAnalysis('face', result, { kind: 'face' });
                 } catch (error) {
                     showError('face', error.message);
                 } finally {
@@ -1134,8 +4436,7 @@ def index():
                 }
                 showLoading('shodan');
                 try {
-                    const result = await makeRequest('/api/shodan', { query: query });
-                    showResult('shodan', result);
+                    await runJob('shodan', { type: 'shodan', query: query });
                 } catch (error) {
                     showError('shodan', error.message);
                 } finally {
@@ -1205,18 +4506,44 @@ def get_status():
     # Check API key availability
     for api_name, api_key in osint_manager.api_keys.items():
         status['api_keys'][api_name] = api_key is not None
+
+    # One backend holds all three caches, so its size is reported once
+    status['cache_backend'] = osint_manager.lookup_cache.backend_stats()
+    status['lookup_cache'] = osint_manager.lookup_cache.stats()
+    status['lookup_coalescing'] = osint_manager.single_flight.stats()
+    status['rate_limits'] = osint_manager.rate_limiter.stats()
+    status['circuit_breakers'] = osint_manager.breaker_states()
+    status['ai_cache'] = osint_manager.ai_cache.stats()
+    status['upload_cache'] = osint_manager.upload_cache.stats()
+    if osint_manager.blob_store is not None:
+        status['upload_store'] = osint_manager.blob_store.stats()
+    if osint_manager.image_index is not None:
+        status['image_index'] = osint_manager.image_index.stats()
+    status['ai_time_to_first_token'] = osint_manager.ai_ttft.stats()
+    status['ai_routing'] = {"policy": AI_ROUTING, "latency": osint_manager.ai_latency.stats()}
+    status['jobs'] = job_manager.stats()
+    status['ai_batching'] = ai_batcher.stats()
+    status['profiling'] = profiler.stats()
     
     return jsonify(status)
 
 @app.route('/health')
 def health_check():
     """Simple health check endpoint"""
+    breakers = {provider: state['state'] for provider, state in osint_manager.breaker_states().items()}
     return jsonify({
-        'status': 'healthy',
+        'status': 'degraded' if 'open' in breakers.values() else 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'circuit_breakers': breakers
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics, aggregated across workers when OSINT_METRICS_DIR is set"""
+    metrics.flush()
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/phone', methods=['POST'])
 def phone_osint_endpoint():
     """Phone number OSINT endpoint"""
@@ -1226,13 +4553,13 @@ def phone_osint_endpoint():
     if not phone_number:
         return jsonify({"error": "Phone number is required"}), 400
     
+    ai_mode = requested_ai_mode(data)
+    deadline = request_deadline()
     # Run all phone OSINT tools
-    results = osint_manager.phone_osint(phone_number)
+    results = osint_manager.phone_osint(phone_number, deadline=lookup_budget(deadline, ai_mode))
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('gemini', 
-        f"Analyze this phone number OSINT data for {phone_number}. Provide insights, patterns, and recommendations.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('phone', phone_number, results, deadline, ai_mode)
     
     return jsonify({
         "phone_number": phone_number,
@@ -1269,13 +4596,13 @@ def email_osint_endpoint():
     if not email:
         return jsonify({"error": "Email is required"}), 400
     
+    ai_mode = requested_ai_mode(data)
+    deadline = request_deadline()
     # Run all email OSINT tools
-    results = osint_manager.email_osint(email)
+    results = osint_manager.email_osint(email, deadline=lookup_budget(deadline, ai_mode))
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('openai', 
-        f"Analyze this email OSINT data for {email}. Provide insights, patterns, and recommendations.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('email', email, results, deadline, ai_mode)
     
     return jsonify({
         "email": email,
@@ -1290,23 +4617,73 @@ def image_osint_endpoint():
     if 'image' not in request.files:
         return jsonify({"error": "Image file is required"}), 400
     
-    image_file = request.files['image']
-    image_data = image_file.read()
+    image = request.files['image'].stream
+    try:
+        exif_groups = requested_exif_groups(request.form)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
+    ai_mode = requested_ai_mode(request.form)
+    deadline = request_deadline()
     # Run all image OSINT tools
-    results = osint_manager.image_osint(image_data)
+    results = osint_manager.image_osint(image, exif_groups)
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('openai', 
-        "Analyze this image OSINT data. Provide insights about metadata, faces, and any hidden information.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('image', None, results, deadline, ai_mode)
     
     return jsonify({
+        "upload": upload_fingerprint(image),
         "results": results,
         "ai_analysis": ai_analysis,
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/api/image/similar', methods=['POST'])
+def image_similar_endpoint():
+    """Previously analyzed images that are near-duplicates of an upload, a pHash or a known image"""
+    data = request.form if request.files else (request.get_json(silent=True) or {})
+    try:
+        max_distance = int(data.get('max_distance', 8))
+        limit = min(max(int(data.get('limit', 20)), 1), 200)
+    except (TypeError, ValueError):
+        return jsonify({"error": "max_distance and limit must be integers"}), 400
+    if not 0 <= max_distance <= ImageIndex.MAX_DISTANCE:
+        return jsonify({"error": f"max_distance must be between 0 and {ImageIndex.MAX_DISTANCE}"}), 400
+
+    if osint_manager.image_index is None:
+        return jsonify({"error": "The image index is unavailable"}), 503
+
+    sha256 = data.get('sha256')
+    if 'image' in request.files:
+        image = DecodedImage(request.files['image'].stream)
+        try:
+            hashes = perceptual_hashes(image.image)
+        except Exception as e:
+            return jsonify({"error": f"Could not read image: {str(e)}"}), 400
+        sha256 = upload_fingerprint(image)['sha256']
+    elif data.get('phash'):
+        phash = data['phash']
+        # int() alone would also take a sign, underscores or more than 64 bits
+        if not (isinstance(phash, str) and len(phash) == 16 and all(c in '0123456789abcdefABCDEF' for c in phash)):
+            return jsonify({"error": "phash must be a 64-bit hex string (16 hex digits)"}), 400
+        hashes = {"phash": int(phash, 16)}
+    elif sha256:
+        hashes = osint_manager.image_index.get(sha256)
+        if hashes is None:
+            return jsonify({"error": f"No analyzed image with sha256 {sha256}"}), 404
+    else:
+        return jsonify({"error": "An image file, phash or sha256 is required"}), 400
+
+    started = time.monotonic()
+    matches = osint_manager.image_index.search(hashes, max_distance, limit, exclude=sha256)
+    return jsonify({
+        "query": dict({name: f"{value:016x}" for name, value in hashes.items()}, sha256=sha256),
+        "max_distance": max_distance,
+        "matches": matches,
+        "search_ms": round((time.monotonic() - started) * 1000, 2),
+        "timestamp": datetime.now().isoformat()
+    })
+
 @app.route('/api/website', methods=['POST'])
 def website_osint_endpoint():
     """Website OSINT endpoint"""
@@ -1316,13 +4693,13 @@ def website_osint_endpoint():
     if not domain:
         return jsonify({"error": "Domain is required"}), 400
     
+    ai_mode = requested_ai_mode(data)
+    deadline = request_deadline()
     # Run all website OSINT tools
-    results = osint_manager.website_osint(domain)
+    results = osint_manager.website_osint(domain, deadline=lookup_budget(deadline, ai_mode))
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('openai', 
-        f"Analyze this website OSINT data for {domain}. Provide insights about subdomains, technologies, and potential vulnerabilities.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('website', domain, results, deadline, ai_mode)
     
     return jsonify({
         "domain": domain,
@@ -1340,13 +4717,13 @@ def social_media_osint_endpoint():
     if not username:
         return jsonify({"error": "Username is required"}), 400
     
+    ai_mode = requested_ai_mode(data)
+    deadline = request_deadline()
     # Run all social media OSINT tools
     results = osint_manager.social_media_osint(username)
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('openai', 
-        f"Analyze this social media OSINT data for {username}. Provide insights about online presence, patterns, and potential risks.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('social', username, results, deadline, ai_mode)
     
     return jsonify({
         "username": username,
@@ -1364,13 +4741,13 @@ def ip_osint_endpoint():
     if not ip_address:
         return jsonify({"error": "IP address is required"}), 400
     
+    ai_mode = requested_ai_mode(data)
+    deadline = request_deadline()
     # Run all IP OSINT tools
-    results = osint_manager.ip_osint(ip_address)
+    results = osint_manager.ip_osint(ip_address, deadline=lookup_budget(deadline, ai_mode))
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('openai', 
-        f"Analyze this IP address OSINT data for {ip_address}. Provide insights about geolocation, ISP, and potential risks.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('ip', ip_address, results, deadline, ai_mode)
     
     return jsonify({
         "ip_address": ip_address,
@@ -1385,18 +4762,18 @@ def video_osint_endpoint():
     if 'video' not in request.files:
         return jsonify({"error": "Video file is required"}), 400
     
-    video_file = request.files['video']
-    video_data = video_file.read()
+    video = request.files['video'].stream
     
+    ai_mode = requested_ai_mode(request.form)
+    deadline = request_deadline()
     # Run all video OSINT tools
-    results = osint_manager.video_osint(video_data)
+    results = osint_manager.video_osint(video)
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('openai', 
-        "Analyze this video OSINT data. Provide insights about metadata, content, and any hidden information.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('video', None, results, deadline, ai_mode)
     
     return jsonify({
+        "upload": upload_fingerprint(video),
         "results": results,
         "ai_analysis": ai_analysis,
         "timestamp": datetime.now().isoformat()
@@ -1408,20 +4785,20 @@ def deepfake_detection_endpoint():
     if 'media' not in request.files:
         return jsonify({"error": "Media file is required"}), 400
     
-    media_file = request.files['media']
-    media_data = media_file.read()
+    media = request.files['media'].stream
     media_type = request.form.get('media_type', 'image')
     
+    ai_mode = requested_ai_mode(request.form)
+    deadline = request_deadline()
     # Run deepfake detection
-    results = osint_manager.deepfake_detection(media_data, media_type)
+    results = osint_manager.deepfake_detection(media, media_type)
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('openai', 
-        f"Analyze this {media_type} for deepfake detection. Provide insights about authenticity and potential manipulation.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('deepfake', None, results, deadline, ai_mode, media_type=media_type)
     
     return jsonify({
         "media_type": media_type,
+        "upload": upload_fingerprint(media),
         "results": results,
         "ai_analysis": ai_analysis,
         "timestamp": datetime.now().isoformat()
@@ -1433,18 +4810,18 @@ def face_detection_endpoint():
     if 'image' not in request.files:
         return jsonify({"error": "Image file is required"}), 400
     
-    image_file = request.files['image']
-    image_data = image_file.read()
+    image = request.files['image'].stream
     
+    ai_mode = requested_ai_mode(request.form)
+    deadline = request_deadline()
     # Run face detection
-    results = osint_manager.face_detection(image_data)
+    results = osint_manager.face_detection(image)
     
-    # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api('openai', 
-        "Analyze this image for face detection. Provide insights about faces, expressions, and potential identification.", 
-        results)
+    # Get AI analysis (inline, deferred or off)
+    ai_analysis = run_ai_stage('face', None, results, deadline, ai_mode)
     
     return jsonify({
+        "upload": upload_fingerprint(image),
         "results": results,
         "ai_analysis": ai_analysis,
         "timestamp": datetime.now().isoformat()
@@ -1463,73 +4840,15 @@ def shodan_search_endpoint():
     if not osint_manager.api_keys.get('shodan'):
         return jsonify({"error": "Shodan API key not configured"}), 400
     
+    ai_mode = requested_ai_mode(data)
+    deadline = request_deadline()
+
     try:
-        if search_type == 'host':
-            # Search for specific host/IP
-            url = f"https://api.shodan.io/shodan/host/{query}?key={osint_manager.api_keys['shodan']}"
-        else:
-            # General search
-            url = f"https://api.shodan.io/shodan/host/search?key={osint_manager.api_keys['shodan']}&query={query}"
-        
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            shodan_data = response.json()
-            
-            if search_type == 'host':
-                results = {
-                    "Shodan_Host_Search": {
-                        "success": True,
-                        "data": {
-                            "ip": shodan_data.get('ip_str'),
-                            "ports": shodan_data.get('ports', []),
-                            "hostnames": shodan_data.get('hostnames', []),
-                            "country_name": shodan_data.get('country_name'),
-                            "city": shodan_data.get('city'),
-                            "org": shodan_data.get('org'),
-                            "os": shodan_data.get('os'),
-                            "data": shodan_data.get('data', []),
-                            "message": f"Shodan data found for {query}"
-                        }
-                    }
-                }
-            else:
-                results = {
-                    "Shodan_General_Search": {
-                        "success": True,
-                        "data": {
-                            "total_results": shodan_data.get('total', 0),
-                            "matches": shodan_data.get('matches', []),
-                            "message": f"Found {shodan_data.get('total', 0)} Shodan results for '{query}'"
-                        }
-                    }
-                }
-        elif response.status_code == 403:
-            # Free plan limitation
-            results = {
-                "Shodan_Search": {
-                    "success": False,
-                    "error": "Shodan search requires paid membership. Free plan has limited access.",
-                    "upgrade_info": {
-                        "current_plan": "oss (Open Source Software)",
-                        "recommendation": "Upgrade to Membership or Professional plan for full search access",
-                        "alternative": "Use Shodan web interface for manual searches",
-                        "web_interface": f"https://www.shodan.io/search?query={query}"
-                    }
-                }
-            }
-        else:
-            results = {
-                "Shodan_Search": {
-                    "success": False,
-                    "error": f"Shodan API error: {response.status_code} - {response.text}"
-                }
-            }
+        # Run the Shodan query
+        results = osint_manager.shodan_search(query, search_type, deadline=lookup_budget(deadline, ai_mode))
         
-        # Get AI analysis
-        ai_analysis = osint_manager.call_ai_api('openai', 
-            f"Analyze this Shodan search data for '{query}'. Provide insights about exposed services, potential vulnerabilities, and security recommendations.", 
-            results)
+        # Get AI analysis (inline, deferred or off)
+        ai_analysis = run_ai_stage('shodan', query, results, deadline, ai_mode)
         
         return jsonify({
             "query": query,
@@ -1549,22 +4868,110 @@ def shodan_search_endpoint():
 def ai_analysis_endpoint():
     """AI analysis endpoint"""
     data = request.get_json()
-    provider = data.get('provider', 'openai')
-    prompt = data.get('prompt')
+    kind = data.get('kind')
+    if kind is not None and kind not in INVESTIGATIONS:
+        return jsonify({"error": f"Unsupported investigation type: {kind}"}), 400
+    # An investigation kind and target stand in for the prompt, matching the
+    # analysis (and cache entry) the lookup endpoints would have produced
+    # An explicitly requested provider is used as is; otherwise the routing policy picks one
+    provider = data.get('provider') or (INVESTIGATIONS[kind]['provider'] if kind else 'openai')
+    policy = 'fixed' if data.get('provider') else None
+    prompt = data.get('prompt') or (investigation_prompt(kind, data.get('target'), data.get('media_type') or 'image')
+                                    if kind else None)
     results = data.get('results')
     
     if not prompt:
         return jsonify({"error": "Prompt is required"}), 400
     
+    if data.get('stream') or request.args.get('stream') in ('1', 'true'):
+        provider = osint_manager.ai_route(provider, policy)[0]
+        return Response(stream_with_context(stream_ai_analysis(provider, prompt, results, request_deadline())),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     # Get AI analysis
-    ai_analysis = osint_manager.call_ai_api(provider, prompt, results)
+    ai_analysis = osint_manager.route_ai_api(provider, prompt, results, deadline=request_deadline(), policy=policy)
     
     return jsonify({
-        "provider": provider,
+        "provider": ai_analysis.get('meta', {}).get('provider', provider),
         "analysis": ai_analysis,
         "timestamp": datetime.now().isoformat()
     })
 
+@app.route('/api/batch/<kind>', methods=['POST'])
+def batch_endpoint(kind):
+    """Bulk phone, email, IP or website lookups streamed back as NDJSON"""
+    if kind not in BATCH_KINDS:
+        return jsonify({"error": f"Unsupported batch type: {kind}", "types": sorted(BATCH_KINDS)}), 400
+
+    targets = batch_targets(INVESTIGATIONS[kind]['field'])
+    # Batches skip AI analysis unless asked for with ?ai=inline
+    ai = request.args.get('ai') == 'inline'
+    # ?timeout= bounds each target's lookups, as it bounds a single lookup
+    return Response(stream_with_context(run_batch(kind, targets, ai=ai, timeout=request_timeout())),
+                    mimetype='application/x-ndjson')
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job_endpoint():
+    """Start an investigation in the background and return its job id at once"""
+    data = request.form if request.files else (request.get_json(silent=True) or {})
+    kind = data.get('type')
+    spec = INVESTIGATIONS.get(kind)
+    if spec is None:
+        return jsonify({"error": f"Unknown investigation type: {kind}", "types": sorted(INVESTIGATIONS)}), 400
+
+    options = {}
+    if spec.get('upload'):
+        if spec['field'] not in request.files:
+            return jsonify({"error": f"{spec['field'].capitalize()} file is required"}), 400
+        upload = request.files[spec['field']]
+        # The job gets the spooled file itself and removes it when it finishes
+        target = upload.stream.detach()
+        label = {"filename": upload.filename, "size_bytes": target.size_bytes}
+        options['media_type'] = data.get('media_type', 'image')
+    else:
+        target = data.get(spec['field']) or data.get('target')
+        if not target:
+            return jsonify({"error": f"{spec['field']} is required"}), 400
+        label = target
+        options['search_type'] = data.get('search_type', 'host')
+
+    ai = requested_ai_mode(data) != 'off'
+    try:
+        job = job_manager.submit(kind, target, label, options, ai)
+    except JobQueueFull as e:
+        if isinstance(target, UploadSpool):
+            target.close()
+        return jsonify({"error": f"Too many investigations in progress: {str(e)}"}), 429
+
+    response = jsonify({
+        "job_id": job['id'],
+        "status": job['status'],
+        "status_url": f"/api/jobs/{job['id']}",
+        "events_url": f"/api/jobs/{job['id']}/events",
+        "timestamp": datetime.now().isoformat()
+    })
+    response.status_code = 202
+    response.headers['Location'] = f"/api/jobs/{job['id']}"
+    return response
+
+@app.route('/api/jobs/<job_id>')
+def job_status_endpoint(job_id):
+    """Poll a job: status plus every source result received so far"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events_endpoint(job_id):
+    """Stream a job's source results as Server-Sent Events"""
+    if job_manager.get(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+    return Response(stream_with_context(job_manager.events(job_id)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == '__main__':
     # For deployment, use environment variable for port
     port = int(os.environ.get('PORT', 5000))
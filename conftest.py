@@ -0,0 +1,8 @@
+"""Shared pytest setup for the unit tests"""
+
+import os
+import tempfile
+
+# Keep the image index the app opens at import time out of the shared temp directory
+os.environ.setdefault('OSINT_IMAGE_INDEX_PATH',
+                      os.path.join(tempfile.mkdtemp(prefix='osint-tests-'), 'images.sqlite3'))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+Tests for AI analysis of lookup results
+"""
+
+import json
+import threading
+import time
+import uuid
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+import app
+
+
+def test_compact_results_drops_meta_and_repeated_banners():
+    banner = 'SSH-2.0-OpenSSH_8.9p1 Ubuntu-3ubuntu0.1 ' * 3
+    results = {
+        "Shodan_Host_Search": {"success": True, "meta": {"cache": "hit"}, "data": {
+            "ports": [22, 2222], "hostnames": [], "services": [{"banner": banner}, {"banner": banner}]
+        }}
+    }
+    compacted = json.loads(app.compact_results(results))
+    source = compacted['Shodan_Host_Search']
+    assert list(source) == ['success', 'data']
+    assert 'hostnames' not in source['data']
+    assert source['data']['services'] == [{"banner": banner}, {"banner": "[same as an earlier value]"}]
+
+
+def test_compact_results_fits_the_token_budget():
+    results = {"Subdomains": {"success": True, "data": {
+        "subdomains": [f"host-{i}.example.com" for i in range(2000)],
+        "html": "<html>" + "x" * 5000 + "</html>"
+    }}}
+    text = app.compact_results(results, token_budget=300)
+    assert len(text) <= 300 * 4
+    compacted = json.loads(text)
+    data = compacted['Subdomains']['data']
+    # Low-signal fields go first, then long lists are cut down with a count of the rest
+    assert 'html' not in data
+    assert data['subdomains'][-1].endswith('more')
+
+
+
+def test_prompt_content_embeds_compacted_results():
+    results = {"Services": {"success": True, "data": {f"port_{i}": f"banner of service {i}" for i in range(5000)}}}
+    content = app.ai_prompt_content("Analyze", results)
+    assert content.startswith("Analyze\n\nOSINT Results:\n{")
+    assert len(content) <= len("Analyze\n\nOSINT Results:\n") + app.AI_PROMPT_TOKEN_BUDGET * 4 + len("... (truncated)")
+    # A prompt for several targets gets each of them a full budget
+    assert len(app.ai_prompt_content("Analyze", results, targets=3)) > len(content)
+    assert app.ai_prompt_content("Analyze", {}).endswith('No results available')
+
+@pytest.mark.parametrize('query, body, mode', [('?ai=off', {'ai': 'inline'}, 'off'), ('', {'ai': False}, 'off'),
+                                               ('', {'ai': 'yes'}, 'inline'), ('?ai=DEFERRED', None, 'deferred'),
+                                               ('?ai=sometimes', None, app.AI_ANALYSIS_MODE), ('', {}, app.AI_ANALYSIS_MODE)])
+def test_requested_ai_mode(query, body, mode):
+    with app.app.test_request_context(f'/api/ip{query}'):
+        assert app.requested_ai_mode(body) == mode
+
+
+def test_inline_ai_leaves_lookups_a_share_of_the_deadline():
+    deadline = app.Deadline(10)
+    assert app.lookup_budget(deadline, 'inline').remaining() == pytest.approx(10 * app.LOOKUP_BUDGET_SHARE, abs=0.1)
+    assert app.lookup_budget(deadline, 'deferred') is deadline
+    assert app.lookup_budget(deadline, 'off') is deadline
+
+
+@pytest.fixture
+def analyses(monkeypatch):
+    """Prompts sent for analysis, inline or from a deferred job"""
+    prompts = []
+
+    def route_ai_api(preferred, prompt, results=None, deadline=None, **kwargs):
+        prompts.append(prompt)
+        return {"analysis": "looks benign", "meta": {"provider": preferred}}
+
+    def batched(kind, target, results, deadline, media_type='image'):
+        prompts.append(app.investigation_prompt(kind, target))
+        return {"analysis": "looks benign", "meta": {"provider": "openai"}}
+
+    monkeypatch.setattr(app.osint_manager, 'route_ai_api', route_ai_api)
+    monkeypatch.setattr(app.ai_batcher, 'analyze', batched)
+    return prompts
+
+
+def test_ai_off_skips_analysis(analyses):
+    response = app.app.test_client().post('/api/ip?timeout=0&ai=off', json={'ip_address': '192.0.2.1'})
+    assert response.get_json()['ai_analysis'] == {"status": "off"}
+    assert analyses == []
+
+
+def test_inline_ai_answers_with_the_lookups(analyses):
+    response = app.app.test_client().post('/api/ip?timeout=0', json={'ip_address': '192.0.2.1', 'ai': 'inline'})
+    assert response.get_json()['ai_analysis']['analysis'] == "looks benign"
+    assert len(analyses) == 1
+
+
+def test_deferred_ai_runs_as_a_job(analyses):
+    response = app.app.test_client().post('/api/ip?timeout=0&ai=deferred', json={'ip_address': '192.0.2.1'})
+    pending = response.get_json()['ai_analysis']
+    assert pending['status'] == 'pending'
+    assert pending['events_url'] == f"/api/jobs/{pending['job_id']}/events"
+    events = list(app.job_manager.events(pending['job_id'], keepalive=1))
+    assert events[-1].startswith('event: done')
+    job = app.job_manager.get(pending['job_id'])
+    assert job['ai_analysis']['analysis'] == "looks benign"
+    # The job carries the results already returned, for the analysis to use
+    assert 'IP_Validation' in job['results']
+
+
+def test_results_digest_ignores_cache_meta_and_key_order():
+    results = {"Geo": {"success": True, "data": {"city": "Oslo", "asn": 1}, "meta": {"cache": "miss"}}}
+    replayed = {"Geo": {"meta": {"cache": "hit", "age_seconds": 3}, "data": {"asn": 1, "city": "Oslo"}, "success": True}}
+    assert app.results_digest(results) == app.results_digest(replayed)
+    assert app.results_digest(results) != app.results_digest({"Geo": {"success": True, "data": {"city": "Bergen"}}})
+
+
+@pytest.fixture
+def ai_manager(monkeypatch):
+    manager = app.OSINTToolManager()
+    manager.api_keys['openai'] = 'test-key'
+    calls = []
+
+    def call_openai(prompt, results=None, deadline=None, targets=1):
+        calls.append(prompt)
+        return manager.reply
+
+    monkeypatch.setattr(manager, '_call_openai', call_openai)
+    manager.reply, manager.calls = {"analysis": "looks benign"}, calls
+    return manager
+
+
+def test_identical_analyses_are_served_from_cache(ai_manager):
+    results = {"Geo": {"success": True, "data": {"city": "Oslo"}, "meta": {"cache": "miss"}}}
+    first = ai_manager.call_ai_api('openai', 'Analyze', results)
+    assert first['meta']['cache'] == 'miss'
+    results['Geo']['meta'] = {"cache": "hit"}
+    second = ai_manager.call_ai_api('openai', 'Analyze', results)
+    assert second == {"analysis": "looks benign", "meta": dict(second['meta'], cache='hit')}
+    assert len(ai_manager.calls) == 1
+    # A different prompt or different results are a new analysis
+    ai_manager.call_ai_api('openai', 'Analyze again', results)
+    ai_manager.call_ai_api('openai', 'Analyze', {"Geo": {"success": True, "data": {"city": "Bergen"}}})
+    assert len(ai_manager.calls) == 3
+
+
+def test_failed_analyses_are_not_cached(ai_manager):
+    ai_manager.reply = {"error": "OpenAI HTTP 500"}
+    ai_manager.call_ai_api('openai', 'Analyze', {})
+    ai_manager.call_ai_api('openai', 'Analyze', {})
+    assert len(ai_manager.calls) == 2
+
+
+def test_status_reports_the_shared_cache_backend_once():
+    status = app.app.test_client().get('/api/status').get_json()
+    assert status['cache_backend']['backend'] == app.osint_manager.lookup_cache.backend.name
+    for cache in ('lookup_cache', 'ai_cache', 'upload_cache'):
+        assert set(status[cache]) == {"hits", "misses", "errors"}
+
+
+class StreamingAdapter(BaseAdapter):
+    """Transport adapter answering with an OpenAI-style event stream of the given text deltas"""
+
+    def __init__(self, deltas):
+        super().__init__()
+        self.deltas = deltas
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        body = ''.join(f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}\n\n" for text in self.deltas)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = (body + "data: [DONE]\n\n").encode('utf-8')
+        response._content_consumed = True
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def parse_sse(body):
+    """(event, data) pairs of a Server-Sent Events body"""
+    events = []
+    for block in body.split('\n\n'):
+        if not block:
+            continue
+        fields = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_sse_event_keeps_multiline_text_on_one_data_line():
+    event = app.sse_event('token', {"text": "line one\nline two"})
+    assert event == 'event: token\ndata: {"text": "line one\\nline two"}\n\n'
+    assert parse_sse(event) == [('token', {"text": "line one\nline two"})]
+
+
+def test_streamed_analysis_is_relayed_token_by_token(monkeypatch):
+    monkeypatch.setitem(app.osint_manager.api_keys, 'openai', 'test-key')
+    adapter = StreamingAdapter(["Looks ", "benign:\n", "no open ports"])
+    app.osint_manager._session('openai').mount('https://', adapter)
+    client = app.app.test_client()
+    prompt = f"Analyze {uuid.uuid4().hex}"
+    try:
+        response = client.post('/api/ai/analyze?stream=1', json={'provider': 'openai', 'prompt': prompt})
+        assert response.mimetype == 'text/event-stream'
+        events = parse_sse(response.get_data(as_text=True))
+        assert events[:-1] == [('token', {"text": "Looks "}), ('token', {"text": "benign:\n"}),
+                               ('token', {"text": "no open ports"})]
+        event, done = events[-1]
+        assert event == 'done'
+        assert done['provider'] == 'openai'
+        assert done['analysis']['analysis'] == "Looks benign:\nno open ports"
+
+        # The finished analysis is cached, and replayed as a single token
+        events = parse_sse(client.post('/api/ai/analyze?stream=1',
+                                       json={'provider': 'openai', 'prompt': prompt}).get_data(as_text=True))
+        assert events[0] == ('token', {"text": "Looks benign:\nno open ports"})
+        assert events[-1][1]['analysis']['meta']['cache'] == 'hit'
+        assert adapter.sent == 1
+    finally:
+        app.osint_manager._session('openai').mount('https://', HTTPAdapter(max_retries=0))
+
+
+@pytest.fixture
+def router(monkeypatch):
+    """A manager with both AI providers configured, answering from per-provider scripts"""
+    manager = app.OSINTToolManager()
+    manager.api_keys.update({'openai': 'test-key', 'gemini': 'test-key'})
+    manager.answers, manager.asked = {}, []
+
+    def call_ai_api(provider, prompt, results=None, deadline=None, targets=1):
+        manager.asked.append(provider)
+        return manager.answers[provider]()
+
+    monkeypatch.setattr(manager, 'call_ai_api', call_ai_api)
+    return manager
+
+
+def answer(text):
+    return lambda: {"analysis": text, "meta": {"cache": "miss"}}
+
+
+def fail():
+    return {"error": "AI API error: 500 Server Error", "meta": {"cache": "miss"}}
+
+
+def test_ai_route_orders_providers_by_policy(router):
+    assert router.ai_route('gemini', 'fixed') == ['gemini']
+    assert router.ai_route('gemini', 'fallback') == ['gemini', 'openai']
+    router.ai_latency.record('openai', 0.5)
+    router.ai_latency.record('gemini', 2.0)
+    assert router.ai_route('gemini', 'fastest') == ['openai', 'gemini']
+    assert router.ai_route('gemini', 'hedged') == ['openai', 'gemini']
+    # Only configured providers stand in, and those with an open breaker go last
+    router.breaker('openai').state = 'open'
+    assert router.ai_route('gemini', 'fastest') == ['gemini', 'openai']
+    router.api_keys['openai'] = None
+    assert router.ai_route('gemini', 'fallback') == ['gemini']
+
+
+def test_fixed_routing_does_not_fall_back(router):
+    router.answers.update(openai=fail, gemini=answer("from gemini"))
+    analysis = router.route_ai_api('openai', f"Analyze {uuid.uuid4().hex}", policy='fixed')
+    assert 'analysis' not in analysis
+    assert router.asked == ['openai']
+
+
+def test_fallback_routing_tries_the_next_provider(router):
+    router.answers.update(openai=fail, gemini=answer("from gemini"))
+    analysis = router.route_ai_api('openai', f"Analyze {uuid.uuid4().hex}", policy='fallback')
+    assert analysis['analysis'] == "from gemini"
+    assert analysis['meta']['provider'] == 'gemini'
+    assert router.asked == ['openai', 'gemini']
+    # Only the provider that answered has a latency sample
+    assert list(router.ai_latency.stats()) == ['gemini']
+
+
+def test_fastest_routing_asks_the_fastest_provider_first(router):
+    router.answers.update(openai=answer("from openai"), gemini=answer("from gemini"))
+    router.ai_latency.record('openai', 3.0)
+    router.ai_latency.record('gemini', 0.2)
+    analysis = router.route_ai_api('openai', f"Analyze {uuid.uuid4().hex}", policy='fastest')
+    assert analysis['meta']['provider'] == 'gemini'
+    assert router.asked == ['gemini']
+
+
+def test_hedged_routing_takes_whichever_answers_first(router, monkeypatch):
+    monkeypatch.setattr(app, 'AI_HEDGE_AFTER', 0.05)
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return answer("from openai")()
+
+    router.answers.update(openai=slow, gemini=answer("from gemini"))
+    try:
+        analysis = router.route_ai_api('openai', f"Analyze {uuid.uuid4().hex}", policy='hedged')
+    finally:
+        release.set()
+    assert analysis['analysis'] == "from gemini"
+    assert router.asked == ['openai', 'gemini']
+
+
+def test_hedged_routing_starts_the_next_provider_on_failure(router, monkeypatch):
+    monkeypatch.setattr(app, 'AI_HEDGE_AFTER', 5.0)
+    router.answers.update(openai=fail, gemini=answer("from gemini"))
+    started = time.monotonic()
+    analysis = router.route_ai_api('openai', f"Analyze {uuid.uuid4().hex}", policy='hedged')
+    # Without waiting for the hedge delay
+    assert time.monotonic() - started < 1
+    assert analysis['meta']['provider'] == 'gemini'
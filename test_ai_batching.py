@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Tests for multi-target AI analysis batching
+"""
+
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import app
+
+
+class FakeManager:
+    """Stands in for OSINTToolManager's AI routing; reply() decides what a batch prompt returns"""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+        self.stored = []
+        self._lock = threading.Lock()
+
+    def ai_route(self, preferred, policy=None):
+        return [preferred]
+
+    def cached_analysis(self, providers, prompt, results=None):
+        return None
+
+    def store_analysis(self, provider, prompt, results, analysis):
+        self.stored.append((prompt, analysis['analysis']))
+
+    def route_ai_api(self, preferred, prompt, results=None, deadline=None, policy=None, targets=1):
+        with self._lock:
+            self.calls.append({"prompt": prompt, "results": results, "targets": targets})
+        if targets > 1:
+            reply = self.reply(results)
+            if reply is None:
+                return {"error": "timeout", "message": "No AI provider answered in time"}
+            return {"analysis": reply, "meta": {"cache": "miss", "provider": preferred}}
+        return {"analysis": f"alone: {results['Lookup']['data']}", "meta": {"cache": "miss", "provider": preferred}}
+
+
+def item(target, data='x'):
+    results = {"Lookup": {"success": True, "data": data}}
+    return {"target": target, "prompt": app.investigation_prompt('ip', target), "results": results,
+            "deadline": None, "future": Future(), "tokens": app.AIBatcher.tokens(results)}
+
+
+def test_parse_batch_reply_reads_the_json_object():
+    text = 'Sure, here it is:\n```json\n{"t1": "first", "t2": {"risk": "low"}}\n```'
+    assert app.parse_batch_reply(text) == {"t1": "first", "t2": '{"risk": "low"}'}
+
+
+def test_parse_batch_reply_rejects_cut_off_or_non_object_replies():
+    assert app.parse_batch_reply('{"t1": "first", "t2": "sec') == {}
+    assert app.parse_batch_reply('no json here') == {}
+    assert app.parse_batch_reply('["t1", "t2"]') == {}
+
+
+def test_batch_reply_is_split_per_target():
+    manager = FakeManager(lambda results: json.dumps({key: f"about {value['target']}" for key, value in results.items()}))
+    batcher = app.AIBatcher(manager)
+    group = [item('1.1.1.1'), item('8.8.8.8')]
+    batcher._analyze_batch('ip', group)
+
+    assert [i['future'].result()['analysis'] for i in group] == ["about 1.1.1.1", "about 8.8.8.8"]
+    assert group[0]['future'].result()['meta']['batch_size'] == 2
+    # One prompt for both, with both targets' budgets, and each answer cached as if asked alone
+    assert len(manager.calls) == 1 and manager.calls[0]['targets'] == 2
+    assert sorted(manager.stored) == sorted([(group[0]['prompt'], "about 1.1.1.1"), (group[1]['prompt'], "about 8.8.8.8")])
+
+
+def test_targets_missing_from_the_reply_fall_back_to_single_analyses():
+    manager = FakeManager(lambda results: json.dumps({"t1": "about t1"}))
+    batcher = app.AIBatcher(manager)
+    group = [item('1.1.1.1', 'one'), item('8.8.8.8', 'two'), item('9.9.9.9', 'three')]
+    batcher._analyze_batch('ip', group)
+
+    assert group[0]['future'].result()['analysis'] == "about t1"
+    assert group[1]['future'].result()['analysis'] == "alone: two"
+    assert group[2]['future'].result()['analysis'] == "alone: three"
+    assert batcher.stats()['fallbacks'] == 2
+    assert [call['targets'] for call in manager.calls] == [3, 1, 1]
+
+
+def test_unparseable_reply_falls_back_for_every_target():
+    manager = FakeManager(lambda results: '{"t1": "trunc')
+    batcher = app.AIBatcher(manager)
+    group = [item('1.1.1.1', 'one'), item('8.8.8.8', 'two')]
+    batcher._analyze_batch('ip', group)
+    assert [i['future'].result()['analysis'] for i in group] == ["alone: one", "alone: two"]
+
+
+def test_failed_batch_falls_back_for_every_target():
+    manager = FakeManager(lambda results: None)
+    batcher = app.AIBatcher(manager)
+    group = [item('1.1.1.1', 'one'), item('8.8.8.8', 'two')]
+    batcher._analyze_batch('ip', group)
+    assert [i['future'].result()['analysis'] for i in group] == ["alone: one", "alone: two"]
+    assert batcher.stats()['fallbacks'] == 2
+
+
+def test_fallbacks_do_not_wait_on_the_managers_ai_pool():
+    # Hedged routing runs provider calls on the manager's AI pool and waits for
+    # them; fallbacks queued on that same pool could leave no worker to run them
+    class HedgingManager(FakeManager):
+        def __init__(self, reply):
+            super().__init__(reply)
+            self._ai_executor = ThreadPoolExecutor(max_workers=1)
+
+        def route_ai_api(self, preferred, prompt, results=None, deadline=None, policy=None, targets=1):
+            call = super().route_ai_api
+            return self._ai_executor.submit(call, preferred, prompt, results, deadline, policy, targets).result(timeout=5)
+
+    batcher = app.AIBatcher(HedgingManager(lambda results: '{}'))
+    group = [item('1.1.1.1', 'one'), item('8.8.8.8', 'two')]
+    batcher._analyze_batch('ip', group)
+    assert [i['future'].result()['analysis'] for i in group] == ["alone: one", "alone: two"]
+
+
+def test_default_budgets_fit_the_smallest_context_window(monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'openai', {'model': 'gpt-4', 'context_window': 8192})
+    monkeypatch.setattr(app, 'AI_BATCH_TOKEN_BUDGET', 0)
+    assert app.AIBatcher(FakeManager(None)).token_budget == 6144
+    monkeypatch.setattr(app, 'AI_BATCH_TOKEN_BUDGET', 16000)
+    assert app.AIBatcher(FakeManager(None)).token_budget == 8192
+    assert app.ai_output_tokens('openai', "Analyze", targets=2) == 2 * app.AI_MAX_OUTPUT_TOKENS
+
+
+def test_reply_tokens_are_cut_to_what_the_prompt_leaves(monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'openai', {'model': 'gpt-4', 'context_window': 3500})
+    results = {"Services": {"success": True, "data": {f"port_{i}": f"banner of service {i}" for i in range(5000)}}}
+    content = app.ai_prompt_content("Analyze", results)
+    assert 3500 - len(content) // 4 < app.AI_MAX_OUTPUT_TOKENS
+    assert app.ai_output_tokens('openai', content) == 3500 - len(content) // 4
+    assert app.ai_output_tokens('gemini', content) == app.AI_MAX_OUTPUT_TOKENS
+
+
+def test_groups_are_split_to_fit_the_token_budget():
+    batcher = app.AIBatcher(FakeManager(None), token_budget=3 * app.AIBatcher.tokens({"Lookup": {"success": True, "data": 'x'}}))
+    batches = batcher.pack([item(str(i)) for i in range(7)])
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+
+
+def test_concurrent_analyses_share_one_prompt():
+    manager = FakeManager(lambda results: json.dumps({key: f"about {value['target']}" for key, value in results.items()}))
+    batcher = app.AIBatcher(manager, window=0.2, max_size=8)
+    targets = ['1.1.1.1', '8.8.8.8', '9.9.9.9']
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        analyses = list(pool.map(lambda t: batcher.analyze('ip', t, {"Lookup": {"success": True, "data": t}}), targets))
+    assert [a['analysis'] for a in analyses] == [f"about {t}" for t in targets]
+    assert len(manager.calls) == 1
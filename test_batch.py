@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests for the NDJSON batch endpoints
+"""
+
+import io
+import json
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def looked_up(monkeypatch):
+    """Targets the stubbed investigate() saw, with the seconds left on their deadline"""
+    seen = {}
+
+    def investigate(kind, target, deadline=None, *args, **kwargs):
+        seen[target] = deadline.remaining()
+        return {"Echo": {"success": True, "data": {"kind": kind}}}
+
+    monkeypatch.setattr(app.osint_manager, 'investigate', investigate)
+    return seen
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def lines(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+NDJSON = b'"192.0.2.1"\n{"ip_address": "192.0.2.2"}\n{"target": "192.0.2.3"}\n\n192.0.2.4\n" 192.0.2.1"\n'
+TARGETS = ['192.0.2.1', '192.0.2.2', '192.0.2.3', '192.0.2.4']
+
+
+def test_json_array(client, looked_up):
+    response = client.post('/api/batch/ip', json=['192.0.2.1', {'ip_address': '192.0.2.2'}, ' 192.0.2.1', '', None])
+    assert sorted(line['target'] for line in lines(response)) == ['192.0.2.1', '192.0.2.2']
+
+
+def test_targets_object(client, looked_up):
+    response = client.post('/api/batch/ip', json={'targets': ['192.0.2.1', '192.0.2.2']})
+    assert sorted(line['target'] for line in lines(response)) == ['192.0.2.1', '192.0.2.2']
+
+
+@pytest.mark.parametrize('content_type', ['application/x-ndjson', 'application/jsonl', 'text/plain'])
+def test_ndjson_body(client, looked_up, content_type):
+    response = client.post('/api/batch/ip', data=NDJSON, content_type=content_type)
+    assert sorted(line['target'] for line in lines(response)) == TARGETS
+
+
+def test_ndjson_file_upload(client, looked_up):
+    response = client.post('/api/batch/ip', data={'file': (io.BytesIO(NDJSON), 'targets.ndjson')})
+    assert sorted(line['target'] for line in lines(response)) == TARGETS
+
+
+def test_lines_carry_normalized_target_and_results(client, looked_up):
+    [line] = lines(client.post('/api/batch/email', json=['Someone@Example.COM']))
+    assert line == {"target": "Someone@Example.COM", "normalized": "someone@example.com",
+                    "results": {"Echo": {"success": True, "data": {"kind": "email"}}}}
+
+
+def test_timeout_bounds_each_target(client, looked_up):
+    lines(client.post('/api/batch/ip?timeout=2', json=['192.0.2.1', '192.0.2.2']))
+    assert all(remaining <= 2 for remaining in looked_up.values())
+    lines(client.post('/api/batch/ip', json=['192.0.2.3']))
+    assert looked_up['192.0.2.3'] > 2
+
+
+def test_unknown_batch_type(client):
+    assert client.post('/api/batch/social', json=['someone']).status_code == 400
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Tests for the lookup cache backends (memory, SQLite and Redis over RESP)
+"""
+
+import fnmatch
+import socketserver
+import threading
+import time
+
+import pytest
+
+import app
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough RESP for RedisCacheBackend"""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def bulk(self, value):
+        self.wfile.write(b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            server.commands.append(command)
+            if command == b'AUTH':
+                ok = args[1] == server.password
+                self.wfile.write(b'+OK\r\n' if ok else b'-WRONGPASS invalid password\r\n')
+            elif command == b'SELECT':
+                server.db = int(args[1])
+                self.wfile.write(b'+OK\r\n')
+            elif command == b'GET':
+                entry = server.data.get(args[1])
+                self.bulk(entry[0] if entry and entry[1] > time.time() else None)
+            elif command == b'SET':
+                server.data[args[1]] = (args[2], time.time() + int(args[4]) / 1000)
+                self.wfile.write(b'+OK\r\n')
+            elif command == b'DEL':
+                removed = sum(server.data.pop(key, None) is not None for key in args[1:])
+                self.wfile.write(b':%d\r\n' % removed)
+            elif command == b'SCAN':
+                keys = [key for key in server.data if fnmatch.fnmatch(key.decode(), args[3].decode())]
+                self.wfile.write(b'*2\r\n')
+                self.bulk(b'0')
+                self.wfile.write(b'*%d\r\n' % len(keys))
+                for key in keys:
+                    self.bulk(key)
+            elif command == b'EVAL':
+                # Same arithmetic as the Lua script, which a real server would run
+                rate, burst, now, penalty = (float(arg) for arg in args[4:8])
+                tokens, updated = server.buckets.get(args[3], (burst, now))
+                tokens, wait = app.token_bucket(tokens, updated, now, rate, burst, penalty)
+                server.buckets[args[3]] = (tokens, now)
+                self.bulk(repr(wait).encode())
+            elif command == b'QUIT':
+                self.wfile.write(b'+OK\r\n')
+                return
+            else:
+                self.wfile.write(b'-ERR unknown command\r\n')
+
+
+@pytest.fixture
+def redis_server():
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data, server.buckets, server.commands = {}, {}, []
+    server.password, server.db = b'secret', 0
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def backend(request, tmp_path):
+    if request.param == 'memory':
+        return app.MemoryCacheBackend(max_entries=100)
+    if request.param == 'sqlite':
+        return app.SQLiteCacheBackend(str(tmp_path / 'cache.sqlite3'))
+    server = request.getfixturevalue('redis_server')
+    return app.RedisCacheBackend(f"redis://:secret@127.0.0.1:{server.server_address[1]}/0")
+
+
+def test_set_get_delete(backend):
+    assert backend.get('missing') is None
+    backend.set('key', b'\x00value\r\n', 60)
+    assert backend.get('key') == b'\x00value\r\n'
+    backend.delete('key')
+    assert backend.get('key') is None
+
+
+def test_entries_expire(backend):
+    backend.set('short', b'v', 0.05)
+    time.sleep(0.1)
+    assert backend.get('short') is None
+
+
+def test_clear(backend):
+    backend.set('a', b'1', 60)
+    backend.set('b', b'2', 60)
+    backend.clear()
+    assert backend.get('a') is None and backend.get('b') is None
+
+
+def test_take_token_waits_once_the_burst_is_spent(backend):
+    assert backend.take_token('bucket', rate=1.0, burst=2) == 0
+    assert backend.take_token('bucket', rate=1.0, burst=2) == 0
+    assert 0.5 < backend.take_token('bucket', rate=1.0, burst=2) <= 1.0
+
+
+def test_lookup_cache_replays_responses(backend):
+    cache = app.LookupCache(backend)
+    cache.set('k', app.ProviderResponse(404, b'{"error": "not found"}'), 60)
+    response = cache.get('k')
+    assert response.status_code == 404
+    assert response.json() == {"error": "not found"}
+    assert response.from_cache
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = app.MemoryCacheBackend(max_entries=2)
+    backend.set('a', b'1', 60)
+    backend.set('b', b'2', 60)
+    backend.get('a')
+    backend.set('c', b'3', 60)
+    assert backend.get('b') is None
+    assert backend.get('a') == b'1'
+
+
+def test_redis_authenticates_and_selects_the_database(redis_server):
+    port = redis_server.server_address[1]
+    backend = app.RedisCacheBackend(f"redis://:secret@127.0.0.1:{port}/3", prefix='t:')
+    backend.set('key', b'v', 60)
+    assert redis_server.commands[:2] == [b'AUTH', b'SELECT']
+    assert redis_server.db == 3
+    assert b't:key' in redis_server.data
+
+
+def test_redis_error_replies_raise(redis_server):
+    backend = app.RedisCacheBackend(f"redis://:wrong@127.0.0.1:{redis_server.server_address[1]}/0")
+    with pytest.raises(RuntimeError, match='WRONGPASS'):
+        backend.get('key')
+
+
+def test_redis_reconnects_after_a_dropped_connection(redis_server):
+    backend = app.RedisCacheBackend(f"redis://:secret@127.0.0.1:{redis_server.server_address[1]}/0")
+    backend.set('key', b'v', 60)
+    # The server closes the pooled connection; the next command reconnects
+    backend._command('QUIT')
+    assert backend.get('key') == b'v'
+
+
+def test_lookup_cache_skips_a_failing_backend(monkeypatch):
+    backend = app.RedisCacheBackend('redis://127.0.0.1:1/0', socket_timeout=0.2)
+    cache = app.LookupCache(backend)
+    assert cache.get('k') is None
+    assert cache.errors == 1
+    # Backing off: the next lookup does not try the backend again
+    assert cache.get('k') is None
+    assert cache.errors == 1
+
+
+def test_unusable_sqlite_path_falls_back_to_memory(monkeypatch, tmp_path):
+    monkeypatch.setenv('OSINT_CACHE_BACKEND', 'sqlite')
+    monkeypatch.setenv('OSINT_CACHE_PATH', str(tmp_path / 'missing' / 'cache.sqlite3'))
+    assert isinstance(app.create_cache_backend(), app.MemoryCacheBackend)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared decode of uploaded images
+"""
+
+import io
+
+import pytest
+from PIL import Image
+
+import app
+
+
+def png(size=(16, 8)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Every Image.open call made through app"""
+    calls = []
+    open_image = Image.open
+    monkeypatch.setattr(app.Image, 'open', lambda *args, **kwargs: calls.append(args) or open_image(*args, **kwargs))
+    return calls
+
+
+@pytest.fixture
+def no_temp_files(monkeypatch):
+    def refuse(*args, **kwargs):
+        raise AssertionError('image analysis wrote a temporary file')
+
+    monkeypatch.setattr(app.tempfile, 'mkstemp', refuse)
+    monkeypatch.setattr(app.tempfile, 'NamedTemporaryFile', refuse)
+
+
+def test_analyzers_share_one_decode(opened, no_temp_files):
+    manager = app.OSINTToolManager()
+    image = app.DecodedImage(png())
+    results = manager._image_osint(image, app.EXIF_DEFAULT_GROUPS)
+    manager._face_detection(image)
+    assert len(opened) == 1
+    assert results['Image_Analysis'] == {"success": True, "data": {
+        "format": "PNG", "mode": "RGB", "size": (16, 8), "width": 16, "height": 8}}
+    assert results['EXIF_Data']['data'] == {"message": "No EXIF data found"}
+    assert results['Perceptual_Hashes']['success']
+
+
+def test_decoded_image_passes_through():
+    image = app.DecodedImage(png())
+    assert app.DecodedImage.of(image) is image
+    assert app.DecodedImage.of(png()).size_bytes == len(png())
+
+
+def test_spooled_upload_is_read_in_place(no_temp_files):
+    spool = app.UploadSpool()
+    spool.write(png())
+    image = app.DecodedImage(spool)
+    assert image.analysis_envelope()['data']['size'] == (16, 8)
+    assert image.size_bytes == spool.size_bytes
+    assert spool.path is None
+
+
+def test_undecodable_upload_fails_each_analyzer_cleanly():
+    results = app.OSINTToolManager()._image_osint(app.DecodedImage(b'not an image'), app.EXIF_DEFAULT_GROUPS)
+    assert not results['Image_Analysis']['success']
+    assert 'cannot identify image file' in results['Image_Analysis']['error']
+    assert not results['EXIF_Data']['success']
+    assert not results['Perceptual_Hashes']['success']
+
+
+def tiff_with_exif():
+    exif = Image.Exif()
+    exif[0x010F] = 'Canon'
+    exif[0x0110] = 'EOS R5'
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, 'TIFF', exif=exif)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('spooled', [False, True])
+def test_tiff_is_read_as_its_own_exif_block(spooled):
+    data = tiff_with_exif()
+    if spooled:
+        spool = app.UploadSpool(threshold=0)
+        spool.write(data)
+        data = spool
+    image = app.DecodedImage(data)
+    exif = image.exif
+    assert exif.group('camera') == {'make': 'Canon', 'model': 'EOS R5'}
+    # Parsed once, then kept
+    assert image.exif is exif
+
+
+def test_image_endpoint_reports_the_upload_and_its_analysis(monkeypatch):
+    monkeypatch.setattr(app.osint_manager, 'blob_store', None)
+    client = app.app.test_client()
+    data = png((12, 12))
+    response = client.post('/api/image', data={'image': (io.BytesIO(data), 'red.png'), 'ai': 'off'})
+    body = response.get_json()
+    assert body['upload']['size_bytes'] == len(data)
+    assert body['results']['Image_Analysis']['data']['width'] == 12
+    assert body['ai_analysis'] == {"status": "off"}
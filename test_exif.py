@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Tests for the lazy EXIF reader
+"""
+
+import io
+
+import pytest
+from PIL import Image
+from PIL.TiffImagePlugin import IFDRational
+
+import app
+
+
+def exif_block():
+    exif = Image.Exif()
+    exif[0x010F] = 'Canon'
+    exif[0x0110] = 'EOS R5'
+    exif[0x8769] = {0x9003: '2024:01:02 03:04:05', 0x829D: IFDRational(28, 10)}
+    exif[0x8825] = {
+        1: 'S', 2: (IFDRational(33), IFDRational(51), IFDRational(3036, 100)),
+        3: 'E', 4: (IFDRational(151), IFDRational(12), IFDRational(4068, 100)),
+        5: b'\x01', 6: IFDRational(125, 10),
+        7: (IFDRational(13), IFDRational(45), IFDRational(30)), 0x1D: '2024:01:02'
+    }
+    return exif.tobytes()
+
+
+def test_gps_in_decimal_degrees():
+    gps = app.ExifReader(exif_block()).group('gps')
+    assert gps['latitude'] == pytest.approx(-33.8584333)
+    assert gps['longitude'] == pytest.approx(151.2113)
+    assert gps['altitude_m'] == -12.5
+    assert gps['timestamp_utc'] == '2024:01:02 13:45:30.000'
+
+
+def test_groups_decode_only_their_tags():
+    reader = app.ExifReader(exif_block())
+    assert reader.group('camera') == {'make': 'Canon', 'model': 'EOS R5', 'f_number': 2.8}
+    assert reader.group('timestamps') == {'original': '2024:01:02 03:04:05'}
+    # Only IFD0 and the Exif IFD were indexed; GPS was never asked for
+    assert set(reader._ifds) == {'ifd0', 'exif'}
+
+
+def test_exif_from_jpeg_app1():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8)).save(buffer, 'JPEG', exif=exif_block())
+    assert app.DecodedImage(buffer.getvalue()).exif.group('gps')['longitude'] == pytest.approx(151.2113)
+
+
+def test_truncated_block_raises_value_error():
+    block = exif_block()
+    for length in range(len(block)):
+        try:
+            reader = app.ExifReader(block[:length])
+            for group in app.ExifReader.GROUPS:
+                reader.group(group)
+        except ValueError:
+            continue
+        # A prefix that decodes cleanly must have kept everything the groups read
+        assert reader.group('gps') == app.ExifReader(block).group('gps')
+
+
+def test_not_an_exif_block():
+    with pytest.raises(ValueError):
+        app.ExifReader(b'JFIF\x00\x00\x00\x00')
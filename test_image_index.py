@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for the perceptual-hash image index and /api/image/similar
+"""
+
+import random
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('phash', ['-000000000000001', '+00000000000000f', '0000_00000000000',
+                                   'f' * 17, 'f' * 15, ' 00000000000000f', 'ghijklmnopqrstuv', 12])
+def test_similar_rejects_malformed_phash(client, phash):
+    response = client.post('/api/image/similar', json={'phash': phash})
+    assert response.status_code == 400
+
+
+def test_similar_accepts_full_range_phash(client):
+    response = client.post('/api/image/similar', json={'phash': 'FFFFFFFFFFFFFFFF'})
+    assert response.status_code == 200
+    assert response.get_json()['query']['phash'] == 'ffffffffffffffff'
+
+
+def test_unopenable_index_disables_search(client, tmp_path, monkeypatch):
+    # A directory cannot be opened as a database
+    monkeypatch.setenv('OSINT_IMAGE_INDEX_PATH', str(tmp_path))
+    index = app.open_image_index()
+    assert index is None
+    monkeypatch.setattr(app.osint_manager, 'image_index', index)
+    response = client.post('/api/image/similar', json={'phash': '0' * 16})
+    assert response.status_code == 503
+
+
+def random_hashes(rng, phash=None):
+    return {"phash": rng.getrandbits(64) if phash is None else phash,
+            "dhash": rng.getrandbits(64), "ahash": rng.getrandbits(64)}
+
+
+@pytest.fixture
+def index(tmp_path):
+    return app.ImageIndex(str(tmp_path / 'images.sqlite3'))
+
+
+def test_search_finds_exactly_the_images_within_distance(index):
+    rng = random.Random(7)
+    # Above 2**63, so the signed storage of the pHash is exercised too
+    query = (1 << 63) | rng.getrandbits(63)
+    indexed = {}
+    for n in range(app.ImageIndex.MAX_DISTANCE + 3):
+        for i in range(3):
+            # n flipped bits, spread over the chunks differently each time
+            phash = query
+            for bit in rng.sample(range(64), n):
+                phash ^= 1 << bit
+            indexed[f"near-{n}-{i}"] = phash
+    for i in range(200):
+        indexed[f"random-{i}"] = rng.getrandbits(64)
+    for sha256, phash in indexed.items():
+        index.add(sha256, random_hashes(rng, phash), {"format": "PNG", "width": 8, "height": 8})
+
+    for max_distance in (0, 3, 4, 8, app.ImageIndex.MAX_DISTANCE):
+        matches = index.search({"phash": query}, max_distance, limit=1000)
+        expected = {sha256 for sha256, phash in indexed.items() if (phash ^ query).bit_count() <= max_distance}
+        assert {match['sha256'] for match in matches} == expected
+        distances = [match['distance'] for match in matches]
+        assert distances == sorted(distances)
+        assert all(match['distance'] == (int(match['phash'], 16) ^ query).bit_count() for match in matches)
+
+
+def test_search_limit_and_exclude(index):
+    rng = random.Random(11)
+    query = rng.getrandbits(64)
+    index.add('query', random_hashes(rng, query))
+    for bit in range(5):
+        index.add(f"near-{bit}", random_hashes(rng, query ^ (1 << bit)))
+    matches = index.search({"phash": query}, 8, limit=3, exclude='query')
+    assert len(matches) == 3
+    assert all(match['sha256'].startswith('near-') and match['distance'] == 1 for match in matches)
+
+
+def test_image_keeps_its_first_entry(index):
+    rng = random.Random(3)
+    first = random_hashes(rng)
+    index.add('image', first)
+    index.add('image', random_hashes(rng))
+    assert index.get('image') == first
+    assert index.get('unknown') is None
+    assert index.stats()['indexed'] == 1
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests for background investigation jobs
+"""
+
+import io
+import os
+import time
+
+import app
+
+
+def test_job_state_is_not_stored_with_lookups():
+    assert app.job_manager.backend is not app.osint_manager.lookup_cache.backend
+
+
+def test_lookup_traffic_does_not_evict_jobs():
+    job = app.job_manager._create('social', 'someone', ai=False)
+    # Read it back from the store, as another worker would
+    del app.job_manager._jobs[job['id']]
+    lookups = app.osint_manager.lookup_cache.backend
+    for i in range(lookups.max_entries + 1):
+        lookups.set(f"test:{i}", b'x', 60)
+    assert app.job_manager.get(job['id'])['target'] == 'someone'
+
+
+def test_unknown_job_stream_sends_job_error():
+    events = list(app.job_manager.events('no-such-job'))
+    assert events == [app.sse_event('job_error', {"error": "Job not found"})]
+
+
+def test_job_events_end_with_done():
+    job = app.job_manager.submit('social', 'someone_else', ai=False)
+    events = list(app.job_manager.events(job['id'], keepalive=1))
+    assert events[-1].startswith('event: done')
+    assert any(event.startswith('event: source') for event in events)
+
+
+def test_upload_job_reads_spooled_file_and_removes_it(monkeypatch):
+    seen = {}
+    investigate = app.osint_manager.investigate
+
+    def spy(kind, target, *args, **kwargs):
+        seen['path'] = target.path
+        seen['on_disk'] = os.path.exists(target.path)
+        return investigate(kind, target, *args, **kwargs)
+
+    monkeypatch.setattr(app.osint_manager, 'investigate', spy)
+    client = app.app.test_client()
+    response = client.post('/api/jobs', data={'type': 'deepfake', 'ai': 'off', 'media_type': 'video',
+                                              'media': (io.BytesIO(b'\0' * 4096), 'clip.mp4')})
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    events = list(app.job_manager.events(job_id, keepalive=1))
+    assert events[-1].startswith('event: done')
+    assert seen['on_disk']
+    assert not os.path.exists(seen['path'])
+    assert app.job_manager.get(job_id)['target'] == {"filename": "clip.mp4", "size_bytes": 4096}
+
+
+class WorkerKilled(BaseException):
+    """Escapes the job's own error handling, like a worker being torn down"""
+
+
+def test_job_whose_worker_dies_ends_its_stream(monkeypatch):
+    def die(*args, **kwargs):
+        raise WorkerKilled()
+
+    monkeypatch.setattr(app.osint_manager, 'investigate', die)
+    job = app.job_manager.submit('social', 'doomed', ai=False)
+    events = list(app.job_manager.events(job['id'], keepalive=1))
+    assert events[-1] == app.sse_event('job_error', {"error": "Job worker stopped without finishing"})
+    assert app.job_manager.get(job['id'])['status'] == 'failed'
+
+
+def test_stream_of_a_stalled_job_ends_after_max_idle():
+    # Created but never run, as if the process running it had died
+    job = app.job_manager._create('social', 'stalled', ai=False)
+    started = time.monotonic()
+    events = list(app.job_manager.events(job['id'], keepalive=0.05, max_idle=0.3))
+    assert time.monotonic() - started < 2
+    assert events[-1].startswith('event: job_error')
+    assert 'no progress' in events[-1]
+    app.job_manager._update(job, status='failed')
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Tests for provider lookups: pooled sessions, fan-out, deadlines and the result cache
+"""
+
+import json
+import threading
+import time
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+import app
+
+
+@pytest.fixture
+def manager():
+    return app.OSINTToolManager()
+
+
+def test_each_provider_gets_one_pooled_session(manager):
+    session = manager._session('shodan')
+    assert manager._session('shodan') is session
+    assert manager._session('ipapi') is not session
+
+
+def test_session_pool_follows_provider_settings(manager, monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'pooled', {'pool_connections': 3, 'pool_maxsize': 7})
+    adapter = manager._session('pooled').get_adapter('https://pooled.invalid/')
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 7
+    # Retries are left to _request, which knows the deadline
+    assert adapter.max_retries.total == 0
+
+
+def test_fan_out_runs_sources_concurrently(manager):
+    # Each source waits for the other, so this only finishes if they overlap
+    barrier = threading.Barrier(2, timeout=5)
+
+    def source(name, deadline=None):
+        barrier.wait()
+        return {"success": True, "data": {"name": name}}
+
+    results = manager._fan_out({'Links': {"success": True, "data": {}}},
+                               {'B': (source, 'b'), 'A': (source, 'a')}, app.Deadline(10))
+    # Declaration order, whichever source finished first
+    assert list(results) == ['Links', 'B', 'A']
+    assert results['A']['data'] == {"name": "a"}
+
+
+def test_fan_out_times_out_slow_sources(manager):
+    release = threading.Event()
+
+    def slow(deadline=None):
+        release.wait(5)
+        return {"success": True, "data": {}}
+
+    def fast(deadline=None):
+        return {"success": True, "data": {}}
+
+    seen = []
+    try:
+        results = manager._fan_out({}, {'Slow': (slow,), 'Fast': (fast,)}, app.Deadline(0.1),
+                                   on_result=lambda name, envelope: seen.append(name))
+    finally:
+        release.set()
+    assert results['Fast']['success']
+    assert results['Slow']['error'] == 'timeout'
+    assert seen == ['Fast', 'Slow']
+
+
+def test_fan_out_turns_exceptions_into_error_envelopes(manager):
+    def broken(deadline=None):
+        raise RuntimeError('provider returned garbage')
+
+    results = manager._fan_out({}, {'Broken': (broken,)})
+    assert results['Broken'] == {"success": False, "error": "provider returned garbage"}
+
+
+@pytest.mark.parametrize('query, seconds', [('?timeout=2', 2), ('?timeout=-1', 0), ('?timeout=soon', app.REQUEST_DEADLINE),
+                                            (f'?timeout={app.REQUEST_DEADLINE * 10}', app.REQUEST_DEADLINE), ('', app.REQUEST_DEADLINE)])
+def test_request_deadline_honours_and_caps_timeout(query, seconds):
+    with app.app.test_request_context(f'/api/ip{query}'):
+        assert app.request_deadline().remaining() == pytest.approx(seconds, abs=0.5)
+
+
+def test_exhausted_deadline_skips_the_provider(manager):
+    deadline = app.Deadline(0)
+    with pytest.raises(app.SourceTimeout):
+        manager._send('ipapi', 'GET', 'https://ipapi.invalid/', deadline=deadline)
+    # The call never counted for or against the provider
+    assert manager.breaker('ipapi').snapshot()['calls'] == 0
+
+
+def test_endpoint_timeout_reaches_every_source():
+    client = app.app.test_client()
+    response = client.post('/api/ip?timeout=0', json={'ip_address': '192.0.2.1', 'ai': 'off'})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert results['IP_Validation']['success']
+    assert results['IP_Geolocation']['error'] == 'timeout'
+    assert results['Shodan_IP_Search']['error'] == 'timeout'
+
+
+class CannedAdapter(BaseAdapter):
+    """Transport adapter answering every request with one status code and body"""
+
+    def __init__(self, status_code, body):
+        super().__init__()
+        self.status_code = status_code
+        self.body = body
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        response = requests.Response()
+        response.status_code = self.status_code
+        response._content = json.dumps(self.body).encode('utf-8')
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def cached(manager, monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'cached', {'retries': 0, 'cache_ttl': 60.0, 'negative_ttl': 5.0})
+    ttls = []
+    set_entry = manager.lookup_cache.set
+    monkeypatch.setattr(manager.lookup_cache, 'set',
+                        lambda key, response, ttl: ttls.append(ttl) or set_entry(key, response, ttl))
+
+    def answer(status_code, body):
+        adapter = CannedAdapter(status_code, body)
+        manager._session('cached').mount('https://', adapter)
+        return adapter
+
+    manager.answer, manager.ttls = answer, ttls
+    return manager
+
+
+def lookup(manager, target='Example.COM'):
+    return manager._lookup_request('cached', 'domain', target, 'https://cached.invalid/')
+
+
+def test_lookups_are_cached_by_normalized_target(cached):
+    adapter = cached.answer(200, {"org": "Example"})
+    assert not lookup(cached).from_cache
+    response = lookup(cached, 'example.com.')
+    assert response.from_cache
+    assert response.json() == {"org": "Example"}
+    assert adapter.sent == 1
+    assert cached.ttls == [60.0]
+
+
+def test_cached_lookups_expire(cached, monkeypatch):
+    adapter = cached.answer(200, {"org": "Example"})
+    lookup(cached)
+    later = time.time() + 61
+    monkeypatch.setattr(app.time, 'time', lambda: later)
+    assert not lookup(cached).from_cache
+    assert adapter.sent == 2
+
+
+@pytest.mark.parametrize('status_code, body', [(404, {"error": "Not found"}), (200, {"valid": False}),
+                                               (200, {"error": "reserved range"})])
+def test_negative_answers_use_negative_ttl(cached, status_code, body):
+    cached.answer(status_code, body)
+    lookup(cached)
+    assert cached.ttls == [5.0]
+
+
+@pytest.mark.parametrize('status_code, body', [(500, {}), (429, {}), (200, {"success": False, "error": "bad key"}),
+                                               (200, {"reason": "RateLimited"})])
+def test_failures_are_not_cached(cached, status_code, body):
+    adapter = cached.answer(status_code, body)
+    lookup(cached)
+    lookup(cached)
+    assert cached.ttls == []
+    assert adapter.sent == 2
+
+
+@pytest.mark.parametrize('kind, target, normalized', [('ip', ' 2001:DB8:0:0::1 ', '2001:db8::1'), ('ip', 'not-an-ip', 'not-an-ip'),
+                                                      ('phone', '+1 (555) 010-0000', '+15550100000'),
+                                                      ('email', 'Someone@Example.COM', 'someone@example.com')])
+def test_normalize_target(kind, target, normalized):
+    assert app.normalize_target(kind, target) == normalized
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Tests for the Prometheus metrics exposition
+"""
+
+import json
+import re
+
+import app
+
+
+SAMPLE = re.compile(r'^([a-z_]+)(?:\{(.*)\})? (\S+)$')
+
+
+def parse(text):
+    """(name, labels, value) of every sample line, in order, and the # TYPE of each metric"""
+    samples, types = [], {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            name, kind = line[7:].split(' ')
+            types[name] = kind
+            continue
+        if line.startswith('#'):
+            continue
+        name, labels, value = SAMPLE.match(line).groups()
+        labels = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', labels or ''))
+        samples.append((name, labels, float(value)))
+    return samples, types
+
+
+def test_histogram_buckets_render_in_order_then_sum_and_count():
+    metrics = app.Metrics()
+    for source, seconds in (('Shodan', 0.003), ('Shodan', 0.3), ('Shodan', 7.0), ('Shodan', 90.0), ('Ipapi', 0.02)):
+        metrics.observe('osint_source_duration_seconds', {'source': source}, seconds)
+    samples, types = parse(metrics.render())
+    assert types['osint_source_duration_seconds'] == 'histogram'
+
+    for source, count, total in (('Ipapi', 1, 0.02), ('Shodan', 4, 97.303)):
+        lines = [(name, labels, value) for name, labels, value in samples if labels.get('source') == source]
+        bounds = [labels['le'] for name, labels, value in lines if name.endswith('_bucket')]
+        assert bounds == [str(bound) for bound in app.Metrics.BUCKETS] + ['+Inf']
+        assert [name for name, labels, value in lines[-3:]] == [
+            'osint_source_duration_seconds_bucket', 'osint_source_duration_seconds_sum',
+            'osint_source_duration_seconds_count']
+        counts = [value for name, labels, value in lines if name.endswith('_bucket')]
+        # Buckets are cumulative, and +Inf holds every observation
+        assert counts == sorted(counts)
+        assert counts[-1] == lines[-1][2] == count
+        assert abs(lines[-2][2] - total) < 1e-9
+    shodan = {labels['le']: value for name, labels, value in samples
+              if labels.get('source') == 'Shodan' and name.endswith('_bucket')}
+    assert (shodan['0.005'], shodan['0.25'], shodan['0.5'], shodan['10.0'], shodan['60.0']) == (1, 1, 2, 3, 3)
+
+
+def test_counters_gauges_and_cache_hit_ratio():
+    metrics = app.Metrics()
+    metrics.inc('osint_http_requests_total', {'endpoint': '/api/ip', 'method': 'POST', 'status': 200}, 3)
+    metrics.gauge_add('osint_http_requests_in_flight', {'endpoint': '/api/ip'})
+    for result in ('hit', 'hit', 'miss', 'hit'):
+        metrics.inc('osint_cache_requests_total', {'cache': 'lookup', 'result': result})
+    samples, types = parse(metrics.render())
+    assert ('osint_http_requests_total', {'endpoint': '/api/ip', 'method': 'POST', 'status': '200'}, 3) in samples
+    assert ('osint_http_requests_in_flight', {'endpoint': '/api/ip'}, 1) in samples
+    assert ('osint_cache_hit_ratio', {'cache': 'lookup'}, 0.75) in samples
+    assert types['osint_http_requests_total'] == 'counter'
+    assert types['osint_cache_hit_ratio'] == 'gauge'
+
+
+def test_snapshots_of_other_workers_are_added_up(tmp_path):
+    metrics = app.Metrics(str(tmp_path))
+    metrics.inc('osint_source_results_total', {'source': 'Shodan', 'outcome': 'success'})
+    metrics.observe('osint_upstream_duration_seconds', {'provider': 'shodan'}, 0.2)
+    # An exited worker: its counters and histograms still count, its gauges do not
+    exited = app.Metrics()
+    exited.inc('osint_source_results_total', {'source': 'Shodan', 'outcome': 'success'}, 2)
+    exited.observe('osint_upstream_duration_seconds', {'provider': 'shodan'}, 3.0)
+    exited.gauge_add('osint_upstream_requests_in_flight', {'provider': 'shodan'})
+    with open(tmp_path / 'metrics-999999999.json', 'w') as f:
+        json.dump(exited._snapshot(), f)
+
+    samples, types = parse(metrics.render())
+    values = {(name, tuple(sorted(labels.items()))): value for name, labels, value in samples}
+    assert values[('osint_source_results_total', (('outcome', 'success'), ('source', 'Shodan')))] == 3
+    assert values[('osint_upstream_duration_seconds_count', (('provider', 'shodan'),))] == 2
+    assert values[('osint_upstream_duration_seconds_bucket', (('le', '0.25'), ('provider', 'shodan')))] == 1
+    assert 'osint_upstream_requests_in_flight' not in types
+
+
+def test_metrics_endpoint_serves_the_text_format():
+    response = app.app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    parse(response.get_data(as_text=True))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Tests for sampled request profiling
+"""
+
+import os
+import pstats
+import tracemalloc
+
+import app
+
+
+def test_only_listed_routes_are_sampled(tmp_path):
+    profiler = app.Profiler(str(tmp_path), routes=['/api/image'], sample_rate=1.0)
+    assert profiler.sample('/api/image')
+    assert not profiler.sample('/api/ip')
+    assert not app.Profiler(str(tmp_path), routes=['/api/image'], sample_rate=0.0).sample('/api/image')
+    # Without a directory there is nowhere to write to
+    assert not app.Profiler(None, routes=['/api/image'], sample_rate=1.0).sample('/api/image')
+
+
+def allocate():
+    return [bytearray(1024) for _ in range(100)]
+
+
+def test_profiles_are_written_for_pstats_and_tracemalloc(tmp_path):
+    profiler = app.Profiler(str(tmp_path), routes=['/api/image'], sample_rate=1.0)
+    state = profiler.start()
+    kept = allocate()
+    profiler.stop(state, '/api/image')
+
+    files = sorted(os.listdir(tmp_path))
+    assert [os.path.splitext(f)[1] for f in files] == ['.pstats', '.tracemalloc']
+    assert all(f.startswith('api_image-') and state['id'] in f for f in files)
+    stats = pstats.Stats(str(tmp_path / files[0]))
+    assert any(function == 'allocate' for _, _, function in stats.stats)
+    snapshot = tracemalloc.Snapshot.load(str(tmp_path / files[1]))
+    assert any(frame.filename == __file__ for trace in snapshot.traces for frame in trace.traceback)
+    # Tracing was started for this request only
+    assert not tracemalloc.is_tracing()
+    assert profiler.stats()['profiled'] == 1
+    del kept
+
+
+def test_one_request_is_profiled_at_a_time(tmp_path):
+    profiler = app.Profiler(str(tmp_path), memory_frames=0)
+    state = profiler.start()
+    assert profiler.start() is None
+    profiler.stop(state, '/api/video')
+    assert [os.path.splitext(f)[1] for f in os.listdir(tmp_path)] == ['.pstats']
+    profiler.stop(profiler.start(), '/api/video')
+    assert profiler.stats()['profiled'] == 2
+
+
+def test_sampled_request_gets_a_profile_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'profiler', app.Profiler(str(tmp_path), routes=['/api/ip'], sample_rate=1.0))
+    client = app.app.test_client()
+    response = client.post('/api/ip?timeout=0', json={'ip_address': '192.0.2.1', 'ai': 'off'})
+    profile_id = response.headers['X-Profile-Id']
+    assert any(f.startswith('api_ip-') and f.endswith(f'-{profile_id}.pstats') for f in os.listdir(tmp_path))
+    assert 'X-Profile-Id' not in client.get('/api/status').headers
+    assert client.get('/api/status').get_json()['profiling'] == {
+        "enabled": True, "routes": ['/api/ip'], "sample_rate": 1.0, "profiled": 1}
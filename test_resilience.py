@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Tests for provider call resilience: coalescing, circuit breakers, deadlines, retries and rate limits
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+import app
+
+
+class RaisingAdapter(BaseAdapter):
+    """Transport adapter that fails every request with the given exception"""
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+        self.timeouts = []
+
+    def send(self, request, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        raise self.error
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'flaky', {'breaker_min_calls': 2, 'read_timeout': 10.0})
+    return app.OSINTToolManager()
+
+
+def mount(manager, error):
+    adapter = RaisingAdapter(error)
+    manager._session('flaky').mount('http://', adapter)
+    return adapter
+
+
+def test_provider_timeouts_open_the_breaker(manager):
+    mount(manager, requests.exceptions.ReadTimeout('read timed out'))
+    for _ in range(2):
+        with pytest.raises(app.SourceTimeout):
+            manager._send('flaky', 'GET', 'http://flaky.invalid/')
+    assert manager.breaker('flaky').state == 'open'
+
+
+def test_deadline_clipped_timeouts_do_not_count(manager):
+    adapter = mount(manager, requests.exceptions.ReadTimeout('read timed out'))
+    for _ in range(4):
+        with pytest.raises(app.SourceTimeout):
+            manager._send('flaky', 'GET', 'http://flaky.invalid/', deadline=app.Deadline(0.5))
+    assert adapter.timeouts[0][1] <= 0.5
+    snapshot = manager.breaker('flaky').snapshot()
+    assert snapshot['state'] == 'closed'
+    assert snapshot['calls'] == 0
+
+
+def test_connection_errors_count(manager):
+    mount(manager, requests.exceptions.ConnectionError('refused'))
+    for _ in range(2):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            manager._send('flaky', 'GET', 'http://flaky.invalid/')
+    assert manager.breaker('flaky').state == 'open'
+
+
+def test_abandoned_calls_do_not_count(manager):
+    mount(manager, KeyboardInterrupt())
+    breaker = manager.breaker('flaky')
+    breaker.state, breaker.opened_at = 'open', 0
+    with pytest.raises(KeyboardInterrupt):
+        manager._send('flaky', 'GET', 'http://flaky.invalid/')
+    # The half-open probe slot is handed back rather than reopening the breaker
+    assert breaker.state == 'half_open'
+    breaker.allow()
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = app.SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return app.ProviderResponse(200, b'{"ok": true}')
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        futures = [pool.submit(flight.do, 'ipapi:ip:1.2.3.4', fetch) for _ in range(5)]
+        while flight.stats()['coalesced'] < 4:
+            time.sleep(0.01)
+        release.set()
+        responses = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert sorted(response.coalesced for response in responses) == [False] + [True] * 4
+    assert all(response.json() == {"ok": True} for response in responses)
+    # Each caller has its own copy of the response
+    assert len({id(response) for response in responses}) == 5
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_single_flight_shares_errors_and_forgets_the_key():
+    flight = app.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise requests.exceptions.ConnectionError('refused')
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, 'key', fail)
+        started.wait(5)
+        follower = pool.submit(flight.do, 'key', fail)
+        while flight.stats()['coalesced'] < 1:
+            time.sleep(0.01)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                future.result()
+    assert flight.do('key', lambda: app.ProviderResponse(200, b'{}')).status_code == 200
+
+
+def test_single_flight_follower_gives_up_at_its_deadline():
+    flight = app.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return app.ProviderResponse(200, b'{}')
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(flight.do, 'key', slow)
+        started.wait(5)
+        with pytest.raises(app.SourceTimeout):
+            flight.do('key', slow, deadline=app.Deadline(0.05))
+        release.set()
+        assert leader.result().status_code == 200
+
+
+def test_coalesced_responses_keep_the_leaders_meta():
+    manager = app.OSINTToolManager()
+    started, release = threading.Event(), threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        return app.ProviderResponse(200, b'{}', cached_at=None, retries=2)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(manager.single_flight.do, 'key', fetch)
+        started.wait(5)
+        follower = pool.submit(manager.single_flight.do, 'key', fetch)
+        while manager.single_flight.stats()['coalesced'] < 1:
+            time.sleep(0.01)
+        release.set()
+        responses = [leader.result(), follower.result()]
+    assert manager._with_meta({}, responses[0])['meta'] == {"cache": "miss", "retries": 2}
+    assert manager._with_meta({}, responses[1])['meta'] == {"cache": "miss", "coalesced": True, "retries": 2}
+
+@pytest.fixture
+def breaker(monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'fragile', {'breaker_window': 4, 'breaker_min_calls': 4,
+                                                          'breaker_failure_rate': 0.5, 'breaker_open_seconds': 30.0})
+    return app.CircuitBreaker('fragile')
+
+
+def test_breaker_opens_at_failure_rate_after_min_calls(breaker):
+    for ok in (False, False, True):
+        breaker.allow()
+        breaker.record(ok)
+    # Two failures in three calls, but fewer than breaker_min_calls
+    assert breaker.state == 'closed'
+    breaker.allow()
+    breaker.record(True)
+    assert breaker.state == 'open'
+    with pytest.raises(app.CircuitOpen):
+        breaker.allow()
+    assert breaker.snapshot()['rejected'] == 1
+
+
+def open_breaker(breaker):
+    for _ in range(4):
+        breaker.allow()
+        breaker.record(False)
+    assert breaker.state == 'open'
+    # As if breaker_open_seconds had passed
+    breaker.opened_at -= 30
+
+
+def test_half_open_lets_one_probe_through(breaker):
+    open_breaker(breaker)
+    breaker.allow()
+    assert breaker.state == 'half_open'
+    with pytest.raises(app.CircuitOpen):
+        breaker.allow()
+
+
+def test_successful_probe_closes(breaker):
+    open_breaker(breaker)
+    breaker.allow()
+    breaker.record(True)
+    assert breaker.snapshot() == {"state": "closed", "calls": 0, "failure_rate": 0.0, "opened": 1, "rejected": 0}
+
+
+def test_failed_probe_reopens(breaker):
+    open_breaker(breaker)
+    breaker.allow()
+    breaker.record(False)
+    assert breaker.state == 'open'
+    assert breaker.opened == 2
+    with pytest.raises(app.CircuitOpen):
+        breaker.allow()
+
+
+def test_released_probe_frees_the_slot(breaker):
+    open_breaker(breaker)
+    breaker.allow()
+    breaker.release()
+    breaker.allow()
+    assert breaker.state == 'half_open'
+
+
+class ScriptedAdapter(BaseAdapter):
+    """Transport adapter answering requests from a list of status codes, (status, headers) and exceptions"""
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = list(script)
+        self.methods = []
+
+    def send(self, request, **kwargs):
+        self.methods.append(request.method)
+        outcome = self.script.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        if isinstance(outcome, tuple):
+            outcome, headers = outcome
+            response.headers.update(headers)
+        response.status_code = outcome
+        response._content = b'{}'
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def retrying(monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'retrying', {'retries': 2, 'retry_backoff': 0.0, 'breaker_min_calls': 100})
+    manager = app.OSINTToolManager()
+
+    def script(*outcomes):
+        adapter = ScriptedAdapter(outcomes)
+        manager._session('retrying').mount('http://', adapter)
+        return adapter
+
+    manager.script = script
+    return manager
+
+
+def test_idempotent_requests_retry_5xx(retrying):
+    adapter = retrying.script(503, 502, 200)
+    response = retrying._request('retrying', 'GET', 'http://retrying.invalid/')
+    assert response.status_code == 200
+    assert response.retries == 2
+    assert adapter.methods == ['GET'] * 3
+
+
+def test_retries_stop_at_the_limit(retrying):
+    retrying.script(503, 503, 503, 200)
+    response = retrying._request('retrying', 'GET', 'http://retrying.invalid/')
+    assert response.status_code == 503
+    assert response.retries == 2
+
+
+def test_non_idempotent_requests_do_not_retry_5xx(retrying):
+    adapter = retrying.script(503, 200)
+    assert retrying._request('retrying', 'POST', 'http://retrying.invalid/').status_code == 503
+    assert len(adapter.methods) == 1
+
+
+def test_429_is_retried_for_any_method(retrying):
+    retrying.script(429, 200)
+    assert retrying._request('retrying', 'POST', 'http://retrying.invalid/').status_code == 200
+
+
+def test_connection_errors_retry_only_when_idempotent(retrying):
+    retrying.script(requests.exceptions.ConnectionError('reset'), 200)
+    assert retrying._request('retrying', 'GET', 'http://retrying.invalid/').status_code == 200
+    retrying.script(requests.exceptions.ConnectionError('reset'), 200)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        retrying._request('retrying', 'POST', 'http://retrying.invalid/')
+
+
+def test_retry_log_masks_api_keys_in_urls(retrying, caplog):
+    error = requests.exceptions.ConnectionError(
+        "HTTPSConnectionPool(host='retrying.invalid'): Max retries exceeded with url: /v1?access_key=s3cret&number=1")
+    retrying.script(error, 200)
+    with caplog.at_level('INFO', logger=app.logger.name):
+        retrying._request('retrying', 'GET', 'http://retrying.invalid/v1?access_key=s3cret&number=1')
+    message = caplog.records[-1].getMessage()
+    assert 'attempt 2 of 3' in message
+    assert 'ConnectionError' in message
+    assert 'access_key=[redacted]&number=1' in message
+    assert 's3cret' not in message
+
+
+@pytest.mark.parametrize('text, redacted', [('/models/m:generateContent?key=AIza-1', '/models/m:generateContent?key=[redacted]'),
+                                            ("/shodan/host/1.2.3.4?minify=1&KEY=abc'", "/shodan/host/1.2.3.4?minify=1&KEY=[redacted]'"),
+                                            ('/search?monkey=1&q=key=2', '/search?monkey=1&q=key=2')])
+def test_redact_url_secrets(text, redacted):
+    assert app.redact_url_secrets(text) == redacted
+
+
+def test_token_bucket_refills_at_the_rate_up_to_the_burst():
+    # Empty bucket refilling at 2 tokens per second
+    assert app.token_bucket(0.0, 0.0, 0.25, rate=2.0, burst=5.0) == (0.5, 0.25)
+    assert app.token_bucket(0.0, 0.0, 0.5, rate=2.0, burst=5.0) == (0.0, 0.0)
+    # However long it sat idle, at most a burst is available
+    assert app.token_bucket(0.0, 0.0, 100.0, rate=2.0, burst=5.0) == (4.0, 0.0)
+
+
+def test_token_bucket_penalty_pauses_until_retry_after():
+    tokens, wait = app.token_bucket(5.0, 0.0, 0.0, rate=1.0, burst=5.0, penalty=3.0)
+    assert wait == 3.0
+    assert app.token_bucket(tokens, 0.0, 2.0, rate=1.0, burst=5.0)[1] == pytest.approx(1.0)
+    assert app.token_bucket(tokens, 0.0, 3.0, rate=1.0, burst=5.0)[1] == 0.0
+
+
+def test_rate_limit_refuses_waits_past_the_deadline(monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'metered', {'rate_limit': 0.5, 'burst': 1.0})
+    limiter = app.RateLimiter()
+    limiter.acquire('metered', app.Deadline(1))
+    # The next token is two seconds away
+    with pytest.raises(app.SourceTimeout):
+        limiter.acquire('metered', app.Deadline(1))
+    stats = limiter.stats()['metered']
+    assert (stats['requests'], stats['rejected'], stats['rate_limit'], stats['burst']) == (1, 1, 0.5, 1.0)
+
+
+def test_status_reports_provider_quota_headers(monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'quota', {'retries': 0})
+    adapter = ScriptedAdapter([(200, {'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '41'}),
+                               (429, {'Retry-After': '0', 'RateLimit-Remaining': '0'})])
+    app.osint_manager._session('quota').mount('http://', adapter)
+    for status_code in (200, 429):
+        assert app.osint_manager._request('quota', 'GET', 'http://quota.invalid/').status_code == status_code
+        stats = app.app.test_client().get('/api/status').get_json()['rate_limits']['quota']
+        if status_code == 200:
+            assert (stats['quota']['limit'], stats['quota']['remaining']) == ('100', '41')
+    # The latest headers replace the earlier ones, and the 429 is counted
+    assert stats['quota']['remaining'] == '0'
+    assert 'limit' not in stats['quota']
+    assert stats['throttled'] == 1
+    assert stats['requests'] == 2
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-request timings breakdown (?timings=1)
+"""
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+import app
+
+
+class BodyAdapter(BaseAdapter):
+    """Transport adapter answering every request with a 200 and the given body"""
+
+    def __init__(self, body):
+        super().__init__()
+        self.body = body
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = self.body
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def timings():
+    timings = app.RequestTimings()
+    token = app.REQUEST_TIMINGS.set(timings)
+    yield timings
+    app.REQUEST_TIMINGS.reset(token)
+
+
+def test_sources_record_upstream_traffic(timings, monkeypatch):
+    monkeypatch.setitem(app.PROVIDER_SETTINGS, 'timed', {'retries': 0})
+    manager = app.OSINTToolManager()
+    manager._session('timed').mount('https://', BodyAdapter(b'{"org": "Example"}'))
+
+    def lookup(deadline=None):
+        for _ in range(2):
+            manager._request('timed', 'GET', 'https://timed.invalid/', deadline=deadline)
+        return {"success": True, "data": {}, "meta": {"cache": "miss"}}
+
+    def broken(deadline=None):
+        raise app.SourceTimeout('too slow')
+
+    manager._fan_out({}, {'Lookup': (lookup,), 'Broken': (broken,)}, app.Deadline(10))
+    lookup_entry = timings.as_dict()['sources']['Lookup']
+    assert lookup_entry['upstream_requests'] == 2
+    assert lookup_entry['bytes'] == 2 * len(b'{"org": "Example"}')
+    assert lookup_entry['cache'] == 'miss'
+    assert lookup_entry['wall_ms'] >= lookup_entry['upstream_ms'] >= 0
+    assert lookup_entry['queued_ms'] >= 0
+    broken_entry = timings.as_dict()['sources']['Broken']
+    assert broken_entry['outcome'] == 'timeout'
+    assert broken_entry['upstream_requests'] == 0
+
+
+def test_sources_past_the_deadline_are_timed_out(timings):
+    manager = app.OSINTToolManager()
+
+    def slow(deadline=None):
+        app.time.sleep(0.5)
+        return {"success": True, "data": {}}
+
+    manager._fan_out({}, {'Slow': (slow,)}, app.Deadline(0.05))
+    entry = timings.as_dict()['sources']['Slow']
+    assert entry['outcome'] == 'timeout'
+    assert entry['wall_ms'] >= 50
+
+
+def test_timings_section_only_when_asked():
+    client = app.app.test_client()
+    body = client.post('/api/ip?timeout=0', json={'ip_address': '192.0.2.1', 'ai': 'off'}).get_json()
+    assert 'timings' not in body
+
+    body = client.post('/api/ip?timeout=0&timings=1', json={'ip_address': '192.0.2.1', 'ai': 'off'}).get_json()
+    timings = body['timings']
+    assert set(timings['sources']) == {'IP_Geolocation', 'Shodan_IP_Search'}
+    assert timings['sources']['IP_Geolocation']['outcome'] == 'timeout'
+    assert timings['total_ms'] >= timings['lookups']['wall_ms']
+    assert 'ai_analysis' not in timings
+    # The request's timings do not leak into the next one
+    assert app.REQUEST_TIMINGS.get() is None
+
+
+def test_inline_analysis_is_timed(monkeypatch):
+    monkeypatch.setattr(app.osint_manager, 'route_ai_api', lambda *args, **kwargs: {
+        "analysis": "looks benign", "meta": {"provider": "openai", "cache": "hit"}})
+    client = app.app.test_client()
+    body = client.post('/api/ip?timeout=0&timings=1', json={'ip_address': '192.0.2.1', 'ai': 'inline'}).get_json()
+    assert body['timings']['ai_analysis']['provider'] == 'openai'
+    assert body['timings']['ai_analysis']['cache'] == 'hit'
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Tests for upload handling: spooling, limits, content-addressed storage and memoized analysis
+"""
+
+import hashlib
+import io
+import json
+import os
+import sys
+import zlib
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = app.OSINTToolManager()
+    manager.blob_store = None
+    ttls = []
+    monkeypatch.setattr(manager.upload_cache, 'set', lambda key, response, ttl: ttls.append(ttl))
+    manager.ttls = ttls
+    return manager
+
+
+def test_successful_analysis_is_kept_for_upload_cache_ttl(manager):
+    manager._memoized_upload('test', b'fine', lambda media: {"A": {"success": True, "data": {}}})
+    assert manager.ttls == [app.UPLOAD_CACHE_TTL]
+
+
+def test_failed_analysis_is_kept_briefly(manager):
+    results = manager._memoized_upload('test', b'broken', lambda media: {
+        "A": {"success": True, "data": {}},
+        "B": {"success": False, "error": "Metadata extraction failed: read error"}
+    })
+    assert results['B']['error'] == "Metadata extraction failed: read error"
+    assert manager.ttls == [app.UPLOAD_NEGATIVE_TTL]
+
+
+def test_failures_that_would_repeat_keep_the_full_ttl(manager):
+    manager._memoized_upload('test', b'unsupported', lambda media: {
+        "A": {"success": True, "data": {}},
+        "B": {"success": False, "error": "MoviePy not available", "retryable": False}
+    })
+    assert manager.ttls == [app.UPLOAD_CACHE_TTL]
+
+
+def test_unreadable_image_format_is_not_retried(manager):
+    results = manager.image_osint(b'not an image at all')
+    assert all(envelope['retryable'] is False for envelope in results.values())
+    assert manager.ttls == [app.UPLOAD_CACHE_TTL]
+
+
+def test_failed_image_read_is_retried(manager, monkeypatch):
+    def unreadable(source):
+        raise OSError('read error')
+
+    monkeypatch.setattr(app.Image, 'open', unreadable)
+    results = manager.image_osint(b'\x89PNG')
+    assert results['Image_Analysis'] == {"success": False, "error": "read error", "meta": {"cache": "miss"}}
+    assert manager.ttls == [app.UPLOAD_NEGATIVE_TTL]
+
+
+def test_video_without_moviepy_keeps_the_full_ttl(manager, monkeypatch):
+    monkeypatch.setattr(app, 'MOVIEPY_AVAILABLE', False)
+    monkeypatch.setitem(sys.modules, 'moviepy', None)
+    results = manager.video_osint(b'\0\0\0\x18ftypmp42')
+    assert results['Video_Metadata']['retryable'] is False
+    assert manager.ttls == [app.UPLOAD_CACHE_TTL]
+
+
+def test_installing_moviepy_changes_the_video_cache_key(manager, monkeypatch):
+    keys = []
+    monkeypatch.setattr(manager.upload_cache, 'get', lambda key: keys.append(key))
+    monkeypatch.setattr(manager, '_video_osint', lambda video: {})
+    for available in (False, True):
+        monkeypatch.setattr(app, 'MOVIEPY_AVAILABLE', available)
+        manager.video_osint(b'video')
+    assert keys[0] != keys[1]
+
+
+def test_spool_stays_in_memory_below_threshold():
+    spool = app.UploadSpool(threshold=16)
+    spool.write(b'0123456789')
+    assert spool.path is None
+    assert spool.view() == b'0123456789'
+    assert spool.size_bytes == 10
+
+
+def test_spool_rolls_over_to_disk_and_hashes_as_it_goes(tmp_path):
+    spool = app.UploadSpool(threshold=16, directory=str(tmp_path), suffix='.mp4')
+    content = b'x' * 10 + b'y' * 20
+    spool.write(content[:10])
+    spool.write(content[10:])
+    assert spool.path.endswith('.mp4')
+    with open(spool.on_disk(), 'rb') as f:
+        assert f.read() == content
+    assert bytes(spool.view()) == content
+    assert app.upload_fingerprint(spool) == {"sha256": hashlib.sha256(content).hexdigest(),
+                                             "crc32": f"{zlib.crc32(content):08x}", "size_bytes": 30}
+    spool.close()
+    assert not os.path.exists(spool.path)
+
+
+def test_detached_spool_outlives_the_original(tmp_path):
+    spool = app.UploadSpool(directory=str(tmp_path))
+    spool.write(b'small upload')
+    detached = spool.detach()
+    spool.close()
+    assert os.path.exists(detached.path)
+    assert detached.sha256 == hashlib.sha256(b'small upload').hexdigest()
+    detached.close()
+    assert not os.listdir(tmp_path)
+
+
+def test_upload_over_the_endpoint_limit_is_refused(monkeypatch):
+    monkeypatch.setitem(app.UPLOAD_LIMITS, '/api/face', 1024)
+    client = app.app.test_client()
+    response = client.post('/api/face', data={'image': (io.BytesIO(b'\0' * 4096), 'big.png'), 'ai': 'off'})
+    assert response.status_code == 413
+    assert '1024' in response.get_json()['error']
+
+
+def test_blob_store_keeps_each_content_once(tmp_path):
+    store = app.BlobStore(str(tmp_path / 'blobs'))
+    sha256 = hashlib.sha256(b'content').hexdigest()
+    path = store.put(b'content', sha256)
+    assert path == str(tmp_path / 'blobs' / sha256[:2] / sha256)
+    assert store.put(b'content', sha256) == path
+    with open(path, 'rb') as f:
+        assert f.read() == b'content'
+    assert store.stats()['stored'] == 1
+    assert store.stats()['deduplicated'] == 1
+
+
+def test_blob_store_links_spooled_uploads(tmp_path):
+    spool = app.UploadSpool(threshold=0, directory=str(tmp_path))
+    spool.write(b'video frames')
+    path = app.BlobStore(str(tmp_path / 'blobs')).put(spool, spool.sha256)
+    assert os.path.samefile(path, spool.path)
+    spool.close()
+    with open(path, 'rb') as f:
+        assert f.read() == b'video frames'
+
+
+@pytest.mark.parametrize('threshold', [1024, 0])
+def test_spool_reads_line_by_line(tmp_path, threshold):
+    spool = app.UploadSpool(threshold=threshold, directory=str(tmp_path))
+    spool.write(b'"192.0.2.1"\n"192.0.2.2"\n')
+    spool.seek(0)
+    assert spool.readline() == b'"192.0.2.1"\n'
+    spool.seek(0)
+    assert list(spool) == [b'"192.0.2.1"\n', b'"192.0.2.2"\n']
+    spool.close()
+
+
+def test_empty_spool_on_disk_has_an_empty_view(tmp_path):
+    spool = app.UploadSpool(directory=str(tmp_path))
+    spool.on_disk()
+    assert spool.view() == b''
+    spool.close()
+
+
+def test_ndjson_batch_file_upload(monkeypatch):
+    monkeypatch.setattr(app.osint_manager, 'investigate',
+                        lambda kind, target, *args, **kwargs: {"Echo": {"success": True, "data": {"target": target}}})
+    client = app.app.test_client()
+    ndjson = b'"192.0.2.1"\n{"ip_address": "192.0.2.2"}\n\n192.0.2.1\n'
+    response = client.post('/api/batch/ip', data={'file': (io.BytesIO(ndjson), 'targets.ndjson')})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(line['target'] for line in lines) == ['192.0.2.1', '192.0.2.2']
+    assert all(line['results']['Echo']['success'] for line in lines)